@@ -424,8 +424,12 @@ class Inference(BaseModel):
     cost: float
     response: str
     total_tokens: int
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
     created_at: datetime
     finished_at: Optional[datetime]
+    # Set when part of the stored message history (a blob or an ancestor inference) is missing
+    messages_incomplete: bool = False
 
 class EvaluationQueueItem(BaseModel):
     model_config = {
@@ -94,10 +94,27 @@ CREATE TABLE IF NOT EXISTS inferences (
     cost FLOAT,
     response TEXT,
     total_tokens INT,
+    prompt_tokens INT,
+    completion_tokens INT,
     created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     finished_at TIMESTAMPTZ
 );
 
+-- Add prompt/completion token columns if they don't exist (for existing tables)
+ALTER TABLE inferences ADD COLUMN IF NOT EXISTS prompt_tokens INT;
+ALTER TABLE inferences ADD COLUMN IF NOT EXISTS completion_tokens INT;
+
+-- Delta-encoded message histories: messages holds only the messages appended after the first
+-- message_offset messages of parent_id (an earlier inference of the same run); contents stored
+-- once in inference_message_blobs appear as {"role": ..., "content_ref": <sha256>}
+ALTER TABLE inferences ADD COLUMN IF NOT EXISTS parent_id UUID;
+ALTER TABLE inferences ADD COLUMN IF NOT EXISTS message_offset INT NOT NULL DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS inference_message_blobs (
+    hash TEXT PRIMARY KEY,
+    content TEXT NOT NULL
+);
+
 CREATE TABLE IF NOT EXISTS approved_version_ids (
     version_id UUID PRIMARY KEY REFERENCES miner_agents(version_id)
 );
@@ -142,6 +159,26 @@ CREATE TRIGGER tr_update_evaluation_score
     FOR EACH ROW
     EXECUTE FUNCTION update_evaluation_score();
 
+-- Function to broadcast evaluation run status changes (consumed by the proxy's admission cache)
+CREATE OR REPLACE FUNCTION notify_evaluation_run_status()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify(
+        'evaluation_run_status',
+        json_build_object('run_id', NEW.run_id, 'status', NEW.status)::text
+    );
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Trigger to notify listeners when an evaluation run changes status
+DROP TRIGGER IF EXISTS tr_notify_evaluation_run_status ON evaluation_runs;
+CREATE TRIGGER tr_notify_evaluation_run_status
+    AFTER UPDATE OF status ON evaluation_runs
+    FOR EACH ROW
+    WHEN (OLD.status IS DISTINCT FROM NEW.status)
+    EXECUTE FUNCTION notify_evaluation_run_status();
+
 -- Performance optimization indices for evaluations queries
 
 -- Primary composite index for main query filtering and ordering
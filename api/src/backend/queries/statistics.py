@@ -1,3 +1,4 @@
+import json
 from typing import Any, Optional
 from datetime import datetime
 
@@ -7,6 +8,9 @@ import asyncpg
 
 from api.src.backend.db_manager import db_operation
 from api.src.backend.entities import MinerAgent, Inference, MinerAgentWithScores
+from loggers.logging_utils import get_logger
+
+logger = get_logger(__name__)
 
 @db_operation
 async def get_24_hour_statistics(conn: asyncpg.Connection) -> dict[str, Any]:
@@ -98,20 +102,93 @@ async def get_queue_position_by_hotkey(conn: asyncpg.Connection, miner_hotkey: s
 
     return [QueuePositionPerValidator(**dict(row)) for row in results]
 
+async def reconstruct_inference_messages(
+    conn: asyncpg.Connection, rows: list
+) -> tuple[dict[UUID, list[dict]], set[UUID]]:
+    """
+    Rebuild full message lists for delta-encoded inference rows.
+
+    Each row stores only the messages appended after the first `message_offset`
+    messages of its `parent_id`, with large contents replaced by `content_ref`
+    hashes into inference_message_blobs. `rows` must include every ancestor of
+    the rows being rebuilt (all rows of a run do).
+
+    Returns the messages by inference id and the ids whose history could not be
+    fully rebuilt (a missing blob or ancestor, also in any ancestor); their
+    message lists lack the missing parts and must not be presented as complete.
+    """
+    by_id = {row['id']: row for row in rows}
+    deltas = {row['id']: json.loads(row['messages']) if isinstance(row['messages'], str) else row['messages']
+              for row in rows}
+
+    refs = {message['content_ref'] for delta in deltas.values() for message in delta if 'content_ref' in message}
+    blobs = {}
+    if refs:
+        blob_rows = await conn.fetch(
+            "SELECT hash, content FROM inference_message_blobs WHERE hash = ANY($1::text[])", list(refs)
+        )
+        blobs = {blob['hash']: blob['content'] for blob in blob_rows}
+    missing_blobs = refs - blobs.keys()
+    if missing_blobs:
+        logger.warning(f"{len(missing_blobs)} inference message blobs are missing: {sorted(missing_blobs)[:5]}")
+
+    def resolve(message: dict) -> dict:
+        if 'content_ref' in message:
+            return {'role': message['role'], 'content': blobs.get(message['content_ref'], '')}
+        return message
+
+    full: dict[UUID, list[dict]] = {}
+    incomplete: set[UUID] = set()
+    for row_id in by_id:
+        # Walk up to the nearest already-rebuilt ancestor, then rebuild back down (chains can be long)
+        chain = []
+        current = row_id
+        while current is not None and current not in full:
+            chain.append(current)
+            parent_id = by_id[current]['parent_id']
+            current = parent_id if parent_id in by_id else None
+        for chain_id in reversed(chain):
+            row = by_id[chain_id]
+            parent_id = row['parent_id']
+            prefix = full[parent_id][:row['message_offset']] if parent_id in full else []
+            full[chain_id] = prefix + [resolve(message) for message in deltas[chain_id]]
+            if parent_id is not None and parent_id not in full:
+                logger.warning(
+                    f"Inference {chain_id} inherits {row['message_offset']} messages from missing inference {parent_id}"
+                )
+                incomplete.add(chain_id)
+            elif parent_id in incomplete or any(
+                message.get('content_ref') in missing_blobs for message in deltas[chain_id]
+            ):
+                incomplete.add(chain_id)
+    return full, incomplete
+
 @db_operation
 async def get_inference_details_for_run(conn: asyncpg.Connection, run_id: str) -> list[Inference]:
     runs = await conn.fetch("""
         select 
-            id, run_id, 
-            (SELECT message->>'content' FROM jsonb_array_elements(messages) WITH ORDINALITY AS t(message, index) 
-             WHERE message->>'role' = 'user' 
-             ORDER BY index DESC LIMIT 1) as message, 
-            temperature, model, cost, response, total_tokens, created_at, finished_at 
+            id, run_id, messages, parent_id, message_offset,
+            temperature, model, cost, response, total_tokens, prompt_tokens, completion_tokens,
+            created_at, finished_at 
         from inferences 
         where run_id = $1;
     """, run_id)
 
-    return [Inference(**dict(run)) for run in runs]
+    messages_by_id, incomplete = await reconstruct_inference_messages(conn, runs)
+
+    inferences = []
+    for run in runs:
+        row = dict(run)
+        messages = messages_by_id[run['id']]
+        for key in ('messages', 'parent_id', 'message_offset'):
+            row.pop(key)
+        row['messages_incomplete'] = run['id'] in incomplete
+        # The dashboard shows the latest user message of each call
+        row['message'] = next(
+            (message['content'] for message in reversed(messages) if message['role'] == 'user'), None
+        )
+        inferences.append(Inference(**row))
+    return inferences
 
 @db_operation
 async def get_agent_scores_over_time(conn: asyncpg.Connection, set_id: Optional[int] = None) -> list[dict]:
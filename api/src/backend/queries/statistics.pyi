@@ -2,6 +2,7 @@ from typing import Any, Optional
 from datetime import datetime
 from uuid import UUID
 
+import asyncpg
 from pydantic import BaseModel
 from api.src.backend.entities import MinerAgent, Inference
 
@@ -24,6 +25,7 @@ class QueuePositionPerValidator(BaseModel):
     queue_position: int
 
 async def get_queue_position_by_hotkey(miner_hotkey: str) -> list[QueuePositionPerValidator]: ...
+async def reconstruct_inference_messages(conn: asyncpg.Connection, rows: list) -> tuple[dict[UUID, list[dict]], set[UUID]]: ...
 async def get_inference_details_for_run(run_id: str) -> list[Inference]: ...
 
 async def get_agent_scores_over_time(set_id: Optional[int] = None) -> list[dict]: ...
\ No newline at end of file
@@ -23,9 +23,11 @@ from .models import (
     EvaluationRun,
     GPTMessage,
     EmbeddingRequest,
+    EmbeddingBatchRequest,
     InferenceRequest,
     Embedding,
     Inference,
+    RunState,
 )
 
 # Database
@@ -38,11 +40,40 @@ from .database import (
     update_inference,
     get_total_embedding_cost,
     get_total_inference_cost,
+    write_queue,
     DBManager,
 )
 
+# Message history encoding
+from .message_history import MessageHistoryEncoder, message_history
+
+# Admission cache
+from .run_cache import RunAdmissionCache, run_cache
+
+# Response cache
+from .response_cache import ResponseCache, response_cache
+
+# Embedding cache
+from .embedding_cache import EmbeddingCache, embedding_cache
+
+# Request limiter
+from .shared_state import SharedRunStore, shared_run_store
+from .rate_limiter import RateLimitExceeded, RequestLimiter, request_limiter
+
+# Metrics
+from .metrics import ProxyMetrics, metrics
+
+# Provider routing
+from .providers import Provider, ProviderRouter, UpstreamError, provider_router
+
+# Token estimation
+from .tokenizer import PromptPlan, PromptRejected, TokenEstimator, token_estimator
+
+# Request coalescing
+from .single_flight import InflightCompletion
+
 # Chutes client
-from .chutes_client import ChutesClient
+from .chutes_client import ChutesClient, InferenceError
 
 # Configuration
 from .config import (
@@ -63,9 +94,11 @@ __all__ = [
     "EvaluationRun", 
     "GPTMessage",
     "EmbeddingRequest",
+    "EmbeddingBatchRequest",
     "InferenceRequest",
     "Embedding",
     "Inference",
+    "RunState",
     
     # Database
     "db_manager",
@@ -75,10 +108,54 @@ __all__ = [
     "create_inference",
     "update_inference",
     "get_total_cost_for_run",
+    "write_queue",
     "DBManager",
     
+    # Message history encoding
+    "MessageHistoryEncoder",
+    "message_history",
+    
+    # Admission cache
+    "RunAdmissionCache",
+    "run_cache",
+    
+    # Response cache
+    "ResponseCache",
+    "response_cache",
+    
+    # Embedding cache
+    "EmbeddingCache",
+    "embedding_cache",
+    
+    # Request limiter
+    "RateLimitExceeded",
+    "RequestLimiter",
+    "request_limiter",
+    "SharedRunStore",
+    "shared_run_store",
+    
+    # Metrics
+    "ProxyMetrics",
+    "metrics",
+    
+    # Provider routing
+    "Provider",
+    "ProviderRouter",
+    "UpstreamError",
+    "provider_router",
+    
+    # Token estimation
+    "PromptPlan",
+    "PromptRejected",
+    "TokenEstimator",
+    "token_estimator",
+    
+    # Request coalescing
+    "InflightCompletion",
+    
     # Client
     "ChutesClient",
+    "InferenceError",
     
     # Config
     "CHUTES_API_KEY",
@@ -1,8 +1,9 @@
+import asyncio
 import json
 import logging
 import random
 import time
-from typing import Dict, List, Any
+from typing import AsyncIterator, Dict, List, Any, Optional, Tuple, Union
 from uuid import UUID
 
 import httpx
@@ -10,10 +11,22 @@ import httpx
 from proxy.config import (
     CHUTES_API_KEY,
     CHUTES_EMBEDDING_URL,
-    CHUTES_INFERENCE_URL,
+    CHUTES_HTTP2,
+    CHUTES_MAX_CONNECTIONS,
+    CHUTES_MAX_KEEPALIVE_CONNECTIONS,
+    CHUTES_KEEPALIVE_EXPIRY,
+    CHUTES_CONNECT_TIMEOUT,
+    CHUTES_POOL_TIMEOUT,
+    CHUTES_EMBEDDING_TIMEOUT,
+    CHUTES_INFERENCE_READ_TIMEOUT,
     EMBEDDING_PRICE_PER_SECOND,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_BATCH_CONCURRENCY,
     MODEL_PRICING,
     DEFAULT_MODEL,
+    DEFAULT_MAX_TOKENS,
+    COALESCE_ENABLED,
+    COALESCE_COST_FACTOR,
     ENV,
 )
 from proxy.models import GPTMessage
@@ -23,63 +36,162 @@ from proxy.database import (
     create_inference,
     update_inference,
 )
+from proxy.run_cache import run_cache
+from proxy.response_cache import ResponseCache, response_cache
+from proxy.single_flight import InflightCompletion
+from proxy.embedding_cache import embedding_cache
+from proxy.rate_limiter import request_limiter
+from proxy.tokenizer import token_estimator
+from proxy.providers import UpstreamError, provider_router
+from proxy.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
 
+class InferenceError(Exception):
+    """Raised when an inference request cannot be completed"""
+
+
 class ChutesClient:
     """Client for interacting with Chutes API services"""
 
     def __init__(self):
         self.api_key = CHUTES_API_KEY
+        self.client: Optional[httpx.AsyncClient] = None
+        # In-flight deterministic completions, keyed like the response cache
+        self._flights: Dict[str, InflightCompletion] = {}
 
         if not self.api_key:
             logger.warning("CHUTES_API_KEY not found in environment variables")
 
-    async def embed(self, run_id: UUID = None, input_text: str = None) -> Dict[str, Any]:
-        """Get embedding for text input"""
+    async def open(self) -> None:
+        """Initialize the shared upstream connection pool"""
+        self.client = httpx.AsyncClient(
+            http2=CHUTES_HTTP2,
+            limits=httpx.Limits(
+                max_connections=CHUTES_MAX_CONNECTIONS,
+                max_keepalive_connections=CHUTES_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=CHUTES_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(CHUTES_EMBEDDING_TIMEOUT, connect=CHUTES_CONNECT_TIMEOUT, pool=CHUTES_POOL_TIMEOUT),
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json",
+            },
+        )
+        logger.info(
+            f"Chutes HTTP client initialized (http2={CHUTES_HTTP2}, "
+            f"max_connections={CHUTES_MAX_CONNECTIONS}, keepalive={CHUTES_MAX_KEEPALIVE_CONNECTIONS})"
+        )
+
+    async def close(self) -> None:
+        """Gracefully close the upstream connection pool"""
+        if self.client:
+            await self.client.aclose()
+            self.client = None
+            logger.info("Chutes HTTP client closed")
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if not self.client:
+            raise RuntimeError("Chutes HTTP client is not initialized yet.")
+        return self.client
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Snapshot of the upstream connection pool for the health endpoint.
+
+        Connection counts are None when the pool internals cannot be read.
+        """
+        if not self.client:
+            return {"open": False}
+
+        connections = self._pool_connections()
+        stats = {
+            "open": True,
+            "http2": CHUTES_HTTP2,
+            "max_connections": CHUTES_MAX_CONNECTIONS,
+            "max_keepalive_connections": CHUTES_MAX_KEEPALIVE_CONNECTIONS,
+            "connections": None,
+            "idle_connections": None,
+            "http2_connections": None,
+        }
+        if connections is not None:
+            try:
+                stats.update(
+                    connections=len(connections),
+                    idle_connections=sum(1 for c in connections if c.is_idle()),
+                    http2_connections=sum(1 for c in connections if c.info().startswith("HTTP/2")),
+                )
+            except (AttributeError, TypeError):
+                pass
+        return stats
+
+    def _pool_connections(self) -> Optional[List[Any]]:
+        """Connections of the underlying httpcore pool, or None if this httpx version hides them"""
+        # httpx does not expose pool state publicly, so this reads the transport's private httpcore pool
+        try:
+            return list(self.client._transport._pool.connections)
+        except (AttributeError, TypeError):
+            return None
+
+    def estimate_embedding_cost(self, upstream_calls: int) -> float:
+        """Worst-case cost of `upstream_calls` embedding calls, each billed by time up to its timeout"""
+        return upstream_calls * CHUTES_EMBEDDING_TIMEOUT * EMBEDDING_PRICE_PER_SECOND
+
+    async def embed(self, run_id: UUID = None, input_text: Union[str, List[str]] = None) -> Dict[str, Any]:
+        """Get embedding for text input (a single text or a list of texts embedded in one call)"""
+
+        if isinstance(input_text, str):
+            cached = embedding_cache.get(input_text)
+            if cached is not None:
+                logger.debug(f"Embedding request for run {run_id} served from embedding cache")
+                metrics.requests.inc(type="embedding", model="embedding", outcome="cached")
+                return [cached]
 
         # Create embedding record in database (skip in dev mode)
         embedding_id = None
         if ENV != 'dev':
-            embedding_id = await create_embedding(run_id, input_text)
-
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
+            record_text = input_text if isinstance(input_text, str) else json.dumps(input_text)
+            embedding_id = await create_embedding(run_id, record_text)
 
         body = {"inputs": input_text, "seed": random.randint(0, 2**32 - 1)}
 
         start_time = time.time()
 
         try:
-            async with httpx.AsyncClient(timeout=60) as client:
-                response = await client.post(CHUTES_EMBEDDING_URL, headers=headers, json=body)
-                response.raise_for_status()
+            response = await self._get_client().post(CHUTES_EMBEDDING_URL, json=body)
+            response.raise_for_status()
 
-                total_time_seconds = time.time() - start_time
-                cost = total_time_seconds * EMBEDDING_PRICE_PER_SECOND
+            total_time_seconds = time.time() - start_time
+            cost = total_time_seconds * EMBEDDING_PRICE_PER_SECOND
 
-                response_data = response.json()
+            response_data = response.json()
+            self._cache_embeddings(input_text, response_data)
 
-                # Update embedding record with cost and response (skip in dev mode)
-                if ENV != 'dev' and embedding_id:
-                    await update_embedding(embedding_id, cost, response_data)
+            metrics.requests.inc(type="embedding", model="embedding", outcome="ok")
+            metrics.request_duration.observe(total_time_seconds, type="embedding", model="embedding")
+            metrics.cost.inc(cost, type="embedding", model="embedding")
 
-                logger.debug(
-                    f"Embedding request for run {run_id} completed in {total_time_seconds:.2f}s, cost: ${cost:.6f}"
-                )
+            # Update embedding record with cost and response (skip in dev mode)
+            if ENV != 'dev' and embedding_id:
+                await update_embedding(run_id, embedding_id, cost, response_data)
+                run_cache.record_embedding_cost(run_id, cost)
+                await request_limiter.record_cost(run_id, "embedding", cost)
 
-                return response_data
+            logger.debug(
+                f"Embedding request for run {run_id} completed in {total_time_seconds:.2f}s, cost: ${cost:.6f}"
+            )
+
+            return response_data
 
         except httpx.HTTPStatusError as e:
             logger.error(
                 f"HTTP error in embedding request for run {run_id}: {e.response.status_code} - {e.response.text}"
             )
+            self._record_embedding_error(str(e.response.status_code))
             # Update embedding record with error (skip in dev mode)
             if ENV != 'dev' and embedding_id:
                 await update_embedding(
+                    run_id,
                     embedding_id,
                     0.0,
                     {"error": f"HTTP error: {e.response.status_code} - {e.response.text}"},
@@ -87,32 +199,131 @@ class ChutesClient:
             return {"error": f"HTTP error in embedding request: {e.response.status_code} - {e.response.text}"}
         except httpx.TimeoutException:
             logger.error(f"Timeout in embedding request for run {run_id}")
+            self._record_embedding_error("timeout")
             # Update embedding record with error (skip in dev mode)
             if ENV != 'dev' and embedding_id:
-                await update_embedding(embedding_id, 0.0, {"error": "Embedding request timed out"})
+                await update_embedding(run_id, embedding_id, 0.0, {"error": "Embedding request timed out"})
             return {"error": "Embedding request timed out. Please try again."}
         except Exception as e:
             logger.error(f"Error in embedding request for run {run_id}: {e}")
+            self._record_embedding_error(type(e).__name__)
             # Update embedding record with error (skip in dev mode)
             if ENV != 'dev' and embedding_id:
-                await update_embedding(embedding_id, 0.0, {"error": str(e)})
+                await update_embedding(run_id, embedding_id, 0.0, {"error": str(e)})
             return {"error": f"Error in embedding request: {str(e)}"}
 
+    @staticmethod
+    def _record_embedding_error(code: str) -> None:
+        metrics.requests.inc(type="embedding", model="embedding", outcome="error")
+        metrics.upstream_errors.inc(provider="chutes_embedding", code=code)
+
+    async def embed_batch(self, run_id: Optional[UUID], texts: List[str]) -> Dict[str, Any]:
+        """Get embeddings for a list of texts.
+
+        Duplicate texts are embedded once, texts seen before are served from the embedding
+        cache, and the remaining texts are sent upstream in size-bounded batches with
+        bounded concurrency. Returns one vector per input text, in input order. Texts whose
+        upstream batch failed get None instead, with the error at the same index in "errors";
+        the vectors of the batches that succeeded (and were billed) are still returned.
+        """
+        vectors: Dict[str, List[float]] = {}
+        errors: Dict[str, str] = {}
+        misses = []
+        for text in dict.fromkeys(texts):
+            cached = embedding_cache.get(text)
+            if cached is None:
+                misses.append(text)
+            else:
+                vectors[text] = cached
+
+        batches = [misses[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(misses), EMBEDDING_BATCH_SIZE)]
+        semaphore = asyncio.Semaphore(EMBEDDING_BATCH_CONCURRENCY)
+
+        async def embed_one(batch: List[str]) -> Tuple[List[str], Any]:
+            async with semaphore:
+                return batch, await self.embed(run_id, batch)
+
+        results = await asyncio.gather(*(embed_one(batch) for batch in batches))
+        for batch, response_data in results:
+            if isinstance(response_data, dict) and "error" in response_data:
+                errors.update(dict.fromkeys(batch, response_data["error"]))
+                continue
+            batch_vectors = self._embedding_vectors(response_data, len(batch))
+            if batch_vectors is None:
+                logger.error(f"Unexpected embedding response shape for run {run_id} batch of {len(batch)}")
+                errors.update(dict.fromkeys(batch, "Unexpected embedding response from upstream"))
+                continue
+            vectors.update(zip(batch, batch_vectors))
+
+        logger.debug(
+            f"Batch embedding for run {run_id}: {len(texts)} texts, {len(misses)} not cached, "
+            f"{len(batches)} upstream calls, {len(errors)} texts failed"
+        )
+        result: Dict[str, Any] = {"embeddings": [vectors.get(text) for text in texts]}
+        if errors:
+            result["errors"] = [errors.get(text) for text in texts]
+        return result
+
+    @staticmethod
+    def _embedding_vectors(response_data: Any, count: int) -> Optional[List[List[float]]]:
+        """Return the vectors in an upstream embed response if it holds exactly `count` of them"""
+        if (
+            isinstance(response_data, list)
+            and len(response_data) == count
+            and all(isinstance(vector, list) for vector in response_data)
+        ):
+            return response_data
+        return None
+
+    def _cache_embeddings(self, input_text: Union[str, List[str]], response_data: Any) -> None:
+        texts = [input_text] if isinstance(input_text, str) else input_text
+        vectors = self._embedding_vectors(response_data, len(texts))
+        if vectors is not None:
+            for text, vector in zip(texts, vectors):
+                embedding_cache.put(text, vector)
+
     async def inference(
         self,
         run_id: UUID = None,
         messages: List[GPTMessage] = None,
         temperature: float = None,
         model: str = None,
+        max_tokens: int = DEFAULT_MAX_TOKENS,
+        prompt_tokens: Optional[int] = None,
     ) -> Dict[str, Any]:
         """Get inference response for messages"""
+        response_chunks = []
+        try:
+            async for _, content in self.inference_stream(run_id, messages, temperature, model, max_tokens, prompt_tokens):
+                if content:
+                    response_chunks.append(content)
+        except InferenceError as e:
+            return {"error": str(e)}
+        return "".join(response_chunks)
+
+    async def inference_stream(
+        self,
+        run_id: UUID = None,
+        messages: List[GPTMessage] = None,
+        temperature: float = None,
+        model: str = None,
+        max_tokens: int = DEFAULT_MAX_TOKENS,
+        prompt_tokens: Optional[int] = None,
+    ) -> AsyncIterator[Tuple[str, Optional[str]]]:
+        """Stream inference for messages, yielding (SSE data, content delta) as upstream chunks arrive.
+
+        The inference record is finalized with the accumulated response, tokens and cost when the
+        stream ends, including when the consumer stops reading early. Input and output tokens are
+        billed at their own rates; `prompt_tokens` is the pre-flight estimate, used only if the
+        upstream does not report usage. Raises InferenceError on failure.
+        """
 
         # Validate model
         if model not in MODEL_PRICING:
             logger.warning(f"Unsupported model requested for run {run_id}: {model}")
-            return {
-                "error": f"Model {model} not supported. Please use one of the following models: {list(MODEL_PRICING.keys())}"
-            }
+            raise InferenceError(
+                f"Model {model} not supported. Please use one of the following models: {list(MODEL_PRICING.keys())}"
+            )
 
         # Convert messages to dict format for database storage
         messages_dict = []
@@ -126,104 +337,210 @@ class ChutesClient:
         if ENV != 'dev':
             inference_id = await create_inference(run_id, messages_dict, temperature, model)
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
+        # Serve deterministic requests from the response cache when possible
+        cache_key = None
+        if response_cache and response_cache.cacheable(temperature):
+            cache_key = response_cache.key(model, messages_dict, temperature, max_tokens)
+            cached = await response_cache.get(cache_key)
+            if cached is not None:
+                cost = response_cache.hit_cost(cached)
+                if ENV != 'dev' and inference_id:
+                    await update_inference(
+                        run_id, inference_id, cost, cached["response"], cached["total_tokens"],
+                        cached.get("prompt_tokens"), cached.get("completion_tokens"),
+                    )
+                    run_cache.record_inference_cost(run_id, cost)
+                    await request_limiter.record_cost(run_id, "inference", cost)
+                logger.debug(f"Inference request for run {run_id} served from response cache, cost: ${cost:.6f}")
+                metrics.requests.inc(type="inference", model=model, outcome="cached")
+                metrics.cost.inc(cost, type="inference", model=model)
+                yield json.dumps({
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": cached["response"]}, "finish_reason": "stop"}],
+                    "usage": {"total_tokens": cached["total_tokens"]},
+                }), cached["response"]
+                return
 
         body = {
             "model": model,
             "messages": messages_dict,
             "stream": True,
-            "max_tokens": 1024,
+            "max_tokens": max_tokens,
             "temperature": temperature,
             "seed": random.randint(0, 2**32 - 1),
+            # Ask for a final usage chunk so prompt and completion tokens can be billed separately
+            "stream_options": {"include_usage": True},
         }
 
-        logger.debug(f"Inference request for run {run_id} with model {model}")
-
-        response_text = ""
-        total_tokens = 0
+        # Identical deterministic requests already in flight share one upstream call
+        flight_key = None
+        if COALESCE_ENABLED and temperature == 0:
+            flight_key = ResponseCache.key(model, messages_dict, temperature, max_tokens)
+        flight = self._flights.get(flight_key) if flight_key else None
+        coalesced = flight is not None
+        if flight is None:
+            flight = InflightCompletion()
+            flight.task = asyncio.create_task(self._run_upstream(flight, run_id, model, body))
+            if flight_key:
+                self._flights[flight_key] = flight
+                flight.task.add_done_callback(lambda _: self._forget_flight(flight_key, flight))
+            logger.debug(f"Inference request for run {run_id} with model {model}")
+        else:
+            logger.debug(f"Inference request for run {run_id} with model {model} coalesced with an in-flight request")
+        flight.attach()
+
+        response_chunks = []
+        error = None
+        start_time = time.time()
+        first_token_time = None
+        completed = False
 
         try:
-            async with httpx.AsyncClient(timeout=None) as client:
-                async with client.stream("POST", CHUTES_INFERENCE_URL, headers=headers, json=body) as response:
-
-                    if response.status_code != 200:
-                        error_text = await response.aread()
-                        if isinstance(error_text, bytes):
-                            error_message = error_text.decode()
-                        else:
-                            error_message = str(error_text)
-                        logger.error(
-                            f"Inference API request failed for run {run_id}: {response.status_code} - {error_message}"
-                        )
-                        # Update inference record with error (skip in dev mode)
-                        if ENV != 'dev' and inference_id:
-                            await update_inference(inference_id, 0.0, f"API request failed: {error_message}", 0)
-                        return {"error": f"API request failed with status {response.status_code}: {error_message}"}
-
-                    # Process streaming response
-                    async for chunk in response.aiter_lines():
-                        if chunk:
-                            chunk_str = chunk.strip()
-                            if chunk_str.startswith("data: "):
-                                chunk_data = chunk_str[6:]  # Remove "data: " prefix
-
-                                if chunk_data == "[DONE]":
-                                    break
-
-                                try:
-                                    chunk_json = json.loads(chunk_data)
-                                    if "choices" in chunk_json and len(chunk_json["choices"]) > 0:
-                                        choice = chunk_json["choices"][0]
-                                        if "delta" in choice and "content" in choice["delta"]:
-                                            content = choice["delta"]["content"]
-                                            if content:
-                                                response_text += content
-
-                                        # Track token usage if available
-                                        usage = chunk_json.get("usage")
-                                        if usage:
-                                            total_tokens = usage.get("total_tokens", 0)
-
-                                except json.JSONDecodeError:
-                                    # Skip malformed JSON chunks
-                                    continue
-
-            # Calculate cost based on tokens
-            cost = (total_tokens / 1_000_000) * MODEL_PRICING[model]
-
-            # Update inference record with cost and response (skip in dev mode)
-            if ENV != 'dev' and inference_id:
-                await update_inference(inference_id, cost, response_text, total_tokens)
-
-            logger.debug(f"Inference request for run {run_id} completed, tokens: {total_tokens}, cost: ${cost:.6f}")
-
-            return response_text
+            async for chunk_data, content in flight.subscribe():
+                if content:
+                    if first_token_time is None:
+                        first_token_time = time.time()
+                    response_chunks.append(content)
+                yield chunk_data, content
+            completed = True
+        except InferenceError:
+            error = flight.error_record
+            raise
+        finally:
+            if flight.detach() and flight_key:
+                self._forget_flight(flight_key, flight)
+            provider = flight.provider
+
+            metrics.request_duration.observe(time.time() - start_time, type="inference", model=model)
+            if error is not None:
+                metrics.requests.inc(type="inference", model=model, outcome="error")
+                # Update inference record with error (skip in dev mode)
+                if ENV != 'dev' and inference_id:
+                    await update_inference(run_id, inference_id, 0.0, error, 0, 0, 0)
+            else:
+                response_text = "".join(response_chunks)
+                prompt_tokens, completion_tokens, total_tokens = self._token_usage(
+                    flight.usage if completed else {}, prompt_tokens, response_text
+                )
+                # Calculate cost from tokens, at the rates of the provider that answered
+                cost = provider.cost(model, prompt_tokens, completion_tokens) if provider else 0.0
+                if coalesced:
+                    cost *= COALESCE_COST_FACTOR
+
+                provider_name = provider.name if provider else "n/a"
+                if not completed:
+                    outcome = "cancelled"
+                else:
+                    outcome = "coalesced" if coalesced else "ok"
+                metrics.requests.inc(type="inference", model=model, outcome=outcome)
+                if not coalesced:
+                    metrics.tokens.inc(prompt_tokens, model=model, provider=provider_name, kind="prompt")
+                    metrics.tokens.inc(completion_tokens, model=model, provider=provider_name, kind="completion")
+                metrics.cost.inc(cost, type="inference", model=model)
+                if first_token_time:
+                    metrics.time_to_first_token.observe(first_token_time - start_time, model=model, provider=provider_name)
+
+                # Update inference record with cost and response (skip in dev mode)
+                if ENV != 'dev' and inference_id:
+                    await update_inference(run_id, inference_id, cost, response_text, total_tokens, prompt_tokens, completion_tokens)
+                    run_cache.record_inference_cost(run_id, cost)
+                    await request_limiter.record_cost(run_id, "inference", cost)
+
+                if cache_key and completed and response_text and not coalesced:
+                    await response_cache.put(cache_key, response_text, total_tokens, cost, prompt_tokens, completion_tokens)
+
+                ttft = f"{first_token_time - start_time:.2f}s" if first_token_time else "n/a"
+                logger.debug(
+                    f"Inference request for run {run_id} via {provider_name}{' (coalesced)' if coalesced else ''} "
+                    f"completed in {time.time() - start_time:.2f}s "
+                    f"(time to first token: {ttft}), tokens: {prompt_tokens} prompt + {completion_tokens} completion, "
+                    f"cost: ${cost:.6f}"
+                )
 
+    async def _run_upstream(self, flight: InflightCompletion, run_id: UUID, model: str, body: Dict[str, Any]) -> None:
+        """Stream one completion from upstream into `flight`, recording any failure on it"""
+        try:
+            timeout = httpx.Timeout(CHUTES_INFERENCE_READ_TIMEOUT, connect=CHUTES_CONNECT_TIMEOUT, pool=CHUTES_POOL_TIMEOUT)
+            upstream = await provider_router.open_inference_stream(self._get_client(), model, body, timeout)
+            flight.provider = upstream.provider
+            try:
+                # Process streaming response
+                async for chunk in upstream.lines():
+                    if chunk:
+                        chunk_str = chunk.strip()
+                        if chunk_str.startswith("data: "):
+                            chunk_data = chunk_str[6:]  # Remove "data: " prefix
+
+                            if chunk_data == "[DONE]":
+                                break
+
+                            try:
+                                chunk_json = json.loads(chunk_data)
+                            except json.JSONDecodeError:
+                                # Skip malformed JSON chunks
+                                continue
+
+                            content = None
+                            if "choices" in chunk_json and len(chunk_json["choices"]) > 0:
+                                choice = chunk_json["choices"][0]
+                                if "delta" in choice and "content" in choice["delta"]:
+                                    content = choice["delta"]["content"]
+
+                            # Track token usage if available (the final chunk may carry usage without choices)
+                            if chunk_json.get("usage"):
+                                flight.usage = chunk_json["usage"]
+
+                            await flight.publish(chunk_data, content)
+            finally:
+                await upstream.aclose()
+
+            flight.completed = True
+
+        except UpstreamError as e:
+            logger.error(f"Inference API request failed for run {run_id}: {e.provider} {e.status_code} - {e.message}")
+            flight.error_record = f"API request failed: {e.message}"
+            flight.error = InferenceError(f"API request failed with status {e.status_code}: {e.message}")
         except httpx.HTTPStatusError as e:
             logger.error(
                 f"HTTP error in inference request for run {run_id}: {e.response.status_code} - {e.response.text}"
             )
-            # Update inference record with error (skip in dev mode)
-            if ENV != 'dev' and inference_id:
-                await update_inference(
-                    inference_id,
-                    0.0,
-                    f"HTTP error: {e.response.status_code} - {e.response.text}",
-                    0,
-                )
-            return {"error": f"HTTP error in inference request: {e.response.status_code} - {e.response.text}"}
-        except httpx.TimeoutException:
+            flight.error_record = f"HTTP error: {e.response.status_code} - {e.response.text}"
+            flight.error = InferenceError(f"HTTP error in inference request: {e.response.status_code} - {e.response.text}")
+        except (httpx.TimeoutException, asyncio.TimeoutError):
             logger.error(f"Timeout in inference request for run {run_id}")
-            # Update inference record with error (skip in dev mode)
-            if ENV != 'dev' and inference_id:
-                await update_inference(inference_id, 0.0, "Inference request timed out", 0)
-            return {"error": "Inference request timed out. Please try again."}
+            flight.error_record = "Inference request timed out"
+            flight.error = InferenceError("Inference request timed out. Please try again.")
+        except asyncio.CancelledError:
+            flight.error_record = "Inference request cancelled"
+            flight.error = InferenceError("Inference request was cancelled.")
         except Exception as e:
             logger.error(f"Error in inference request for run {run_id}: {e}")
-            # Update inference record with error (skip in dev mode)
-            if ENV != 'dev' and inference_id:
-                await update_inference(inference_id, 0.0, str(e), 0)
-            return {"error": f"Error in inference request: {str(e)}"}
\ No newline at end of file
+            flight.error_record = str(e)
+            flight.error = InferenceError(f"Error in inference request: {str(e)}")
+        finally:
+            await flight.finish()
+
+    def _forget_flight(self, key: str, flight: InflightCompletion) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def coalescing_stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._flights)}
+
+    @staticmethod
+    def _token_usage(usage: Dict[str, Any], estimated_prompt_tokens: Optional[int],
+                     response_text: str) -> Tuple[int, int, int]:
+        """(prompt, completion, total) tokens from upstream usage, estimated where it is missing"""
+        prompt_tokens = usage.get("prompt_tokens")
+        completion_tokens = usage.get("completion_tokens")
+        total_tokens = usage.get("total_tokens")
+        if prompt_tokens is None:
+            prompt_tokens = estimated_prompt_tokens or 0
+            if total_tokens is not None and completion_tokens is not None:
+                prompt_tokens = max(total_tokens - completion_tokens, 0)
+        if completion_tokens is None:
+            if total_tokens is not None:
+                completion_tokens = max(total_tokens - prompt_tokens, 0)
+            else:
+                completion_tokens = token_estimator.count_text(response_text)
+        return prompt_tokens, completion_tokens, prompt_tokens + completion_tokens
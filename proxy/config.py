@@ -1,18 +1,52 @@
 import os
+import tempfile
+from pathlib import Path
 from typing import Dict, Literal
 
 ENV: Literal["prod", "staging", "dev"] = os.getenv("ENV", "prod")
 
 # Chutes API configuration
 CHUTES_API_KEY = os.getenv("CHUTES_API_KEY", "")
-CHUTES_EMBEDDING_URL = "https://chutes-baai-bge-large-en-v1-5.chutes.ai/embed"
-CHUTES_INFERENCE_URL = "https://llm.chutes.ai/v1/chat/completions"
+# Overridable so the proxy can be pointed at a mock upstream (see proxy/loadtest)
+CHUTES_EMBEDDING_URL = os.getenv("CHUTES_EMBEDDING_URL", "https://chutes-baai-bge-large-en-v1-5.chutes.ai/embed")
+CHUTES_INFERENCE_URL = os.getenv("CHUTES_INFERENCE_URL", "https://llm.chutes.ai/v1/chat/completions")
+
+# Upstream HTTP connection pool (shared by all embedding/inference calls)
+CHUTES_HTTP2 = os.getenv("CHUTES_HTTP2", "true") == "true"
+CHUTES_MAX_CONNECTIONS = int(os.getenv("CHUTES_MAX_CONNECTIONS", "100"))
+CHUTES_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("CHUTES_MAX_KEEPALIVE_CONNECTIONS", "20"))
+CHUTES_KEEPALIVE_EXPIRY = float(os.getenv("CHUTES_KEEPALIVE_EXPIRY", "60"))
+CHUTES_CONNECT_TIMEOUT = float(os.getenv("CHUTES_CONNECT_TIMEOUT", "10"))
+CHUTES_POOL_TIMEOUT = float(os.getenv("CHUTES_POOL_TIMEOUT", "30"))
+CHUTES_EMBEDDING_TIMEOUT = float(os.getenv("CHUTES_EMBEDDING_TIMEOUT", "60"))
+# Streamed completions can legitimately take minutes; unset means no read timeout
+CHUTES_INFERENCE_READ_TIMEOUT = float(os.getenv("CHUTES_INFERENCE_READ_TIMEOUT")) if os.getenv("CHUTES_INFERENCE_READ_TIMEOUT") else None
+
 # Targon API configuration (for fallback)
 TARGON_API_KEY = os.getenv("TARGON_API_KEY", "")
+TARGON_INFERENCE_URL = os.getenv("TARGON_INFERENCE_URL", "https://api.targon.com/v1/chat/completions")
+
+# Provider routing: health tracking, fallback and hedged requests
+PROVIDER_EWMA_ALPHA = float(os.getenv("PROVIDER_EWMA_ALPHA", "0.2"))
+# Providers whose error-rate EWMA reaches this are tried after healthy ones
+PROVIDER_ERROR_THRESHOLD = float(os.getenv("PROVIDER_ERROR_THRESHOLD", "0.5"))
+# Give up on a provider (and fall back) if it produces no first token within this time
+PROVIDER_FIRST_TOKEN_TIMEOUT = float(os.getenv("PROVIDER_FIRST_TOKEN_TIMEOUT", "120"))
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false") == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "1.0"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "10.0"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
 
 # Pricing configuration
 EMBEDDING_PRICE_PER_SECOND = 0.0001
 
+# Batch embedding configuration
+EMBEDDING_BATCH_MAX_INPUTS = int(os.getenv("EMBEDDING_BATCH_MAX_INPUTS", "2048"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_BATCH_CONCURRENCY = int(os.getenv("EMBEDDING_BATCH_CONCURRENCY", "4"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "20000"))
+
 MODEL_PRICING: Dict[str, float] = {
     "deepseek-ai/DeepSeek-V3-0324": 0.2722,
     "agentica-org/DeepCoder-14B-Preview": 0.02,
@@ -40,6 +74,28 @@ MODEL_PRICING: Dict[str, float] = {
     "all-hands/openhands-lm-32b-v0.1": 0.0246,
 }
 
+# Output-token prices (per million tokens); MODEL_PRICING is the input-token price.
+# Chutes bills a blended rate, so output prices start equal to it.
+MODEL_OUTPUT_PRICING: Dict[str, float] = dict(MODEL_PRICING)
+
+# Context window per model (prompt + completion tokens)
+DEFAULT_CONTEXT_WINDOW = 32768
+MODEL_CONTEXT_WINDOWS: Dict[str, int] = {
+    "deepseek-ai/DeepSeek-V3-0324": 163840,
+    "deepseek-ai/DeepSeek-V3": 163840,
+    "deepseek-ai/DeepSeek-R1": 163840,
+    "deepseek-ai/DeepSeek-R1-0528": 163840,
+    "Qwen/Qwen3-32B": 40960,
+    "Qwen/Qwen3-235B-A22B-Instruct-2507": 262144,
+    "Qwen/QwQ-32B": 40960,
+    "Qwen/Qwen3-30B-A3B": 40960,
+    "chutesai/Mistral-Small-3.2-24B-Instruct-2506": 131072,
+    "chutesai/Mistral-Small-3.1-24B-Instruct-2503": 131072,
+    "unsloth/gemma-3-27b-it": 131072,
+    "moonshotai/Kimi-Dev-72B": 131072,
+    "moonshotai/Kimi-K2-Instruct": 131072,
+}
+
 # Models that support Targon fallback
 TARGON_FALLBACK_MODELS = {
     "moonshotai/Kimi-K2-Instruct"
@@ -47,19 +103,91 @@ TARGON_FALLBACK_MODELS = {
 
 # Targon-specific pricing (per million tokens)
 TARGON_PRICING: Dict[str, float] = {
-    "moonshotai/Kimi-K2-Instruct": 0.14,  # $0.14/M input, $2.49/M output - using input rate for now
+    "moonshotai/Kimi-K2-Instruct": 0.14,  # $0.14/M input
+}
+TARGON_OUTPUT_PRICING: Dict[str, float] = {
+    "moonshotai/Kimi-K2-Instruct": 2.49,  # $2.49/M output
 }
 
 # Cost limits
 MAX_COST_PER_RUN = 2.0  # Maximum cost per evaluation run
 
+# Admission cache for run status and running cost totals
+RUN_CACHE_TTL_SECONDS = float(os.getenv("RUN_CACHE_TTL_SECONDS", "30"))
+RUN_CACHE_MAX_ENTRIES = int(os.getenv("RUN_CACHE_MAX_ENTRIES", "10000"))
+RUN_STATUS_CHANNEL = "evaluation_run_status"
+
+# Delta encoding of inference message histories
+# Message contents at least this long are stored once, by hash, in inference_message_blobs
+MESSAGE_BLOB_MIN_CHARS = int(os.getenv("MESSAGE_BLOB_MIN_CHARS", "1024"))
+# Blob hashes remembered as already written, so their contents are not sent again
+MESSAGE_BLOB_CACHE_ENTRIES = int(os.getenv("MESSAGE_BLOB_CACHE_ENTRIES", "10000"))
+# Recent inferences per run considered as the predecessor of a new one
+MESSAGE_HISTORY_RECENT_PER_RUN = int(os.getenv("MESSAGE_HISTORY_RECENT_PER_RUN", "4"))
+
+# Write-behind batching of inference/embedding records
+WRITE_BEHIND_FLUSH_INTERVAL_MS = int(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL_MS", "200"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "500"))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))
+WRITE_BEHIND_SHUTDOWN_RETRIES = 5
+# Flushes that fail while the database is unavailable are retried indefinitely, backing off exponentially up
+# to the cap; records the database rejects are appended to the dead-letter file (python -m proxy.replay_dead_letters)
+WRITE_BEHIND_RETRY_BASE_SECONDS = float(os.getenv("WRITE_BEHIND_RETRY_BASE_SECONDS", "0.5"))
+WRITE_BEHIND_RETRY_MAX_SECONDS = float(os.getenv("WRITE_BEHIND_RETRY_MAX_SECONDS", "30"))
+WRITE_BEHIND_DEAD_LETTER_PATH = Path(os.getenv(
+    "WRITE_BEHIND_DEAD_LETTER_PATH", str(Path(__file__).parent / "write_behind_dead_letter.jsonl")
+))
+
+# Deterministic (temperature 0) response cache, opt-in
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false") == "true"
+RESPONSE_CACHE_DIR = Path(os.getenv("RESPONSE_CACHE_DIR", str(Path(__file__).parent / "response_cache")))
+RESPONSE_CACHE_MEMORY_ENTRIES = int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", "5000"))
+RESPONSE_CACHE_DISK_ENTRIES = int(os.getenv("RESPONSE_CACHE_DISK_ENTRIES", "200000"))
+# Fraction of the original cost billed to a run when its response is served from the cache
+RESPONSE_CACHE_COST_FACTOR = float(os.getenv("RESPONSE_CACHE_COST_FACTOR", "0.0"))
+
+# Single-flight coalescing of identical in-flight temperature-0 requests
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "true") == "true"
+# Fraction of the shared completion's cost billed to each run that attached to it
+COALESCE_COST_FACTOR = float(os.getenv("COALESCE_COST_FACTOR", "1.0"))
+
+# Request limits applied before forwarding upstream
+RUN_MAX_CONCURRENT_REQUESTS = int(os.getenv("RUN_MAX_CONCURRENT_REQUESTS", "8"))
+RUN_REQUESTS_PER_SECOND = float(os.getenv("RUN_REQUESTS_PER_SECOND", "5"))
+RUN_REQUEST_BURST = float(os.getenv("RUN_REQUEST_BURST", "20"))
+MODEL_MAX_CONCURRENT_REQUESTS = int(os.getenv("MODEL_MAX_CONCURRENT_REQUESTS", "64"))
+MODEL_QUEUE_TIMEOUT_SECONDS = float(os.getenv("MODEL_QUEUE_TIMEOUT_SECONDS", "30"))
+
 # Default model
 DEFAULT_MODEL = "deepseek-ai/DeepSeek-V3-0324"
 DEFAULT_TEMPERATURE = 0.7
+DEFAULT_MAX_TOKENS = 1024
+
+# Pre-flight prompt token estimation
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+# tiktoken vocab files are read from here, so the proxy can run without network access
+TOKENIZER_CACHE_DIR = Path(os.getenv("TOKENIZER_CACHE_DIR", str(Path(__file__).parent / "tokenizer_cache")))
+# Prompts with at least this many characters are encoded in a worker thread instead of on the event loop
+TOKENIZER_THREAD_MIN_CHARS = int(os.getenv("TOKENIZER_THREAD_MIN_CHARS", "32768"))
+# The vocab only approximates each model's own tokenizer, so prompt counts are padded by this factor
+TOKENIZER_SAFETY_MARGIN = float(os.getenv("TOKENIZER_SAFETY_MARGIN", "1.1"))
+TOKENS_PER_MESSAGE = 4
+MIN_COMPLETION_TOKENS = int(os.getenv("MIN_COMPLETION_TOKENS", "64"))
+# What to do with a prompt that does not fit the context window: "reject" or "truncate" (drop oldest turns)
+PROMPT_OVERFLOW_POLICY: Literal["reject", "truncate"] = os.getenv("PROMPT_OVERFLOW_POLICY", "reject")
 
 # Server configuration
 SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
 SERVER_PORT = int(os.getenv("SERVER_PORT", "8001"))
+PROXY_WORKERS = int(os.getenv("PROXY_WORKERS", "1"))
+
+# Per-run limiter state shared across worker processes (in-process when a single worker runs)
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH") or (
+    str(Path(tempfile.gettempdir()) / "ridges-proxy-state.sqlite3") if PROXY_WORKERS > 1 else ""
+)
+SHARED_STATE_IDLE_SECONDS = float(os.getenv("SHARED_STATE_IDLE_SECONDS", "300"))
+# Runs that still hold slots or reservations are only dropped after this long, to clear a dead worker's leaks
+SHARED_STATE_STALE_SECONDS = float(os.getenv("SHARED_STATE_STALE_SECONDS", "3600"))
 
 # Logging configuration
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
\ No newline at end of file
@@ -4,13 +4,15 @@ import json
 from contextlib import asynccontextmanager
 from typing import Optional, Dict, Any, List
 from functools import wraps
-from datetime import datetime
-from uuid import UUID
+from datetime import datetime, timezone
+from uuid import UUID, uuid4
 
 import asyncpg
 
 from proxy.models import EvaluationRun, SandboxStatus, Embedding, Inference
 from proxy.config import ENV
+from proxy.write_behind import WriteBatch, WriteBehindQueue
+from proxy.message_history import message_history
 
 logger = logging.getLogger(__name__)
 
@@ -49,6 +51,12 @@ class DBManager:
         async with self.pool.acquire() as con:
             yield con
 
+    def pool_stats(self) -> Dict[str, int]:
+        """Snapshot of the connection pool for metrics"""
+        if not self.pool:
+            return {"size": 0, "idle": 0, "max": self.max_con}
+        return {"size": self.pool.get_size(), "idle": self.pool.get_idle_size(), "max": self.pool.get_max_size()}
+
 # Initialize database manager with environment variables
 if ENV != 'dev':
     DB_USER = os.getenv("AWS_MASTER_USERNAME")
@@ -114,73 +122,133 @@ async def get_evaluation_run_by_id(conn: asyncpg.Connection, run_id: str) -> Opt
         raise
 
 @db_operation
-async def create_embedding(conn: asyncpg.Connection, run_id: UUID, input_text: str) -> UUID:
-    """Create a new embedding record and return its ID"""
-    try:
-        row = await conn.fetchrow("""
-            INSERT INTO embeddings (run_id, input_text, created_at)
-            VALUES ($1, $2, NOW())
-            RETURNING id
-        """, run_id, input_text)
-        
-        return row['id']
-        
-    except Exception as e:
-        logger.error(f"Error creating embedding for run {run_id}: {e}")
-        raise
+async def write_batch(conn: asyncpg.Connection, batch: WriteBatch) -> None:
+    """Write a batch of buffered embedding/inference records in one transaction"""
+    async with conn.transaction():
+        if batch.inserts["message_blob"]:
+            await conn.executemany("""
+                INSERT INTO inference_message_blobs (hash, content)
+                VALUES ($1, $2)
+                ON CONFLICT (hash) DO NOTHING
+            """, [
+                (blob_hash, r["content"])
+                for blob_hash, r in batch.inserts["message_blob"].items()
+            ])
+        if batch.inserts["embedding"]:
+            await conn.executemany("""
+                INSERT INTO embeddings (id, run_id, input_text, cost, response, created_at, finished_at)
+                VALUES ($1, $2, $3, $4, $5, $6, $7)
+            """, [
+                (embedding_id, r["run_id"], r["input_text"], r.get("cost"), r.get("response"),
+                 r["created_at"], r.get("finished_at"))
+                for embedding_id, r in batch.inserts["embedding"].items()
+            ])
+        if batch.updates["embedding"]:
+            await conn.executemany("""
+                UPDATE embeddings
+                SET cost = $1, response = $2, finished_at = $3
+                WHERE id = $4
+            """, [
+                (r["cost"], r["response"], r["finished_at"], embedding_id)
+                for embedding_id, r in batch.updates["embedding"].items()
+            ])
+        if batch.inserts["inference"]:
+            await conn.executemany("""
+                INSERT INTO inferences (id, run_id, messages, parent_id, message_offset, temperature, model, cost,
+                                        response, total_tokens, prompt_tokens, completion_tokens, created_at, finished_at)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14)
+            """, [
+                (inference_id, r["run_id"], r["messages"], r["parent_id"], r["message_offset"], r["temperature"],
+                 r["model"], r.get("cost"), r.get("response"), r.get("total_tokens"), r.get("prompt_tokens"),
+                 r.get("completion_tokens"), r["created_at"], r.get("finished_at"))
+                for inference_id, r in batch.inserts["inference"].items()
+            ])
+        if batch.updates["inference"]:
+            await conn.executemany("""
+                UPDATE inferences
+                SET cost = $1, response = $2, total_tokens = $3, prompt_tokens = $4, completion_tokens = $5,
+                    finished_at = $6
+                WHERE id = $7
+            """, [
+                (r["cost"], r["response"], r["total_tokens"], r["prompt_tokens"], r["completion_tokens"],
+                 r["finished_at"], inference_id)
+                for inference_id, r in batch.updates["inference"].items()
+            ])
 
-@db_operation
-async def update_embedding(conn: asyncpg.Connection, embedding_id: UUID, cost: float, 
-                          response: Dict[str, Any]) -> None:
-    """Update an embedding record with cost and response"""
-    try:
-        # Convert response dict to JSON string for JSONB storage
-        response_json = json.dumps(response)
-        
-        await conn.execute("""
-            UPDATE embeddings 
-            SET cost = $1, response = $2, finished_at = NOW()
-            WHERE id = $3
-        """, cost, response_json, embedding_id)
-        
-    except Exception as e:
-        logger.error(f"Error updating embedding {embedding_id}: {e}")
-        raise
+def is_rejected_write(e: Exception) -> bool:
+    """Whether a failed write was refused for its data, as opposed to the database being unavailable"""
+    return isinstance(e, (
+        asyncpg.exceptions.DataError,
+        asyncpg.exceptions.IntegrityConstraintViolationError,
+        # Values asyncpg cannot encode for their column
+        ValueError,
+        TypeError,
+    ))
 
-@db_operation
-async def create_inference(conn: asyncpg.Connection, run_id: UUID, messages: List[Dict[str, str]], 
+def _confirm_written(batch: WriteBatch) -> None:
+    """Let the message history encoder reference blobs and inferences once they are in the database"""
+    message_history.confirm(batch.inserts["message_blob"], batch.inserts["inference"])
+
+# Buffers embedding/inference writes off the request path; flushed in batches by write_batch
+write_queue = WriteBehindQueue(write_batch, is_rejected=is_rejected_write, on_written=_confirm_written)
+
+async def create_embedding(run_id: UUID, input_text: str) -> UUID:
+    """Queue a new embedding record and return its ID"""
+    embedding_id = uuid4()
+    await write_queue.insert("embedding", embedding_id, {
+        "run_id": run_id,
+        "input_text": input_text,
+        "created_at": datetime.now(timezone.utc),
+    })
+    return embedding_id
+
+async def update_embedding(run_id: UUID, embedding_id: UUID, cost: float, response: Dict[str, Any]) -> None:
+    """Queue an update of an embedding record with cost and response"""
+    # Convert response dict to JSON string for JSONB storage; run_id is not written, it lets pending
+    # costs be attributed to the run
+    await write_queue.update("embedding", embedding_id, {
+        "run_id": run_id,
+        "cost": cost,
+        "response": json.dumps(response),
+        "finished_at": datetime.now(timezone.utc),
+    })
+
+async def create_inference(run_id: UUID, messages: List[Dict[str, str]],
                           temperature: float, model: str) -> UUID:
-    """Create a new inference record and return its ID"""
-    try:
-        # Convert messages list to JSON string for JSONB storage
-        messages_json = json.dumps(messages)
-        
-        row = await conn.fetchrow("""
-            INSERT INTO inferences (run_id, messages, temperature, model, created_at)
-            VALUES ($1, $2, $3, $4, NOW())
-            RETURNING id
-        """, run_id, messages_json, temperature, model)
-        
-        return row['id']
-        
-    except Exception as e:
-        logger.error(f"Error creating inference for run {run_id}: {e}")
-        raise
+    """Queue a new inference record and return its ID.
 
-@db_operation
-async def update_inference(conn: asyncpg.Connection, inference_id: UUID, cost: float, 
-                          response: str, total_tokens: int) -> None:
-    """Update an inference record with cost, response, and tokens"""
-    try:
-        await conn.execute("""
-            UPDATE inferences 
-            SET cost = $1, response = $2, total_tokens = $3, finished_at = NOW()
-            WHERE id = $4
-        """, cost, response, total_tokens, inference_id)
-        
-    except Exception as e:
-        logger.error(f"Error updating inference {inference_id}: {e}")
-        raise
+    Only the messages appended since an earlier inference of the run are stored,
+    with large contents replaced by references to deduplicated blobs.
+    """
+    inference_id = uuid4()
+    encoded = message_history.encode(run_id, inference_id, messages)
+    for blob_hash, content in encoded.new_blobs.items():
+        await write_queue.insert("message_blob", blob_hash, {"content": content})
+    # Convert messages list to JSON string for JSONB storage
+    await write_queue.insert("inference", inference_id, {
+        "run_id": run_id,
+        "messages": json.dumps(encoded.messages),
+        "parent_id": encoded.parent_id,
+        "message_offset": encoded.message_offset,
+        "temperature": temperature,
+        "model": model,
+        "created_at": datetime.now(timezone.utc),
+    })
+    return inference_id
+
+async def update_inference(run_id: UUID, inference_id: UUID, cost: float, response: str, total_tokens: int,
+                           prompt_tokens: Optional[int] = None, completion_tokens: Optional[int] = None) -> None:
+    """Queue an update of an inference record with cost, response, and tokens"""
+    # run_id is not written, it lets pending costs be attributed to the run
+    await write_queue.update("inference", inference_id, {
+        "run_id": run_id,
+        "cost": cost,
+        "response": response,
+        "total_tokens": total_tokens,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "finished_at": datetime.now(timezone.utc),
+    })
 
 @db_operation
 async def get_total_inference_cost(conn: asyncpg.Connection, run_id: UUID) -> float:
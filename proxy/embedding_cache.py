@@ -0,0 +1,56 @@
+import hashlib
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from proxy.config import EMBEDDING_CACHE_MAX_ENTRIES
+
+
+class EmbeddingCache:
+    """In-memory LRU of embedding vectors keyed by a hash of the input text.
+
+    Vectors are stored as arrays of doubles, so a hit returns exactly the floats
+    upstream returned on the miss, while taking a quarter of the memory of a
+    list of Python floats.
+    """
+
+    def __init__(self, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, array]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get(self, text: str) -> Optional[List[float]]:
+        key = self.key(text)
+        vector = self._entries.get(key)
+        if vector is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return vector.tolist()
+
+    def put(self, text: str, vector: List[float]) -> None:
+        key = self.key(text)
+        self._entries[key] = array("d", vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# Global embedding cache
+embedding_cache = EmbeddingCache()
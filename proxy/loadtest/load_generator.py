@@ -0,0 +1,206 @@
+"""
+Load generator that replays agent-like traffic against the proxy.
+
+Simulates many concurrent agents, each bound to a run_id, holding a growing
+conversation and mixing buffered inference, streamed inference and embedding
+calls across models. Every conversation opens with a distinct issue, so the
+response cache does not answer them. Reports throughput and latency
+percentiles of successful (2xx) requests, the error rate, status codes and the
+proxy's database write rate, and can fail (exit 1) on thresholds for CI:
+
+    python proxy/loadtest/load_generator.py --proxy-url http://127.0.0.1:8001 \\
+        --agents 200 --duration 60 --max-p95 2.0 --min-rps 100 --max-error-rate 0.01
+
+Without --run-ids, random run_ids are generated, which only the dev-mode proxy
+accepts. Pass a file with one real run_id per line to test a production proxy.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+DEFAULT_MODELS = "deepseek-ai/DeepSeek-V3-0324,moonshotai/Kimi-K2-Instruct,Qwen/Qwen3-32B"
+SYSTEM_PROMPT = "You are an autonomous software engineer. Fix the issue described below. " * 40
+
+
+class Results:
+    """Latencies and outcomes collected during a load test; latencies are of successful requests only"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.first_token_latencies: List[float] = []
+        self.statuses: Dict[str, int] = defaultdict(int)
+        self.failures = 0
+
+    def record(self, kind: str, latency: float, status: str) -> None:
+        self.statuses[status] += 1
+        if status.startswith("2"):
+            self.latencies[kind].append(latency)
+        else:
+            self.failures += 1
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def opening_messages() -> List[Dict[str, str]]:
+    """A new conversation; the issue differs every time so temperature-0 prompts miss the response cache"""
+    issue = f"Issue #{random.randint(0, 10 ** 9)}: test_{uuid.uuid4().hex[:8]} fails."
+    return [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": issue}]
+
+
+async def run_agent(client: httpx.AsyncClient, args: argparse.Namespace, run_id: str, models: List[str],
+                    deadline: float, results: Results) -> None:
+    model = random.choice(models)
+    messages = opening_messages()
+    while time.monotonic() < deadline:
+        roll = random.random()
+        start = time.monotonic()
+        try:
+            if roll < args.embedding_ratio:
+                kind = "embedding"
+                response = await client.post(
+                    "/agents/embedding", json={"input": f"def f{random.randint(0, 10_000)}(): pass", "run_id": run_id}
+                )
+                results.record(kind, time.monotonic() - start, str(response.status_code))
+            elif roll < args.embedding_ratio + args.stream_ratio:
+                kind = "inference_stream"
+                body = {"run_id": run_id, "model": model, "temperature": 0.0, "messages": messages, "stream": True}
+                async with client.stream("POST", "/agents/inference", json=body) as response:
+                    first_token = None
+                    async for line in response.aiter_lines():
+                        if first_token is None and line.startswith("data: ") and line != "data: [DONE]":
+                            first_token = time.monotonic() - start
+                    if first_token is not None and response.status_code < 300:
+                        results.first_token_latencies.append(first_token)
+                results.record(kind, time.monotonic() - start, str(response.status_code))
+            else:
+                kind = "inference"
+                body = {"run_id": run_id, "model": model, "temperature": 0.0, "messages": messages}
+                response = await client.post("/agents/inference", json=body)
+                results.record(kind, time.monotonic() - start, str(response.status_code))
+                if response.status_code == 200:
+                    # Agents append each answer and a tool result, so prompts grow over the run
+                    messages = messages + [
+                        {"role": "assistant", "content": str(response.json())[:2000]},
+                        {"role": "user", "content": f"Tool output {random.randint(0, 10_000)}: ok"},
+                    ]
+                    if len(messages) > args.max_turns * 2:
+                        messages = opening_messages()
+        except httpx.HTTPError as e:
+            results.record("transport", time.monotonic() - start, type(e).__name__)
+        if args.think_time:
+            await asyncio.sleep(random.expovariate(1 / args.think_time))
+
+
+async def write_queue_flushed(client: httpx.AsyncClient) -> Optional[int]:
+    """Records the proxy has flushed to the database so far, if it reports them"""
+    try:
+        response = await client.get("/health")
+        return response.json().get("write_queue", {}).get("flushed_records")
+    except (httpx.HTTPError, ValueError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> Dict[str, object]:
+    models = args.models.split(",")
+    if args.run_ids:
+        with open(args.run_ids) as f:
+            run_ids = [line.strip() for line in f if line.strip()]
+    else:
+        run_ids = [str(uuid.uuid4()) for _ in range(args.runs)]
+
+    results = Results()
+    limits = httpx.Limits(max_connections=args.agents, max_keepalive_connections=args.agents)
+    async with httpx.AsyncClient(base_url=args.proxy_url, limits=limits, timeout=args.timeout) as client:
+        flushed_before = await write_queue_flushed(client)
+        start = time.monotonic()
+        deadline = start + args.duration
+        await asyncio.gather(*(
+            run_agent(client, args, run_ids[i % len(run_ids)], models, deadline, results)
+            for i in range(args.agents)
+        ))
+        elapsed = time.monotonic() - start
+        flushed_after = await write_queue_flushed(client)
+
+    all_latencies = [latency for latencies in results.latencies.values() for latency in latencies]
+    total = len(all_latencies) + results.failures
+    report = {
+        "duration_seconds": round(elapsed, 2),
+        "requests": total,
+        "successful_requests": len(all_latencies),
+        "rps": round(len(all_latencies) / elapsed, 2),
+        "error_rate": round(results.failures / total, 4) if total else 0.0,
+        "latency_seconds": {
+            kind: {
+                "count": len(latencies),
+                "p50": round(percentile(latencies, 0.50), 4),
+                "p95": round(percentile(latencies, 0.95), 4),
+                "p99": round(percentile(latencies, 0.99), 4),
+            }
+            for kind, latencies in sorted(results.latencies.items())
+        },
+        "time_to_first_token_seconds": {
+            "p50": round(percentile(results.first_token_latencies, 0.50), 4),
+            "p95": round(percentile(results.first_token_latencies, 0.95), 4),
+            "p99": round(percentile(results.first_token_latencies, 0.99), 4),
+        },
+        "statuses": dict(results.statuses),
+        "db_writes_per_second": (
+            round((flushed_after - flushed_before) / elapsed, 2)
+            if flushed_before is not None and flushed_after is not None else None
+        ),
+    }
+    report["p95_seconds"] = round(percentile(all_latencies, 0.95), 4)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay agent-like traffic against the proxy")
+    parser.add_argument("--proxy-url", default="http://127.0.0.1:8001")
+    parser.add_argument("--agents", type=int, default=100, help="Concurrent simulated agents")
+    parser.add_argument("--runs", type=int, default=50, help="Distinct random run_ids (ignored with --run-ids)")
+    parser.add_argument("--run-ids", help="File with one run_id per line")
+    parser.add_argument("--models", default=DEFAULT_MODELS, help="Comma-separated models to mix")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to generate load")
+    parser.add_argument("--stream-ratio", type=float, default=0.4, help="Fraction of calls that stream")
+    parser.add_argument("--embedding-ratio", type=float, default=0.2, help="Fraction of calls that embed")
+    parser.add_argument("--max-turns", type=int, default=20, help="Turns before an agent starts a new conversation")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean seconds an agent waits between calls")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--max-p95", type=float, help="Fail if p95 latency of successful requests exceeds this")
+    parser.add_argument("--min-rps", type=float, help="Fail if successful requests per second are below this")
+    parser.add_argument("--max-error-rate", type=float, help="Fail if this fraction of requests or more fail")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2))
+
+    failures = []
+    if args.max_p95 is not None and report["p95_seconds"] > args.max_p95:
+        failures.append(f"p95 latency {report['p95_seconds']}s exceeds {args.max_p95}s")
+    if args.min_rps is not None and report["rps"] < args.min_rps:
+        failures.append(f"throughput {report['rps']} rps is below {args.min_rps}")
+    if args.max_error_rate is not None and report["error_rate"] >= args.max_error_rate:
+        failures.append(f"error rate {report['error_rate']} is not below {args.max_error_rate}")
+    if report["successful_requests"] == 0:
+        failures.append("no request succeeded")
+    if failures:
+        print("FAILED: " + "; ".join(failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
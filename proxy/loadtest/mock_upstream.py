@@ -0,0 +1,157 @@
+"""
+Mock Chutes upstream for load testing the proxy without spending money.
+
+Implements the chat-completions (streaming SSE and buffered) and embed APIs
+with configurable latency distributions, error rates and token counts. Run it,
+then start the proxy with CHUTES_INFERENCE_URL and CHUTES_EMBEDDING_URL
+pointed at it:
+
+    python proxy/loadtest/mock_upstream.py --port 9100 --error-rate 0.01
+    CHUTES_INFERENCE_URL=http://127.0.0.1:9100/v1/chat/completions \\
+    CHUTES_EMBEDDING_URL=http://127.0.0.1:9100/embed \\
+    CHUTES_API_KEY=mock python -m proxy.main
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Any, Dict, List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = ("the", "patch", "fixes", "a", "bug", "in", "parser", "module", "test", "passes", "now", "with", "change")
+
+
+class MockSettings:
+    """Latency, error and size distributions for the mock upstream"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.ttft_median = args.ttft_median
+        self.ttft_sigma = args.ttft_sigma
+        self.token_interval = args.token_interval
+        self.error_rate = args.error_rate
+        self.error_codes = [int(code) for code in args.error_codes.split(",")]
+        self.min_completion_tokens = args.min_completion_tokens
+        self.max_completion_tokens = args.max_completion_tokens
+        self.embed_latency_median = args.embed_latency_median
+        self.embed_latency_sigma = args.embed_latency_sigma
+        self.embedding_dim = args.embedding_dim
+
+    def time_to_first_token(self) -> float:
+        return random.lognormvariate(0, self.ttft_sigma) * self.ttft_median
+
+    def embed_latency(self) -> float:
+        return random.lognormvariate(0, self.embed_latency_sigma) * self.embed_latency_median
+
+    def completion_tokens(self, max_tokens: int) -> int:
+        return min(max_tokens, random.randint(self.min_completion_tokens, self.max_completion_tokens))
+
+    def error(self) -> int:
+        """An HTTP status to fail with, or 0 to succeed"""
+        return random.choice(self.error_codes) if random.random() < self.error_rate else 0
+
+
+def prompt_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(len(str(message.get("content", ""))) // 4 + 4 for message in messages) + 3
+
+
+def create_app(settings: MockSettings) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        status = settings.error()
+        if status:
+            return JSONResponse({"detail": f"mock upstream error {status}"}, status_code=status)
+
+        model = body.get("model", "mock")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        usage_prompt = prompt_tokens(body.get("messages", []))
+        completion = settings.completion_tokens(int(body.get("max_tokens") or 1024))
+        usage = {
+            "prompt_tokens": usage_prompt,
+            "completion_tokens": completion,
+            "total_tokens": usage_prompt + completion,
+        }
+
+        if not body.get("stream"):
+            await asyncio.sleep(settings.time_to_first_token() + completion * settings.token_interval)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(random.choices(WORDS, k=completion))},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            }
+
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        async def events():
+            await asyncio.sleep(settings.time_to_first_token())
+            for index in range(completion):
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "delta": {"content": random.choice(WORDS) + " "},
+                        "finish_reason": "stop" if index == completion - 1 else None,
+                    }],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                if settings.token_interval:
+                    await asyncio.sleep(settings.token_interval)
+            if include_usage:
+                yield f"data: {json.dumps({'id': completion_id, 'model': model, 'choices': [], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/embed")
+    async def embed(request: Request):
+        body = await request.json()
+        status = settings.error()
+        if status:
+            return JSONResponse({"detail": f"mock upstream error {status}"}, status_code=status)
+
+        inputs = body.get("inputs")
+        count = len(inputs) if isinstance(inputs, list) else 1
+        await asyncio.sleep(settings.embed_latency())
+        return [[random.random() for _ in range(settings.embedding_dim)] for _ in range(count)]
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mock Chutes upstream for proxy load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--ttft-median", type=float, default=0.5, help="Median time to first token in seconds")
+    parser.add_argument("--ttft-sigma", type=float, default=0.5, help="Log-normal sigma of time to first token")
+    parser.add_argument("--token-interval", type=float, default=0.005, help="Seconds between streamed tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-codes", default="429,500,503", help="Comma-separated statuses used for failures")
+    parser.add_argument("--min-completion-tokens", type=int, default=50)
+    parser.add_argument("--max-completion-tokens", type=int, default=400)
+    parser.add_argument("--embed-latency-median", type=float, default=0.05)
+    parser.add_argument("--embed-latency-sigma", type=float, default=0.3)
+    parser.add_argument("--embedding-dim", type=int, default=1024)
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(MockSettings(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,32 @@
 from dotenv import load_dotenv
 load_dotenv("proxy/.env")
 
+import asyncio
+import json
+import math
 import os
 from loggers.logging_utils import get_logger
 import sys
+import time
 import uvicorn
 from contextlib import asynccontextmanager
+from typing import List, Optional
 from uuid import UUID
 
 from fastapi import FastAPI, HTTPException
-from proxy.config import ENV, SERVER_HOST, SERVER_PORT, LOG_LEVEL, MAX_COST_PER_RUN, DEFAULT_MODEL, DEFAULT_TEMPERATURE
-from proxy.database import db_manager, get_evaluation_run_by_id, get_total_inference_cost, get_total_embedding_cost
-from proxy.chutes_client import ChutesClient
-from proxy.models import EmbeddingRequest, InferenceRequest, SandboxStatus
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from proxy.config import ENV, SERVER_HOST, SERVER_PORT, PROXY_WORKERS, SHARED_STATE_PATH, LOG_LEVEL, MAX_COST_PER_RUN, DEFAULT_MODEL, DEFAULT_TEMPERATURE, EMBEDDING_BATCH_SIZE
+from proxy.database import db_manager, write_queue
+from proxy.run_cache import run_cache
+from proxy.response_cache import response_cache
+from proxy.embedding_cache import embedding_cache
+from proxy.rate_limiter import RateLimitExceeded, Reservation, request_limiter
+from proxy.shared_state import SharedRunStore, shared_run_store
+from proxy.tokenizer import PromptPlan, PromptRejected, token_estimator
+from proxy.providers import provider_router
+from proxy.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, metrics
+from proxy.chutes_client import ChutesClient, InferenceError
+from proxy.models import EmbeddingRequest, EmbeddingBatchRequest, GPTMessage, InferenceRequest, RunState, SandboxStatus
 
 
 
@@ -26,9 +40,13 @@ async def lifespan(app: FastAPI):
     """Manage application lifespan - startup and shutdown"""
     # Startup
     logger.info("Starting proxy server...")
+    await asyncio.to_thread(token_estimator.load)
+    await chutes_client.open()
     if ENV != 'dev':
         await db_manager.open()
         logger.info("Database connection established")
+        await write_queue.start()
+        await run_cache.start_listener()
     else:
         logger.info("Running in dev mode - skipping database connection")
     
@@ -36,7 +54,12 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("Shutting down proxy server...")
+    await chutes_client.close()
+    if shared_run_store:
+        shared_run_store.close()
     if ENV != 'dev':
+        await run_cache.stop_listener()
+        await write_queue.close()
         await db_manager.close()
         logger.info("Database connection closed")
     else:
@@ -44,47 +67,119 @@ async def lifespan(app: FastAPI):
 
 app = FastAPI(lifespan=lifespan)
 
+def _http_pool_gauge():
+    stats = chutes_client.pool_stats()
+    if not stats["open"]:
+        return {}
+    gauge = {("max",): stats["max_connections"]}
+    if stats["connections"] is not None:
+        idle = stats["idle_connections"]
+        gauge[("active",)] = stats["connections"] - idle
+        gauge[("idle",)] = idle
+    return gauge
+
+def _db_pool_gauge():
+    stats = db_manager.pool_stats()
+    return {
+        ("active",): stats["size"] - stats["idle"],
+        ("idle",): stats["idle"],
+        ("max",): stats["max"],
+    }
+
+metrics.register_gauge(
+    "proxy_http_pool_connections", "Upstream httpx connection pool utilization.", ("state",), _http_pool_gauge,
+)
+if ENV != 'dev':
+    metrics.register_gauge(
+        "proxy_db_pool_connections", "asyncpg connection pool utilization.", ("state",), _db_pool_gauge,
+    )
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return "OK"
+    health = {
+        "status": "OK",
+        "chutes_pool": chutes_client.pool_stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "limiter": await request_limiter.stats(),
+        "providers": provider_router.stats(),
+        "coalescing": chutes_client.coalescing_stats(),
+    }
+    if run_cache:
+        health["run_cache"] = run_cache.stats()
+        health["write_queue"] = write_queue.stats()
+    if response_cache:
+        health["response_cache"] = response_cache.stats()
+    return health
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics endpoint"""
+    return PlainTextResponse(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+async def check_run_admission(run_id: str, request_type: str) -> RunState:
+    """Validate that an evaluation run may make another embedding/inference request"""
+    # Get evaluation run state from the admission cache (loaded from the database on a miss)
+    run_uuid = UUID(run_id)
+    start_time = time.perf_counter()
+    evaluation_run = await run_cache.get(run_uuid)
+    metrics.admission_check_duration.observe(time.perf_counter() - start_time, type=request_type)
+    
+    if not evaluation_run:
+        logger.warning(f"{request_type.capitalize()} request for run_id {run_id} - evaluation run not found")
+        raise HTTPException(status_code=404, detail="Evaluation run not found")
+    
+    # Check if evaluation run is in the correct state
+    if evaluation_run.status != SandboxStatus.sandbox_created:
+        logger.warning(f"{request_type.capitalize()} request for run_id {run_id} - invalid status: {evaluation_run.status}")
+        raise HTTPException(
+            status_code=400,
+            detail=f"Evaluation run is not in the sandbox_created state. Current status: {evaluation_run.status}"
+        )
+    
+    # Check cost limits at FastAPI level
+    if request_type == "embedding":
+        current_cost, requested = evaluation_run.embedding_cost, "embeddings"
+    else:
+        current_cost, requested = evaluation_run.inference_cost, "inference"
+    if current_cost > MAX_COST_PER_RUN:
+        logger.warning(f"{request_type.capitalize()} request for run_id {run_id} exceeded cost limit: ${current_cost:.6f}")
+        raise HTTPException(
+            status_code=429,
+            detail=f"Agent version has reached the maximum cost ({MAX_COST_PER_RUN}) for this evaluation run. Please do not request more {requested}."
+        )
+    
+    return evaluation_run
+
+async def acquire_request_limits(run_state: Optional[RunState], model: str, request_type: str, estimated_cost: float) -> Reservation:
+    """Take a concurrency slot, rate token and cost reservation for a request"""
+    run_uuid = run_state.run_id if run_state else None
+    spent_cost = 0.0
+    if run_state:
+        spent_cost = run_state.embedding_cost if request_type == "embedding" else run_state.inference_cost
+    try:
+        return await request_limiter.acquire(run_uuid, model, request_type, estimated_cost, spent_cost)
+    except RateLimitExceeded as e:
+        logger.warning(f"{request_type.capitalize()} request for run_id {run_uuid} refused by limiter: {e.detail}")
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
 
 @app.post("/agents/embedding")
 async def embedding_endpoint(request: EmbeddingRequest):
     """Proxy endpoint for chutes embedding with database validation"""
     try:
         if ENV != 'dev' and request.run_id:
-            # Get evaluation run from database
-            evaluation_run = await get_evaluation_run_by_id(request.run_id)
-            
-            if not evaluation_run:
-                logger.warning(f"Embedding request for run_id {request.run_id} - evaluation run not found")
-                raise HTTPException(status_code=404, detail="Evaluation run not found")
-            
-            # Check if evaluation run is in the correct state
-            if evaluation_run.status != SandboxStatus.sandbox_created:
-                logger.warning(f"Embedding request for run_id {request.run_id} - invalid status: {evaluation_run.status}")
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Evaluation run is not in the sandbox_created state. Current status: {evaluation_run.status}"
-                )
-            
-            # Check cost limits at FastAPI level
-            run_uuid = UUID(request.run_id)
-            current_cost = await get_total_embedding_cost(run_uuid)
-            if current_cost > MAX_COST_PER_RUN:
-                logger.warning(f"Embedding request for run_id {request.run_id} exceeded cost limit: ${current_cost:.6f}")
-                raise HTTPException(
-                    status_code=429,
-                    detail=f"Agent version has reached the maximum cost ({MAX_COST_PER_RUN}) for this evaluation run. Please do not request more embeddings."
-                )
-            
-            # Get embedding from chutes
-            embedding_result = await chutes_client.embed(run_uuid, request.input)
+            run_state = await check_run_admission(request.run_id, "embedding")
         else:
             # In dev mode or when run_id is None, skip all run_id operations
             logger.info(f"Dev mode or no run_id: skipping run_id validation for embedding request")
-            embedding_result = await chutes_client.embed(None, request.input)
+            run_state = None
+        
+        reservation = await acquire_request_limits(run_state, "embedding", "embedding", chutes_client.estimate_embedding_cost(1))
+        try:
+            # Get embedding from chutes
+            embedding_result = await chutes_client.embed(run_state.run_id if run_state else None, request.input)
+        finally:
+            await request_limiter.release(reservation)
         
         logger.info(f"Embedding request completed successfully")
         return embedding_result
@@ -98,6 +193,71 @@ async def embedding_endpoint(request: EmbeddingRequest):
             detail="Failed to get embedding due to internal server error. Please try again later."
         )
 
+@app.post("/agents/embedding/batch")
+async def embedding_batch_endpoint(request: EmbeddingBatchRequest):
+    """Proxy endpoint for embedding a list of texts, deduplicated and cached"""
+    try:
+        if ENV != 'dev' and request.run_id:
+            run_state = await check_run_admission(request.run_id, "embedding")
+        else:
+            # In dev mode or when run_id is None, skip all run_id operations
+            logger.info(f"Dev mode or no run_id: skipping run_id validation for batch embedding request")
+            run_state = None
+        
+        upstream_calls = math.ceil(len(request.inputs) / EMBEDDING_BATCH_SIZE)
+        reservation = await acquire_request_limits(
+            run_state, "embedding", "embedding", chutes_client.estimate_embedding_cost(upstream_calls)
+        )
+        try:
+            embedding_result = await chutes_client.embed_batch(run_state.run_id if run_state else None, request.inputs)
+        finally:
+            await request_limiter.release(reservation)
+        
+        logger.info(f"Batch embedding request for {len(request.inputs)} texts completed")
+        return embedding_result
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error processing batch embedding request for run_id {request.run_id}: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail="Failed to get embeddings due to internal server error. Please try again later."
+        )
+
+class ReservedStreamingResponse(StreamingResponse):
+    """Streaming response that releases its limiter reservation however the response ends.
+
+    The stream releases the reservation as soon as the upstream completion
+    finishes, but its body is never iterated if the client disconnects before
+    the response starts, so the response releases it again (a no-op if already
+    released) once it is closed.
+    """
+
+    def __init__(self, content, reservation: Reservation, **kwargs):
+        super().__init__(content, **kwargs)
+        self.reservation = reservation
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await request_limiter.release(self.reservation)
+
+async def stream_inference(run_id: Optional[UUID], plan: PromptPlan, temperature: float, model: str,
+                           reservation: Reservation):
+    """Forward upstream completion chunks to the caller as server-sent events"""
+    try:
+        async for chunk_data, _ in chutes_client.inference_stream(
+            run_id, plan.messages, temperature, model, plan.max_tokens, plan.prompt_tokens
+        ):
+            yield f"data: {chunk_data}\n\n"
+    except InferenceError as e:
+        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    finally:
+        await request_limiter.release(reservation)
+    yield "data: [DONE]\n\n"
+
 @app.post("/agents/inference")
 async def inference_endpoint(request: InferenceRequest):
     """Proxy endpoint for chutes inference with database validation"""
@@ -106,51 +266,50 @@ async def inference_endpoint(request: InferenceRequest):
         
         if ENV != 'dev' and request.run_id:
             logger.info(f"Taking production path with run_id validation")
-            # Get evaluation run from database
-            run_uuid = UUID(request.run_id)
-            evaluation_run = await get_evaluation_run_by_id(request.run_id)
-            
-            if not evaluation_run:
-                logger.warning(f"Inference request for run_id {request.run_id} - evaluation run not found")
-                raise HTTPException(status_code=404, detail="Evaluation run not found")
-            
-            # Check if evaluation run is in the correct state
-            if evaluation_run.status != SandboxStatus.sandbox_created:
-                logger.warning(f"Inference request for run_id {request.run_id} - invalid status: {evaluation_run.status}")
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Evaluation run is not in the sandbox_created state. Current status: {evaluation_run.status}"
-                )
-            
-            # Check cost limits at FastAPI level
-            current_cost = await get_total_inference_cost(run_uuid)
-            if current_cost > MAX_COST_PER_RUN:
-                logger.warning(f"Inference request for run_id {request.run_id} exceeded cost limit: ${current_cost:.6f}")
-                raise HTTPException(
-                    status_code=429,
-                    detail=f"Agent version has reached the maximum cost ({MAX_COST_PER_RUN}) for this evaluation run. Please do not request more inference."
-                )
-            
-            # Get inference from chutes (use defaults if None)
-            temperature = request.temperature if request.temperature is not None else DEFAULT_TEMPERATURE
-            model = request.model if request.model is not None else DEFAULT_MODEL
-            inference_result = await chutes_client.inference(
-                run_uuid,
-                request.messages,
-                temperature,
-                model
-            )
+            run_state = await check_run_admission(request.run_id, "inference")
         else:
             # In dev mode or when run_id is None, skip all run_id operations
             logger.info(f"Taking dev path - ENV: {ENV}, run_id: {request.run_id}")
-            temperature = request.temperature if request.temperature is not None else DEFAULT_TEMPERATURE
-            model = request.model if request.model is not None else DEFAULT_MODEL
+            run_state = None
+        run_uuid = run_state.run_id if run_state else None
+        
+        # Get inference from chutes (use defaults if None)
+        temperature = request.temperature if request.temperature is not None else DEFAULT_TEMPERATURE
+        model = request.model if request.model is not None else DEFAULT_MODEL
+        
+        # Count prompt tokens up front so oversized or unaffordable prompts never reach upstream
+        remaining_budget = MAX_COST_PER_RUN - run_state.inference_cost if run_state else None
+        try:
+            plan = await token_estimator.plan(model, request.messages, remaining_budget)
+        except PromptRejected as e:
+            logger.warning(f"Inference request for run_id {run_uuid} rejected before dispatch: {e.detail}")
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        
+        reservation = await acquire_request_limits(run_state, model, "inference", plan.estimated_cost)
+        
+        if request.stream:
+            logger.info(f"Streaming inference response")
+            try:
+                return ReservedStreamingResponse(
+                    stream_inference(run_uuid, plan, temperature, model, reservation),
+                    reservation,
+                    media_type="text/event-stream",
+                )
+            except BaseException:
+                await request_limiter.release(reservation)
+                raise
+        
+        try:
             inference_result = await chutes_client.inference(
-                None,
-                request.messages,
+                run_uuid,
+                plan.messages,
                 temperature,
-                model
+                model,
+                plan.max_tokens,
+                plan.prompt_tokens,
             )
+        finally:
+            await request_limiter.release(reservation)
         
         logger.info(f"Inference request completed successfully")
         
@@ -167,5 +326,10 @@ async def inference_endpoint(request: InferenceRequest):
         )
 
 if __name__ == "__main__":
-    print(f"Starting Chutes Proxy Server on {SERVER_HOST}:{SERVER_PORT}")
-    uvicorn.run(app, host=SERVER_HOST, port=SERVER_PORT) 
\ No newline at end of file
+    print(f"Starting Chutes Proxy Server on {SERVER_HOST}:{SERVER_PORT} with {PROXY_WORKERS} worker(s)")
+    if PROXY_WORKERS > 1:
+        # Start from clean shared limiter state; workers import the app by path so each gets its own loop
+        SharedRunStore.reset(SHARED_STATE_PATH)
+        uvicorn.run("proxy.main:app", host=SERVER_HOST, port=SERVER_PORT, workers=PROXY_WORKERS)
+    else:
+        uvicorn.run(app, host=SERVER_HOST, port=SERVER_PORT) 
\ No newline at end of file
@@ -0,0 +1,121 @@
+import hashlib
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+
+from proxy.config import (
+    RUN_CACHE_MAX_ENTRIES,
+    MESSAGE_BLOB_CACHE_ENTRIES,
+    MESSAGE_BLOB_MIN_CHARS,
+    MESSAGE_HISTORY_RECENT_PER_RUN,
+    WRITE_BEHIND_MAX_PENDING,
+)
+
+
+class EncodedMessages:
+    """How one inference's messages are stored: appended messages relative to a predecessor"""
+
+    def __init__(self, parent_id: Optional[UUID], message_offset: int, messages: List[Dict[str, str]],
+                 new_blobs: Dict[str, str]):
+        self.parent_id = parent_id
+        self.message_offset = message_offset
+        self.messages = messages
+        self.new_blobs = new_blobs
+
+
+class MessageHistoryEncoder:
+    """Delta-encodes inference message histories.
+
+    Agent conversations grow by appending, so each inference's messages usually
+    start with the full message list of an earlier inference in the same run.
+    Such an inference stores only a reference to that predecessor, the number
+    of messages inherited from it, and the appended messages. Message contents
+    of at least MESSAGE_BLOB_MIN_CHARS (typically the system prompt and problem
+    statement) are stored once in inference_message_blobs, keyed by their
+    SHA-256, and referenced by hash.
+
+    The last few inferences of each run are remembered in process; a run whose
+    predecessor is not known here (another worker, a restart) simply starts a
+    new chain with its full message list. Inferences and blobs only become
+    known once ``confirm`` reports their rows written, so nothing references a
+    row that is still buffered, being retried or was dead-lettered; until
+    then a blob's contents are sent again with every inference that uses it.
+    """
+
+    def __init__(self, max_runs: int = RUN_CACHE_MAX_ENTRIES, recent_per_run: int = MESSAGE_HISTORY_RECENT_PER_RUN,
+                 blob_min_chars: int = MESSAGE_BLOB_MIN_CHARS, max_blobs: int = MESSAGE_BLOB_CACHE_ENTRIES,
+                 max_unconfirmed: int = WRITE_BEHIND_MAX_PENDING):
+        self.max_runs = max_runs
+        self.recent_per_run = recent_per_run
+        self.blob_min_chars = blob_min_chars
+        self.max_blobs = max_blobs
+        self.max_unconfirmed = max_unconfirmed
+        self._runs: "OrderedDict[UUID, Deque[Tuple[UUID, Tuple[str, ...]]]]" = OrderedDict()
+        self._known_blobs: "OrderedDict[str, None]" = OrderedDict()
+        # Inferences encoded but not yet written: inference id -> (run id, message digests)
+        self._unconfirmed: "OrderedDict[UUID, Tuple[Optional[UUID], Tuple[str, ...]]]" = OrderedDict()
+
+    @staticmethod
+    def content_hash(content: str) -> str:
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    @classmethod
+    def message_digest(cls, message: Dict[str, str]) -> str:
+        return cls.content_hash(f"{message['role']}\0{message['content']}")
+
+    def encode(self, run_id: Optional[UUID], inference_id: UUID, messages: List[Dict[str, str]]) -> EncodedMessages:
+        digests = tuple(self.message_digest(message) for message in messages)
+
+        parent_id, offset = None, 0
+        recent = self._runs.get(run_id)
+        if recent is not None:
+            self._runs.move_to_end(run_id)
+            for candidate_id, candidate_digests in recent:
+                length = len(candidate_digests)
+                if offset < length <= len(digests) and digests[:length] == candidate_digests:
+                    parent_id, offset = candidate_id, length
+        self._unconfirmed[inference_id] = (run_id, digests)
+        while len(self._unconfirmed) > self.max_unconfirmed:
+            self._unconfirmed.popitem(last=False)
+
+        stored, new_blobs = [], {}
+        for message in messages[offset:]:
+            content = message["content"]
+            if len(content) < self.blob_min_chars:
+                stored.append(message)
+                continue
+            digest = self.content_hash(content)
+            stored.append({"role": message["role"], "content_ref": digest})
+            if digest in self._known_blobs:
+                self._known_blobs.move_to_end(digest)
+            else:
+                new_blobs[digest] = content
+
+        return EncodedMessages(parent_id, offset, stored, new_blobs)
+
+    def confirm(self, blob_hashes: Iterable[str], inference_ids: Iterable[UUID]) -> None:
+        """Mark blobs and inferences as written, so later inferences may reference them"""
+        for digest in blob_hashes:
+            self._known_blobs[digest] = None
+            self._known_blobs.move_to_end(digest)
+        while len(self._known_blobs) > self.max_blobs:
+            self._known_blobs.popitem(last=False)
+
+        for inference_id in inference_ids:
+            unconfirmed = self._unconfirmed.pop(inference_id, None)
+            if unconfirmed is None:
+                continue
+            run_id, digests = unconfirmed
+            recent = self._runs.get(run_id)
+            if recent is not None:
+                self._runs.move_to_end(run_id)
+            else:
+                recent = deque(maxlen=self.recent_per_run)
+                self._runs[run_id] = recent
+                while len(self._runs) > self.max_runs:
+                    self._runs.popitem(last=False)
+            recent.appendleft((inference_id, digests))
+
+
+# Global message history encoder
+message_history = MessageHistoryEncoder()
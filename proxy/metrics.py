@@ -0,0 +1,170 @@
+import bisect
+import math
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Prometheus text exposition format, rendered by hand to avoid a client library dependency
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Monotonically increasing value per label set"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    """Bucketed observations per label set, with running sum and count"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: per-bucket counts (last slot is +Inf), sum
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = ([0] * (len(self.buckets) + 1), [0.0])
+            self._values[key] = entry
+        counts, total = entry
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def samples(self) -> Iterable[str]:
+        bucket_labels = self.labelnames + ("le",)
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(bucket_labels, key + (_format_value(bound),))} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total[0])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class CallbackGauge(Metric):
+    """Gauge whose values are read from a callback at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 callback: Callable[[], Dict[LabelValues, float]]):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def samples(self) -> Iterable[str]:
+        for key, value in sorted(self.callback().items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class ProxyMetrics:
+    """Process-wide request, upstream, cost and pool metrics for the /metrics endpoint"""
+
+    def __init__(self):
+        self.requests = Counter(
+            "proxy_requests_total", "Embedding and inference requests handled.", ("type", "model", "outcome"),
+        )
+        self.request_duration = Histogram(
+            "proxy_request_duration_seconds", "Total time to serve a request.", ("type", "model"),
+        )
+        self.time_to_first_token = Histogram(
+            "proxy_time_to_first_token_seconds", "Time from request start to the first completion token.",
+            ("model", "provider"),
+        )
+        self.tokens = Counter(
+            "proxy_tokens_total", "Prompt and completion tokens billed for upstream completions.",
+            ("model", "provider", "kind"),
+        )
+        self.upstream_errors = Counter(
+            "proxy_upstream_errors_total", "Failed upstream calls by provider and status code or error kind.",
+            ("provider", "code"),
+        )
+        self.cost = Counter(
+            "proxy_cost_dollars_total", "Cost billed to evaluation runs.", ("type", "model"),
+        )
+        self.admission_check_duration = Histogram(
+            "proxy_admission_check_seconds", "Time spent in run admission checks, including database loads.",
+            ("type",), buckets=FAST_BUCKETS,
+        )
+        self.dead_letter_records = Counter(
+            "proxy_write_dead_letter_records_total",
+            "Buffered records that could not be written to the database and were dead-lettered.", ("kind",),
+        )
+        self._metrics: List[Metric] = [
+            self.requests,
+            self.request_duration,
+            self.time_to_first_token,
+            self.tokens,
+            self.upstream_errors,
+            self.cost,
+            self.admission_check_duration,
+            self.dead_letter_records,
+        ]
+
+    def register_gauge(self, name: str, documentation: str, labelnames: Sequence[str],
+                       callback: Callable[[], Dict[LabelValues, float]]) -> None:
+        self._metrics.append(CallbackGauge(name, documentation, labelnames, callback))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+# Global metrics registry
+metrics = ProxyMetrics()
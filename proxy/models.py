@@ -5,12 +5,21 @@ from datetime import datetime
 
 from pydantic import BaseModel, Field
 from api.src.backend.entities import SandboxStatus
+from proxy.config import EMBEDDING_BATCH_MAX_INPUTS
 
 class EvaluationRun(BaseModel):
     """Model for evaluation run data"""
     run_id: UUID
     status: SandboxStatus
 
+class RunState(BaseModel):
+    """Cached admission state for an evaluation run"""
+    run_id: UUID
+    status: SandboxStatus
+    inference_cost: float = 0.0
+    embedding_cost: float = 0.0
+    loaded_at: float = Field(..., description="Monotonic time the entry was loaded from the database")
+
 class GPTMessage(BaseModel):
     """Model for GPT message structure"""
     role: str = Field(..., description="Role of the message (user, assistant, system)")
@@ -21,12 +30,18 @@ class EmbeddingRequest(BaseModel):
     input: str = Field(..., description="Text to embed")
     run_id: Optional[str] = Field(None, description="Evaluation run ID")
 
+class EmbeddingBatchRequest(BaseModel):
+    """Model for batch embedding request"""
+    inputs: List[str] = Field(..., min_length=1, max_length=EMBEDDING_BATCH_MAX_INPUTS, description="Texts to embed")
+    run_id: Optional[str] = Field(None, description="Evaluation run ID")
+
 class InferenceRequest(BaseModel):
     """Model for inference request"""
     run_id: Optional[str] = Field(None, description="Evaluation run ID")
     model: Optional[str] = Field(None, description="Model to use for inference")
     temperature: Optional[float] = Field(None, description="Temperature for inference")
     messages: List[GPTMessage] = Field(..., description="Messages to send to the model")
+    stream: bool = Field(False, description="Stream the completion back as server-sent events")
 
 class Embedding(BaseModel):
     """Model for embedding data stored in database"""
@@ -48,6 +63,8 @@ class Inference(BaseModel):
     cost: Optional[float] = Field(None, description="Cost of the inference")
     response: Optional[str] = Field(None, description="Response from the inference API")
     total_tokens: Optional[int] = Field(None, description="Total tokens used")
+    prompt_tokens: Optional[int] = Field(None, description="Prompt (input) tokens used")
+    completion_tokens: Optional[int] = Field(None, description="Completion (output) tokens used")
     created_at: datetime = Field(..., description="When the inference was created")
     finished_at: Optional[datetime] = Field(None, description="When the inference was completed")
 
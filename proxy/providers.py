@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from proxy.config import (
+    CHUTES_API_KEY,
+    CHUTES_INFERENCE_URL,
+    MODEL_PRICING,
+    MODEL_OUTPUT_PRICING,
+    TARGON_API_KEY,
+    TARGON_INFERENCE_URL,
+    TARGON_FALLBACK_MODELS,
+    TARGON_PRICING,
+    TARGON_OUTPUT_PRICING,
+    PROVIDER_FIRST_TOKEN_TIMEOUT,
+    PROVIDER_EWMA_ALPHA,
+    PROVIDER_ERROR_THRESHOLD,
+    HEDGE_ENABLED,
+    HEDGE_PERCENTILE,
+    HEDGE_MIN_DELAY,
+    HEDGE_DEFAULT_DELAY,
+    HEDGE_MIN_SAMPLES,
+)
+from proxy.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamError(Exception):
+    """Raised when a provider answers a completion request with a non-200 status"""
+
+    def __init__(self, provider: str, status_code: int, message: str):
+        super().__init__(f"{provider} returned {status_code}: {message}")
+        self.provider = provider
+        self.status_code = status_code
+        self.message = message
+
+
+class Provider:
+    """An OpenAI-compatible chat-completions upstream and its observed health"""
+
+    def __init__(self, name: str, url: str, api_key: str, pricing: Dict[str, float],
+                 output_pricing: Optional[Dict[str, float]] = None):
+        self.name = name
+        self.url = url
+        self.api_key = api_key
+        self.pricing = pricing
+        self.output_pricing = output_pricing or pricing
+        self.latency_ewma: Optional[float] = None
+        self.error_ewma = 0.0
+        self.requests = 0
+        self.errors = 0
+        self._first_token_latencies: deque = deque(maxlen=200)
+
+    def supports(self, model: str) -> bool:
+        return bool(self.api_key) and model in self.pricing
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        """Cost of a completion on this provider, with input and output tokens at their own rates"""
+        output_price = self.output_pricing.get(model, self.pricing[model])
+        return (prompt_tokens * self.pricing[model] + completion_tokens * output_price) / 1_000_000
+
+    def headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    def record_success(self, first_token_latency: float) -> None:
+        self.requests += 1
+        self._first_token_latencies.append(first_token_latency)
+        if self.latency_ewma is None:
+            self.latency_ewma = first_token_latency
+        else:
+            self.latency_ewma += PROVIDER_EWMA_ALPHA * (first_token_latency - self.latency_ewma)
+        self.error_ewma += PROVIDER_EWMA_ALPHA * (0.0 - self.error_ewma)
+
+    def record_failure(self) -> None:
+        self.requests += 1
+        self.errors += 1
+        self.error_ewma += PROVIDER_EWMA_ALPHA * (1.0 - self.error_ewma)
+
+    def healthy(self) -> bool:
+        return self.error_ewma < PROVIDER_ERROR_THRESHOLD
+
+    def hedge_delay(self) -> float:
+        """Time to wait for a first token before hedging: a high percentile of recent first-token latency"""
+        if len(self._first_token_latencies) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        latencies = sorted(self._first_token_latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * HEDGE_PERCENTILE))
+        return max(HEDGE_MIN_DELAY, latencies[index])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "latency_ewma": self.latency_ewma,
+            "error_ewma": self.error_ewma,
+            "healthy": self.healthy(),
+            "hedge_delay": self.hedge_delay(),
+        }
+
+
+class UpstreamStream:
+    """An upstream completion stream that has already produced its first data line"""
+
+    def __init__(self, provider: Provider, response: httpx.Response, first_lines: List[str], lines: AsyncIterator[str]):
+        self.provider = provider
+        self.response = response
+        self._first_lines = first_lines
+        self._lines = lines
+
+    async def lines(self) -> AsyncIterator[str]:
+        for line in self._first_lines:
+            yield line
+        async for line in self._lines:
+            yield line
+
+    async def aclose(self) -> None:
+        await self.response.aclose()
+
+
+class ProviderRouter:
+    """Routes completion requests across providers.
+
+    Providers that support the model are tried in order of health and
+    first-token latency EWMA, falling back to the next one on an error or a
+    first-token timeout. With hedging enabled, a second provider is started
+    once the first has been silent for longer than its recent latency
+    percentile; whichever produces a first token first wins and the other
+    request is cancelled.
+    """
+
+    def __init__(self, providers: List[Provider]):
+        self.providers = providers
+        self.hedged_requests = 0
+        self.hedges_won = 0
+
+    def worst_case_cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        """Highest cost of a completion across the providers that could serve it"""
+        return max(
+            (p.cost(model, prompt_tokens, completion_tokens) for p in self.providers if p.supports(model)),
+            default=0.0,
+        )
+
+    def candidates(self, model: str) -> List[Provider]:
+        supported = [p for p in self.providers if p.supports(model)]
+        # Unhealthy providers go last; otherwise prefer lower latency, keeping configured order for ties
+        return sorted(
+            supported,
+            key=lambda p: (not p.healthy(), p.latency_ewma if p.latency_ewma is not None else 0.0),
+        )
+
+    async def open_inference_stream(self, client: httpx.AsyncClient, model: str, body: Dict[str, Any],
+                                    timeout: httpx.Timeout) -> UpstreamStream:
+        """Open a completion stream on the best available provider; raises the last error if all fail"""
+        remaining = self.candidates(model)
+        if not remaining:
+            raise UpstreamError("router", 400, f"No provider configured for model {model}")
+
+        attempts: Dict[asyncio.Task, Provider] = {}
+
+        def start_next() -> None:
+            provider = remaining.pop(0)
+            attempts[asyncio.create_task(self._attempt(client, provider, body, timeout))] = provider
+
+        primary = remaining[0]
+        start_next()
+        hedged = False
+        last_error: Optional[BaseException] = None
+        try:
+            while attempts:
+                wait_timeout = None
+                if HEDGE_ENABLED and not hedged and remaining and len(attempts) == 1:
+                    wait_timeout = next(iter(attempts.values())).hedge_delay()
+
+                done, _ = await asyncio.wait(attempts, timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    self.hedged_requests += 1
+                    logger.info(f"Hedging {model} request on {remaining[0].name} after {wait_timeout:.2f}s without a first token")
+                    start_next()
+                    continue
+
+                for task in done:
+                    provider = attempts.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        if hedged and provider is not primary:
+                            self.hedges_won += 1
+                        return task.result()
+                    provider.record_failure()
+                    metrics.upstream_errors.inc(provider=provider.name, code=self._error_code(error))
+                    last_error = error
+                    logger.warning(f"Provider {provider.name} failed for {model}: {error}")
+
+                if not attempts and remaining:
+                    logger.info(f"Falling back to {remaining[0].name} for {model}")
+                    start_next()
+        finally:
+            for task in attempts:
+                task.cancel()
+            for task in attempts:
+                try:
+                    stream = await task
+                    await stream.aclose()
+                except BaseException:
+                    pass
+
+        raise last_error
+
+    async def _attempt(self, client: httpx.AsyncClient, provider: Provider, body: Dict[str, Any],
+                       timeout: httpx.Timeout) -> UpstreamStream:
+        start_time = time.time()
+        request = client.build_request("POST", provider.url, json=body, headers=provider.headers(), timeout=timeout)
+        response = await client.send(request, stream=True)
+        try:
+            if response.status_code != 200:
+                error_text = await response.aread()
+                raise UpstreamError(provider.name, response.status_code, error_text.decode(errors="replace"))
+
+            lines = response.aiter_lines()
+            first_lines = await asyncio.wait_for(self._read_until_data(lines), timeout=PROVIDER_FIRST_TOKEN_TIMEOUT)
+            provider.record_success(time.time() - start_time)
+            return UpstreamStream(provider, response, first_lines, lines)
+        except BaseException:
+            await response.aclose()
+            raise
+
+    @staticmethod
+    def _error_code(error: BaseException) -> str:
+        if isinstance(error, UpstreamError):
+            return str(error.status_code)
+        if isinstance(error, (asyncio.TimeoutError, httpx.TimeoutException)):
+            return "timeout"
+        return type(error).__name__
+
+    @staticmethod
+    async def _read_until_data(lines: AsyncIterator[str]) -> List[str]:
+        first_lines = []
+        async for line in lines:
+            first_lines.append(line)
+            if line.strip().startswith("data: "):
+                break
+        return first_lines
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hedge_enabled": HEDGE_ENABLED,
+            "hedged_requests": self.hedged_requests,
+            "hedges_won": self.hedges_won,
+            "providers": {p.name: p.stats() for p in self.providers},
+        }
+
+
+# Global provider router: Chutes first, Targon as fallback for the models it serves
+provider_router = ProviderRouter([
+    Provider("chutes", CHUTES_INFERENCE_URL, CHUTES_API_KEY, MODEL_PRICING, MODEL_OUTPUT_PRICING),
+    Provider(
+        "targon",
+        TARGON_INFERENCE_URL,
+        TARGON_API_KEY,
+        {model: price for model, price in TARGON_PRICING.items() if model in TARGON_FALLBACK_MODELS},
+        TARGON_OUTPUT_PRICING,
+    ),
+])
@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from uuid import UUID
+
+from proxy.config import (
+    MAX_COST_PER_RUN,
+    RUN_MAX_CONCURRENT_REQUESTS,
+    RUN_REQUESTS_PER_SECOND,
+    RUN_REQUEST_BURST,
+    MODEL_MAX_CONCURRENT_REQUESTS,
+    MODEL_QUEUE_TIMEOUT_SECONDS,
+    RUN_CACHE_MAX_ENTRIES,
+    PROXY_WORKERS,
+)
+from proxy.shared_state import SharedRunStore, shared_run_store
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request is refused by the limiter"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class TokenBucket:
+    """Classic token bucket: refills at `rate` tokens per second up to `burst`"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def try_take(self, amount: float = 1.0) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+
+class RunLimits:
+    """Live limiter state for one evaluation run"""
+
+    def __init__(self):
+        self.bucket = TokenBucket(RUN_REQUESTS_PER_SECOND, RUN_REQUEST_BURST)
+        self.in_flight = 0
+        self.reserved_cost: Dict[str, float] = {"inference": 0.0, "embedding": 0.0}
+
+
+class Reservation:
+    """Slots and budget held by one admitted request until it is released"""
+
+    def __init__(self, run_id: Optional[UUID], model: str, request_type: str, cost: float):
+        self.run_id = run_id
+        self.model = model
+        self.request_type = request_type
+        self.cost = cost
+        self.released = False
+
+
+class RequestLimiter:
+    """In-process admission limits applied before a request reaches Chutes.
+
+    Per run: at most RUN_MAX_CONCURRENT_REQUESTS in flight, a token bucket of
+    RUN_REQUESTS_PER_SECOND (burst RUN_REQUEST_BURST), and a cost budget in
+    which every in-flight request holds a worst-case reservation, so concurrent
+    requests cannot jointly overshoot MAX_COST_PER_RUN. Requests over a per-run
+    limit are rejected.
+
+    Per model: at most MODEL_MAX_CONCURRENT_REQUESTS in flight across all runs.
+    Excess requests queue for up to MODEL_QUEUE_TIMEOUT_SECONDS before being
+    rejected, so one busy run cannot monopolize a model.
+
+    With a shared store, per-run state lives there so the limits hold across
+    worker processes, and the per-model cap is split evenly between workers.
+    """
+
+    def __init__(self, shared: Optional[SharedRunStore] = None, workers: int = 1):
+        self.shared = shared
+        self.model_limit = max(1, MODEL_MAX_CONCURRENT_REQUESTS // workers)
+        self._runs: "OrderedDict[UUID, RunLimits]" = OrderedDict()
+        self._models: Dict[str, asyncio.Semaphore] = {}
+        self._model_in_flight: Dict[str, int] = {}
+        self.rejected: Dict[str, int] = {"concurrency": 0, "rate": 0, "budget": 0, "model_queue": 0}
+
+    async def acquire(
+        self,
+        run_id: Optional[UUID],
+        model: str,
+        request_type: str,
+        estimated_cost: float = 0.0,
+        spent_cost: float = 0.0,
+    ) -> Reservation:
+        """Admit a request or raise RateLimitExceeded; the caller must release() the result"""
+        if run_id is not None:
+            if self.shared:
+                refusal, spent, reserved = await self.shared.acquire(run_id, request_type, estimated_cost, spent_cost)
+                if refusal:
+                    self._refuse(refusal, run_id, request_type, spent, reserved, estimated_cost)
+            else:
+                limits = self._run_limits(run_id)
+                reserved = limits.reserved_cost[request_type]
+                if limits.in_flight >= RUN_MAX_CONCURRENT_REQUESTS:
+                    self._refuse("concurrency", run_id, request_type, spent_cost, reserved, estimated_cost)
+                if spent_cost + reserved + estimated_cost > MAX_COST_PER_RUN:
+                    self._refuse("budget", run_id, request_type, spent_cost, reserved, estimated_cost)
+                if not limits.bucket.try_take():
+                    self._refuse("rate", run_id, request_type, spent_cost, reserved, estimated_cost)
+
+                limits.in_flight += 1
+                limits.reserved_cost[request_type] += estimated_cost
+
+        reservation = Reservation(run_id, model, request_type, estimated_cost)
+        try:
+            await asyncio.wait_for(self._model_semaphore(model).acquire(), timeout=MODEL_QUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            await self._release_run(reservation)
+            self.rejected["model_queue"] += 1
+            raise RateLimitExceeded(503, f"Model {model} is at capacity. Please try again later.")
+        except BaseException:
+            await self._release_run(reservation)
+            raise
+        self._model_in_flight[model] = self._model_in_flight.get(model, 0) + 1
+        return reservation
+
+    async def release(self, reservation: Reservation) -> None:
+        """Return a reservation's slots and budget; safe to call more than once"""
+        if reservation.released:
+            return
+        reservation.released = True
+        self._model_semaphore(reservation.model).release()
+        self._model_in_flight[reservation.model] -= 1
+        # Shielded so a caller cancelled mid-release (a client disconnect) cannot leak the run's reservation
+        await asyncio.shield(self._release_run(reservation))
+
+    async def record_cost(self, run_id: Optional[UUID], request_type: str, cost: float) -> None:
+        """Add a finished request's cost to the shared run total (a no-op for a single worker)"""
+        if self.shared and run_id is not None:
+            await self.shared.record_cost(run_id, request_type, cost)
+
+    async def stats(self) -> Dict[str, object]:
+        stats = {
+            "tracked_runs": len(self._runs),
+            "in_flight": sum(limits.in_flight for limits in self._runs.values()),
+            "model_in_flight": dict(self._model_in_flight),
+            "rejected": dict(self.rejected),
+        }
+        if self.shared:
+            stats.update(await self.shared.stats())
+        return stats
+
+    def _refuse(self, reason: str, run_id: UUID, request_type: str, spent: float, reserved: float,
+                estimated_cost: float) -> None:
+        self.rejected[reason] += 1
+        if reason == "concurrency":
+            raise RateLimitExceeded(
+                429,
+                f"Too many concurrent requests for this evaluation run (limit {RUN_MAX_CONCURRENT_REQUESTS}). "
+                "Please wait for in-flight requests to finish.",
+            )
+        if reason == "budget":
+            logger.warning(
+                f"{request_type.capitalize()} request for run_id {run_id} would exceed cost limit: "
+                f"spent ${spent:.6f} + reserved ${reserved:.6f} + estimated ${estimated_cost:.6f}"
+            )
+            raise RateLimitExceeded(
+                429,
+                f"This request could exceed the maximum cost ({MAX_COST_PER_RUN}) for this evaluation run "
+                f"(spent ${spent:.4f}, reserved by in-flight requests ${reserved:.4f}).",
+            )
+        raise RateLimitExceeded(
+            429,
+            f"Request rate limit exceeded for this evaluation run ({RUN_REQUESTS_PER_SECOND}/s). Please slow down.",
+        )
+
+    async def _release_run(self, reservation: Reservation) -> None:
+        if reservation.run_id is None:
+            return
+        if self.shared:
+            await self.shared.release(reservation.run_id, reservation.request_type, reservation.cost)
+            return
+        limits = self._runs.get(reservation.run_id)
+        if limits is None:
+            return
+        limits.in_flight -= 1
+        limits.reserved_cost[reservation.request_type] -= reservation.cost
+
+    def _run_limits(self, run_id: UUID) -> RunLimits:
+        limits = self._runs.get(run_id)
+        if limits is None:
+            limits = RunLimits()
+            self._runs[run_id] = limits
+            self._evict_idle_runs()
+        self._runs.move_to_end(run_id)
+        return limits
+
+    def _evict_idle_runs(self) -> None:
+        # Only runs with nothing in flight can be forgotten without losing reservations
+        excess = len(self._runs) - RUN_CACHE_MAX_ENTRIES
+        for run_id in list(self._runs):
+            if excess <= 0:
+                break
+            if self._runs[run_id].in_flight == 0:
+                del self._runs[run_id]
+                excess -= 1
+
+    def _model_semaphore(self, model: str) -> asyncio.Semaphore:
+        semaphore = self._models.get(model)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.model_limit)
+            self._models[model] = semaphore
+        return semaphore
+
+
+# Global request limiter
+request_limiter = RequestLimiter(shared_run_store, PROXY_WORKERS)
@@ -0,0 +1,30 @@
+"""Write the records in the write-behind dead-letter file to the database.
+
+Run with ``python -m proxy.replay_dead_letters`` once whatever made the
+database reject them is fixed. Records that are rejected again stay in the
+file with their new error.
+"""
+import asyncio
+import logging
+import sys
+
+from proxy.config import ENV
+from proxy.database import db_manager, write_queue
+
+
+async def main() -> int:
+    if ENV == 'dev':
+        print("Nothing to replay in dev mode, records are not written to a database")
+        return 1
+    await db_manager.open()
+    try:
+        written, remaining = await write_queue.replay_dead_letters()
+    finally:
+        await db_manager.close()
+    print(f"Replayed {written} dead-lettered records, {remaining} remain in {write_queue.dead_letter_path}")
+    return 1 if remaining else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(main()))
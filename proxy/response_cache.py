@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from proxy.config import (
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_DIR,
+    RESPONSE_CACHE_MEMORY_ENTRIES,
+    RESPONSE_CACHE_DISK_ENTRIES,
+    RESPONSE_CACHE_COST_FACTOR,
+)
+
+logger = logging.getLogger(__name__)
+
+# Prune the disk tier after this many writes rather than on every write
+DISK_PRUNE_INTERVAL = 100
+
+
+class ResponseCache:
+    """Content-addressed cache of deterministic (temperature 0) completions.
+
+    Entries are keyed on the model, normalized messages, temperature and
+    max_tokens. A bounded in-memory LRU sits in front of a directory of JSON
+    files; both tiers are bounded by entry count.
+    """
+
+    def __init__(
+        self,
+        directory: Path = RESPONSE_CACHE_DIR,
+        memory_entries: int = RESPONSE_CACHE_MEMORY_ENTRIES,
+        disk_entries: int = RESPONSE_CACHE_DISK_ENTRIES,
+        cost_factor: float = RESPONSE_CACHE_COST_FACTOR,
+    ):
+        self.directory = Path(directory)
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.cost_factor = cost_factor
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._writes_since_prune = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    @staticmethod
+    def cacheable(temperature: Optional[float]) -> bool:
+        return temperature == 0
+
+    @staticmethod
+    def key(model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> str:
+        """Hash a request into its cache key; whitespace-only differences in messages are ignored"""
+        normalized = [
+            {"role": m["role"].strip().lower(), "content": m["content"].strip()}
+            for m in messages
+        ]
+        payload = json.dumps(
+            {"model": model, "messages": normalized, "temperature": float(temperature), "max_tokens": max_tokens},
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return entry
+
+        entry = await asyncio.to_thread(self._read_disk, key)
+        if entry is not None:
+            self._remember(key, entry)
+            self.disk_hits += 1
+            return entry
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, response: str, total_tokens: int, cost: float,
+                  prompt_tokens: Optional[int] = None, completion_tokens: Optional[int] = None) -> None:
+        entry = {
+            "response": response,
+            "total_tokens": total_tokens,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cost": cost,
+        }
+        self._remember(key, entry)
+        self.stores += 1
+        try:
+            await asyncio.to_thread(self._write_disk, key, entry)
+        except Exception as e:
+            logger.warning(f"Failed to write response cache entry {key}: {e}")
+
+    def hit_cost(self, entry: Dict[str, Any]) -> float:
+        """Cost billed to a run for a response served from the cache"""
+        return entry["cost"] * self.cost_factor
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_entries": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+    def _remember(self, key: str, entry: Dict[str, Any]) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _path(self, key: str) -> Path:
+        # Fan out by prefix so no single directory grows too large
+        return self.directory / key[:2] / f"{key}.json"
+
+    def _read_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            entry = json.loads(path.read_text())
+            # Refresh mtime so disk eviction is least-recently-used
+            os.utime(path)
+            return entry
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Discarding unreadable response cache entry {path}: {e}")
+            path.unlink(missing_ok=True)
+            return None
+
+    def _write_disk(self, key: str, entry: Dict[str, Any]) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(entry))
+        tmp_path.replace(path)
+
+        self._writes_since_prune += 1
+        if self._writes_since_prune >= DISK_PRUNE_INTERVAL:
+            self._writes_since_prune = 0
+            self._prune_disk()
+
+    def _prune_disk(self) -> None:
+        files = []
+        for f in self.directory.glob("*/*.json"):
+            try:
+                files.append((f.stat().st_mtime, f))
+            except FileNotFoundError:
+                continue
+        excess = len(files) - self.disk_entries
+        if excess <= 0:
+            return
+        files.sort()
+        for _, f in files[:excess]:
+            f.unlink(missing_ok=True)
+        logger.info(f"Evicted {excess} response cache entries from {self.directory}")
+
+
+# Global response cache, only created when enabled
+response_cache = ResponseCache() if RESPONSE_CACHE_ENABLED else None
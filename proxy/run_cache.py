@@ -0,0 +1,150 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from uuid import UUID
+
+import asyncpg
+
+from proxy.config import ENV, RUN_CACHE_TTL_SECONDS, RUN_CACHE_MAX_ENTRIES, RUN_STATUS_CHANNEL
+from proxy.database import (
+    db_manager,
+    write_queue,
+    get_evaluation_run_by_id,
+    get_total_inference_cost,
+    get_total_embedding_cost,
+)
+from proxy.models import RunState, SandboxStatus
+
+logger = logging.getLogger(__name__)
+
+
+class RunAdmissionCache:
+    """In-memory run status and running cost totals used by the admission checks.
+
+    Entries are loaded from the database on first use and then kept current in
+    process: costs are incremented as inferences/embeddings finish and status
+    changes arrive over LISTEN/NOTIFY. Entries expire after a TTL so a missed
+    notification can only leave a run stale for a bounded time.
+    """
+
+    def __init__(self, ttl_seconds: float = RUN_CACHE_TTL_SECONDS, max_entries: int = RUN_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[UUID, RunState]" = OrderedDict()
+        self._loading: Dict[UUID, asyncio.Future] = {}
+        self._listener: Optional[asyncpg.Connection] = None
+
+    async def start_listener(self) -> None:
+        """Subscribe to evaluation run status notifications on a dedicated connection"""
+        try:
+            self._listener = await asyncpg.connect(**db_manager.conn_args)
+            await self._listener.add_listener(RUN_STATUS_CHANNEL, self._on_status_notification)
+            logger.info(f"Listening for evaluation run status changes on {RUN_STATUS_CHANNEL}")
+        except Exception as e:
+            # The TTL still bounds staleness, so run without notifications rather than fail startup
+            logger.warning(f"Could not listen on {RUN_STATUS_CHANNEL}, relying on TTL only: {e}")
+            self._listener = None
+
+    async def stop_listener(self) -> None:
+        """Close the notification connection"""
+        if self._listener:
+            await self._listener.close()
+            self._listener = None
+            logger.info("Run status listener closed")
+
+    def _on_status_notification(self, connection, pid, channel, payload: str) -> None:
+        try:
+            data = json.loads(payload)
+            self.set_status(UUID(data["run_id"]), SandboxStatus(data["status"]))
+        except Exception as e:
+            logger.warning(f"Ignoring malformed run status notification {payload!r}: {e}")
+
+    async def get(self, run_id: UUID) -> Optional[RunState]:
+        """Return the admission state for a run, loading it from the database if needed"""
+        state = self._entries.get(run_id)
+        if state is not None and time.monotonic() - state.loaded_at < self.ttl_seconds:
+            self._entries.move_to_end(run_id)
+            return state
+
+        # Collapse concurrent misses for the same run into a single load
+        pending = self._loading.get(run_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[run_id] = future
+        try:
+            state = await self._load(run_id)
+            future.set_result(state)
+            return state
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited failure does not log a warning
+            future.exception()
+            raise
+        finally:
+            self._loading.pop(run_id, None)
+
+    async def _load(self, run_id: UUID) -> Optional[RunState]:
+        evaluation_run = await get_evaluation_run_by_id(str(run_id))
+        if not evaluation_run:
+            self._entries.pop(run_id, None)
+            return None
+
+        # Costs still in the write-behind queue are not in the sums yet. Taken before the query, so a
+        # record written meanwhile is counted twice rather than missed
+        pending_inference_cost = write_queue.pending_cost("inference", run_id)
+        pending_embedding_cost = write_queue.pending_cost("embedding", run_id)
+        inference_cost, embedding_cost = await asyncio.gather(
+            get_total_inference_cost(run_id),
+            get_total_embedding_cost(run_id),
+        )
+        state = RunState(
+            run_id=run_id,
+            status=evaluation_run.status,
+            inference_cost=inference_cost + pending_inference_cost,
+            embedding_cost=embedding_cost + pending_embedding_cost,
+            loaded_at=time.monotonic(),
+        )
+        self._entries[run_id] = state
+        self._entries.move_to_end(run_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return state
+
+    def set_status(self, run_id: UUID, status: SandboxStatus) -> None:
+        """Apply a status change to a cached run"""
+        state = self._entries.get(run_id)
+        if state is not None:
+            state.status = status
+            logger.debug(f"Run {run_id} status updated to {status.value} in admission cache")
+
+    def record_inference_cost(self, run_id: Optional[UUID], cost: float) -> None:
+        """Add a finished inference's cost to the cached running total"""
+        state = self._entries.get(run_id)
+        if state is not None:
+            state.inference_cost += cost
+
+    def record_embedding_cost(self, run_id: Optional[UUID], cost: float) -> None:
+        """Add a finished embedding's cost to the cached running total"""
+        state = self._entries.get(run_id)
+        if state is not None:
+            state.embedding_cost += cost
+
+    def invalidate(self, run_id: UUID) -> None:
+        self._entries.pop(run_id, None)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "listening": self._listener is not None and not self._listener.is_closed(),
+        }
+
+
+# Global admission cache (unused in dev mode, where admission checks are skipped)
+run_cache = RunAdmissionCache() if ENV != 'dev' else None
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from uuid import UUID
+
+from proxy.config import (
+    MAX_COST_PER_RUN,
+    RUN_MAX_CONCURRENT_REQUESTS,
+    RUN_REQUESTS_PER_SECOND,
+    RUN_REQUEST_BURST,
+    SHARED_STATE_PATH,
+    SHARED_STATE_IDLE_SECONDS,
+    SHARED_STATE_STALE_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Prune idle runs after this many admissions rather than on every one
+PRUNE_INTERVAL = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS run_limits (
+    run_id TEXT PRIMARY KEY,
+    in_flight INTEGER NOT NULL,
+    tokens REAL NOT NULL,
+    tokens_at REAL NOT NULL,
+    reserved_inference REAL NOT NULL,
+    reserved_embedding REAL NOT NULL,
+    spent_inference REAL NOT NULL,
+    spent_embedding REAL NOT NULL,
+    touched_at REAL NOT NULL
+)
+"""
+
+
+class SharedRunStore:
+    """Per-run limiter state shared by all proxy worker processes on a host.
+
+    Backed by a SQLite database in WAL mode; every admission, release and cost
+    update is a single IMMEDIATE transaction, so the read-check-update sequence
+    is atomic across processes. Spent cost is seeded from the first worker's
+    database totals and then incremented by every worker, so budget checks see
+    costs that other workers have not flushed to Postgres yet. Runs with
+    nothing in flight are dropped once untouched for SHARED_STATE_IDLE_SECONDS.
+    Runs still holding slots or reservations (a long stream) are kept until
+    untouched for SHARED_STATE_STALE_SECONDS, which clears slots leaked by a
+    worker that died mid-request.
+    """
+
+    def __init__(self, path: Path, idle_seconds: float = SHARED_STATE_IDLE_SECONDS,
+                 stale_seconds: float = SHARED_STATE_STALE_SECONDS):
+        self.path = Path(path)
+        self.idle_seconds = idle_seconds
+        self.stale_seconds = stale_seconds
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._admissions = 0
+
+    @staticmethod
+    def reset(path: Path) -> None:
+        """Remove state left by a previous deployment; call before workers start"""
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{path}{suffix}").unlink(missing_ok=True)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(SCHEMA)
+            self._conn = conn
+            logger.info(f"Shared run state opened at {self.path}")
+        return self._conn
+
+    def _transaction(self, fn, *args):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn, *args)
+                conn.execute("COMMIT")
+                return result
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    async def acquire(self, run_id: UUID, request_type: str, estimated_cost: float,
+                      spent_cost: float) -> Tuple[Optional[str], float, float]:
+        """Admit a request for a run.
+
+        Returns (refusal, spent, reserved): refusal is None when admitted, otherwise
+        "concurrency", "budget" or "rate"; spent and reserved are the run's shared
+        totals for the request type at the time of the check.
+        """
+        self._admissions += 1
+        if self._admissions % PRUNE_INTERVAL == 0:
+            await asyncio.to_thread(self._transaction, self._prune)
+        return await asyncio.to_thread(
+            self._transaction, self._acquire, str(run_id), request_type, estimated_cost, spent_cost
+        )
+
+    async def release(self, run_id: UUID, request_type: str, cost: float) -> None:
+        await asyncio.to_thread(self._transaction, self._release, str(run_id), request_type, cost)
+
+    async def record_cost(self, run_id: UUID, request_type: str, cost: float) -> None:
+        await asyncio.to_thread(self._transaction, self._record_cost, str(run_id), request_type, cost)
+
+    def _acquire(self, conn: sqlite3.Connection, run_id: str, request_type: str, estimated_cost: float,
+                 spent_cost: float) -> Tuple[Optional[str], float, float]:
+        now = time.time()
+        row = conn.execute(
+            f"SELECT in_flight, tokens, tokens_at, reserved_{request_type}, spent_{request_type} "
+            "FROM run_limits WHERE run_id = ?",
+            (run_id,),
+        ).fetchone()
+        if row is None:
+            conn.execute(
+                "INSERT INTO run_limits VALUES (?, 0, ?, ?, 0.0, 0.0, 0.0, 0.0, ?)",
+                (run_id, RUN_REQUEST_BURST, now, now),
+            )
+            row = (0, RUN_REQUEST_BURST, now, 0.0, 0.0)
+        in_flight, tokens, tokens_at, reserved, shared_spent = row
+
+        # This worker's database-backed total may be ahead of the shared one on first sight
+        spent = max(spent_cost, shared_spent)
+        tokens = min(RUN_REQUEST_BURST, tokens + (now - tokens_at) * RUN_REQUESTS_PER_SECOND)
+
+        if in_flight >= RUN_MAX_CONCURRENT_REQUESTS:
+            refusal = "concurrency"
+        elif spent + reserved + estimated_cost > MAX_COST_PER_RUN:
+            refusal = "budget"
+        elif tokens < 1.0:
+            refusal = "rate"
+        else:
+            refusal = None
+            in_flight += 1
+            tokens -= 1.0
+            reserved += estimated_cost
+
+        conn.execute(
+            f"UPDATE run_limits SET in_flight = ?, tokens = ?, tokens_at = ?, reserved_{request_type} = ?, "
+            f"spent_{request_type} = ?, touched_at = ? WHERE run_id = ?",
+            (in_flight, tokens, now, reserved, spent, now, run_id),
+        )
+        return refusal, spent, reserved
+
+    def _release(self, conn: sqlite3.Connection, run_id: str, request_type: str, cost: float) -> None:
+        conn.execute(
+            f"UPDATE run_limits SET in_flight = MAX(in_flight - 1, 0), "
+            f"reserved_{request_type} = MAX(reserved_{request_type} - ?, 0.0), touched_at = ? WHERE run_id = ?",
+            (cost, time.time(), run_id),
+        )
+
+    def _record_cost(self, conn: sqlite3.Connection, run_id: str, request_type: str, cost: float) -> None:
+        conn.execute(
+            f"UPDATE run_limits SET spent_{request_type} = spent_{request_type} + ?, touched_at = ? WHERE run_id = ?",
+            (cost, time.time(), run_id),
+        )
+
+    def _prune(self, conn: sqlite3.Connection) -> None:
+        now = time.time()
+        deleted = conn.execute(
+            # Reservations are only held by in-flight requests, and float remainders may outlive them
+            "DELETE FROM run_limits WHERE touched_at < ? AND (in_flight = 0 OR touched_at < ?)",
+            (now - self.idle_seconds, now - self.stale_seconds),
+        ).rowcount
+        if deleted:
+            logger.info(f"Pruned {deleted} idle runs from shared run state")
+
+    async def stats(self) -> Dict[str, object]:
+        tracked, in_flight = await asyncio.to_thread(self._transaction, self._stats)
+        return {"path": str(self.path), "tracked_runs": tracked, "in_flight": in_flight}
+
+    def _stats(self, conn: sqlite3.Connection) -> Tuple[int, int]:
+        return conn.execute("SELECT COUNT(*), COALESCE(SUM(in_flight), 0) FROM run_limits").fetchone()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# Global shared run state, only used when the proxy runs with multiple workers
+shared_run_store = SharedRunStore(SHARED_STATE_PATH) if SHARED_STATE_PATH else None
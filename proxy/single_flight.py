@@ -0,0 +1,61 @@
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+
+class InflightCompletion:
+    """One upstream completion stream, broadcast to every request attached to it.
+
+    The upstream call runs in its own task and appends chunks here; each
+    attached request replays the chunks from the start and then follows new
+    ones as they arrive, so a request that joins late still receives the full
+    completion. When the last attached request goes away the upstream call is
+    cancelled.
+    """
+
+    def __init__(self):
+        self.chunks: List[Tuple[str, Optional[str]]] = []
+        self.usage: Dict[str, Any] = {}
+        self.provider = None
+        self.done = False
+        self.completed = False
+        # Raised to every attached request, and the text recorded on their inference rows
+        self.error: Optional[Exception] = None
+        self.error_record: Optional[str] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._condition = asyncio.Condition()
+
+    async def publish(self, chunk_data: str, content: Optional[str]) -> None:
+        async with self._condition:
+            self.chunks.append((chunk_data, content))
+            self._condition.notify_all()
+
+    async def finish(self) -> None:
+        async with self._condition:
+            self.done = True
+            self._condition.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[Tuple[str, Optional[str]]]:
+        """Yield every chunk of the completion, then raise the upstream error if it failed"""
+        index = 0
+        while True:
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.done:
+                break
+            async with self._condition:
+                await self._condition.wait_for(lambda: index < len(self.chunks) or self.done)
+        if self.error is not None:
+            raise self.error
+
+    def attach(self) -> None:
+        self.subscribers += 1
+
+    def detach(self) -> bool:
+        """Drop a subscriber; returns True if it was the last one and the upstream call was cancelled"""
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.done and self.task is not None:
+            self.task.cancel()
+            return True
+        return False
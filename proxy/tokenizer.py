@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import logging
+import math
+import os
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import tiktoken
+
+from proxy.config import (
+    TOKENIZER_ENCODING,
+    TOKENIZER_CACHE_DIR,
+    TOKENIZER_SAFETY_MARGIN,
+    TOKENIZER_THREAD_MIN_CHARS,
+    TOKENS_PER_MESSAGE,
+    MIN_COMPLETION_TOKENS,
+    PROMPT_OVERFLOW_POLICY,
+    DEFAULT_MAX_TOKENS,
+    DEFAULT_CONTEXT_WINDOW,
+    MODEL_CONTEXT_WINDOWS,
+    MODEL_PRICING,
+)
+from proxy.models import GPTMessage
+from proxy.providers import provider_router
+
+logger = logging.getLogger(__name__)
+
+
+def vocab_cache_file(encoding_name: str) -> Path:
+    """Where tiktoken caches a .tiktoken encoding's vocab (every encoding but gpt2): the sha1 of its download URL"""
+    url = f"https://openaipublic.blob.core.windows.net/encodings/{encoding_name}.tiktoken"
+    return TOKENIZER_CACHE_DIR / hashlib.sha1(url.encode()).hexdigest()
+
+
+class PromptRejected(Exception):
+    """Raised when a prompt cannot be sent within the context window or remaining budget"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class PromptPlan:
+    """A prompt sized for dispatch: the messages to send, their token count and the completion allowance"""
+
+    def __init__(self, messages: List[GPTMessage], prompt_tokens: int, max_tokens: int, estimated_cost: float,
+                 dropped_messages: int = 0):
+        self.messages = messages
+        self.prompt_tokens = prompt_tokens
+        self.max_tokens = max_tokens
+        self.estimated_cost = estimated_cost
+        self.dropped_messages = dropped_messages
+
+
+class TokenEstimator:
+    """Counts prompt tokens before a request is dispatched.
+
+    Models are served with their own tokenizers, which are not shipped with the
+    proxy, so counts use a tiktoken BPE vocab padded by TOKENIZER_SAFETY_MARGIN.
+    The vocab is read from TOKENIZER_CACHE_DIR once, at startup (load()), and
+    the proxy refuses to start without it. Prompts of at least
+    TOKENIZER_THREAD_MIN_CHARS characters are counted in a worker thread so
+    encoding them does not stall the event loop.
+    """
+
+    def __init__(self, encoding_name: str = TOKENIZER_ENCODING):
+        self.encoding_name = encoding_name
+        self._encoding = None
+
+    def load(self, download: bool = False) -> None:
+        """Load the vocab from TOKENIZER_CACHE_DIR (blocking).
+
+        Raises RuntimeError if it has not been provisioned there, unless download
+        is set, which fetches it into TOKENIZER_CACHE_DIR (provisioning only).
+        """
+        # tiktoken reads vocab files from TIKTOKEN_CACHE_DIR before trying the network
+        os.environ["TIKTOKEN_CACHE_DIR"] = str(TOKENIZER_CACHE_DIR)
+        vocab_file = vocab_cache_file(self.encoding_name)
+        if download:
+            TOKENIZER_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        elif not vocab_file.is_file():
+            raise RuntimeError(
+                f"No {self.encoding_name} vocab at {vocab_file}. Provision it with `python -m proxy.tokenizer` "
+                f"or point TOKENIZER_CACHE_DIR at a directory that holds it"
+            )
+        try:
+            self._encoding = tiktoken.get_encoding(self.encoding_name)
+        except Exception as e:
+            raise RuntimeError(f"Could not load the {self.encoding_name} vocab from {TOKENIZER_CACHE_DIR}: {e}") from e
+        logger.info(f"Loaded {self.encoding_name} vocab from {TOKENIZER_CACHE_DIR}")
+
+    def count_text(self, text: str) -> int:
+        if self._encoding is None:
+            raise RuntimeError("Token estimator used before its vocab was loaded")
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def count_messages(self, messages: List[GPTMessage]) -> int:
+        return self._pad(sum(self._count_message(message) for message in messages))
+
+    def _count_message(self, message: GPTMessage) -> int:
+        # Chat templates add a few tokens per message for role markers and separators
+        return self.count_text(message.content) + TOKENS_PER_MESSAGE
+
+    @staticmethod
+    def _pad(raw_tokens: int) -> int:
+        return math.ceil((raw_tokens + 3) * TOKENIZER_SAFETY_MARGIN)
+
+    async def plan(self, model: str, messages: List[GPTMessage], remaining_budget: Optional[float] = None) -> PromptPlan:
+        """Size a request to the model's context window and the run's remaining budget.
+
+        Raises PromptRejected if the prompt leaves no room for a completion (and
+        PROMPT_OVERFLOW_POLICY is "reject" or truncation cannot make it fit), or if
+        the run cannot afford the prompt plus a minimal completion.
+        """
+        messages = [message for message in messages if message]
+        if sum(len(message.content) for message in messages) >= TOKENIZER_THREAD_MIN_CHARS:
+            return await asyncio.to_thread(self._plan, model, messages, remaining_budget)
+        return self._plan(model, messages, remaining_budget)
+
+    def _plan(self, model: str, messages: List[GPTMessage], remaining_budget: Optional[float]) -> PromptPlan:
+        if model not in MODEL_PRICING:
+            # Unsupported models are refused later with the list of supported ones
+            return PromptPlan(messages, 0, DEFAULT_MAX_TOKENS, 0.0)
+
+        context_window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+        prompt_tokens = self.count_messages(messages)
+        dropped = 0
+        if context_window - prompt_tokens < MIN_COMPLETION_TOKENS and PROMPT_OVERFLOW_POLICY == "truncate":
+            messages, dropped = self._truncate(messages, context_window - MIN_COMPLETION_TOKENS)
+            prompt_tokens = self.count_messages(messages)
+        if context_window - prompt_tokens < MIN_COMPLETION_TOKENS:
+            raise PromptRejected(
+                400,
+                f"Prompt is about {prompt_tokens} tokens, which leaves no room for a completion in the "
+                f"{context_window}-token context window of {model}. Please shorten the conversation.",
+            )
+        max_tokens = min(DEFAULT_MAX_TOKENS, context_window - prompt_tokens)
+
+        if remaining_budget is not None:
+            prompt_cost = provider_router.worst_case_cost(model, prompt_tokens, 0)
+            cost_per_completion_token = provider_router.worst_case_cost(model, 0, 1_000_000) / 1_000_000
+            if cost_per_completion_token > 0:
+                affordable = math.floor((remaining_budget - prompt_cost) / cost_per_completion_token)
+                if affordable < MIN_COMPLETION_TOKENS:
+                    raise PromptRejected(
+                        429,
+                        f"This request (about {prompt_tokens} prompt tokens) would exceed the remaining budget "
+                        f"(${max(remaining_budget, 0.0):.4f}) for this evaluation run.",
+                    )
+                max_tokens = min(max_tokens, affordable)
+
+        if dropped:
+            logger.info(f"Truncated prompt for {model}: dropped {dropped} oldest messages to fit {context_window} tokens")
+        return PromptPlan(
+            messages,
+            prompt_tokens,
+            max_tokens,
+            provider_router.worst_case_cost(model, prompt_tokens, max_tokens),
+            dropped,
+        )
+
+    def _truncate(self, messages: List[GPTMessage], token_limit: int) -> Tuple[List[GPTMessage], int]:
+        """Drop the oldest non-system messages, always keeping the last one, until the prompt fits"""
+        counts = [self._count_message(message) for message in messages]
+        total = sum(counts)
+        droppable = [i for i, message in enumerate(messages[:-1]) if message.role != "system"]
+        dropped = set()
+        for index in droppable:
+            if self._pad(total) <= token_limit:
+                break
+            dropped.add(index)
+            total -= counts[index]
+        return [message for i, message in enumerate(messages) if i not in dropped], len(dropped)
+
+
+# Global token estimator
+token_estimator = TokenEstimator()
+
+
+if __name__ == "__main__":
+    # Provisioning step: download the vocab into TOKENIZER_CACHE_DIR (needs network access)
+    token_estimator.load(download=True)
+    print(f"{TOKENIZER_ENCODING} vocab provisioned in {TOKENIZER_CACHE_DIR}")
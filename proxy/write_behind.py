@@ -0,0 +1,390 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from proxy.config import (
+    WRITE_BEHIND_FLUSH_INTERVAL_MS,
+    WRITE_BEHIND_BATCH_SIZE,
+    WRITE_BEHIND_DEAD_LETTER_PATH,
+    WRITE_BEHIND_MAX_PENDING,
+    WRITE_BEHIND_RETRY_BASE_SECONDS,
+    WRITE_BEHIND_RETRY_MAX_SECONDS,
+    WRITE_BEHIND_SHUTDOWN_RETRIES,
+)
+from proxy.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Message blobs come first so they are written before the inferences that reference them
+RECORD_KINDS = ("message_blob", "inference", "embedding")
+
+# kind -> record id -> column values
+Records = Dict[str, Dict[UUID, Dict[str, Any]]]
+
+
+def _encode_value(value: Any) -> Any:
+    """JSON form of the record values json cannot encode, tagged so replay can restore them"""
+    if isinstance(value, UUID):
+        return {"__uuid__": str(value)}
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    return str(value)
+
+
+def _decode_value(obj: Dict[str, Any]) -> Any:
+    if len(obj) == 1:
+        if "__uuid__" in obj:
+            return UUID(obj["__uuid__"])
+        if "__datetime__" in obj:
+            return datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+class WriteBatch:
+    """Inserts and updates drained from the queue in one flush"""
+
+    def __init__(self, inserts: Records, updates: Records):
+        self.inserts = inserts
+        self.updates = updates
+
+    def __len__(self) -> int:
+        return sum(len(self.inserts[k]) + len(self.updates[k]) for k in RECORD_KINDS)
+
+    @classmethod
+    def empty(cls) -> "WriteBatch":
+        return cls({k: {} for k in RECORD_KINDS}, {k: {} for k in RECORD_KINDS})
+
+    def add(self, operation: str, kind: str, record_id: UUID, values: Dict[str, Any]) -> None:
+        (self.inserts if operation == "insert" else self.updates)[kind][record_id] = values
+
+    def records(self) -> List[Tuple[str, str, UUID, Dict[str, Any]]]:
+        """Every record as (operation, kind, record id, values), in write order"""
+        return [
+            (operation, kind, record_id, values)
+            for operation, records in (("insert", self.inserts), ("update", self.updates))
+            for kind in RECORD_KINDS
+            for record_id, values in records[kind].items()
+        ]
+
+
+class WriteBehindQueue:
+    """Buffers inference/embedding writes off the request path and flushes them in batches.
+
+    Records are flushed every ``flush_interval_ms`` or as soon as ``batch_size``
+    records are pending, whichever comes first. An update for a record whose
+    insert has not been flushed yet is folded into that insert, so short requests
+    cost a single row write. Producers block once ``max_pending`` records are
+    buffered, which pushes back on the request path instead of growing without
+    bound while the database is slow or unavailable.
+
+    A batch that fails because the database is unreachable or overloaded is
+    requeued and retried with capped exponential backoff for as long as the
+    outage lasts; ``max_pending`` bounds the memory it holds meanwhile. A
+    batch the database rejects (``is_rejected`` says whether an error is about
+    the data rather than the database) is written record by record instead,
+    and only the records it rejects are appended to a dead-letter file, from
+    which ``replay_dead_letters`` can write them once the cause is fixed.
+    Records still buffered when the queue closes are dead-lettered too.
+
+    ``on_written`` is called with every batch (or single record) once it is
+    committed, for callers that must not rely on a record before it exists.
+    """
+
+    def __init__(
+        self,
+        flush_fn: Callable[[WriteBatch], Awaitable[None]],
+        *,
+        is_rejected: Callable[[Exception], bool] = lambda e: False,
+        on_written: Optional[Callable[[WriteBatch], None]] = None,
+        flush_interval_ms: int = WRITE_BEHIND_FLUSH_INTERVAL_MS,
+        batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+        max_pending: int = WRITE_BEHIND_MAX_PENDING,
+        dead_letter_path: Path = WRITE_BEHIND_DEAD_LETTER_PATH,
+    ):
+        self.flush_fn = flush_fn
+        self.is_rejected = is_rejected
+        self.on_written = on_written
+        self.flush_interval = flush_interval_ms / 1000
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.dead_letter_path = dead_letter_path
+        self._inserts: Records = {k: {} for k in RECORD_KINDS}
+        self._updates: Records = {k: {} for k in RECORD_KINDS}
+        self._pending = 0
+        # The batch being written, whose records the database does not have yet either
+        self._flushing: Optional[WriteBatch] = None
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Condition()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.flushed_records = 0
+        self.failed_flushes = 0
+        self.dead_letter_records = 0
+        # Consecutive failed flushes, and when the next flush may be attempted
+        self._failures = 0
+        self._retry_at = 0.0
+
+    async def start(self) -> None:
+        """Start the background flush loop"""
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"Write-behind queue started (interval={self.flush_interval * 1000:.0f}ms, "
+            f"batch_size={self.batch_size}, max_pending={self.max_pending})"
+        )
+
+    async def close(self) -> None:
+        """Stop the flush loop and write out everything still buffered"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        for attempt in range(1, WRITE_BEHIND_SHUTDOWN_RETRIES + 1):
+            if await self.flush():
+                break
+            await asyncio.sleep(attempt)
+        if self._pending:
+            batch = self._drain()
+            logger.error(f"Write-behind queue closed with {len(batch)} unwritten records, dead-lettering them for replay")
+            await self._dead_letter([(*record, "not written before shutdown") for record in batch.records()])
+        else:
+            logger.info("Write-behind queue drained")
+
+    async def insert(self, kind: str, record_id: UUID, values: Dict[str, Any]) -> None:
+        await self._wait_for_space()
+        self._inserts[kind][record_id] = values
+        self._added()
+
+    async def update(self, kind: str, record_id: UUID, values: Dict[str, Any]) -> None:
+        pending_insert = self._inserts[kind].get(record_id)
+        if pending_insert is not None:
+            pending_insert.update(values)
+            return
+
+        await self._wait_for_space()
+        if record_id in self._updates[kind]:
+            self._updates[kind][record_id].update(values)
+            return
+        self._updates[kind][record_id] = values
+        self._added()
+
+    async def flush(self) -> bool:
+        """Write out everything currently buffered; returns False if records were requeued for a retry"""
+        async with self._flush_lock:
+            batch = self._drain()
+            if not len(batch):
+                return True
+            # Producers may buffer new records while this batch is written
+            async with self._space:
+                self._space.notify_all()
+            self._flushing = batch
+            try:
+                await self.flush_fn(batch)
+                self._written(batch)
+                self.flushed_records += len(batch)
+                self._failures = 0
+                logger.debug(f"Flushed {len(batch)} buffered proxy records")
+                return True
+            except Exception as e:
+                self.failed_flushes += 1
+                if not self.is_rejected(e):
+                    self._retry_later(batch, e)
+                    return False
+                logger.error(f"Database rejected a batch of {len(batch)} proxy records, writing them one by one: {e}")
+                return await self._write_individually(batch)
+            finally:
+                self._flushing = None
+                async with self._space:
+                    self._space.notify_all()
+
+    def pending_cost(self, kind: str, run_id: UUID) -> float:
+        """Cost of a run's records that are buffered or being written, so not yet in the database.
+
+        Records of a batch are counted until the whole flush returns, so a
+        caller summing this with database totals may briefly count a cost
+        twice, but never misses one.
+        """
+        batches = [WriteBatch(self._inserts, self._updates)]
+        if self._flushing is not None:
+            batches.append(self._flushing)
+        return sum(
+            values.get("cost") or 0.0
+            for batch in batches
+            for records in (batch.inserts[kind], batch.updates[kind])
+            for values in records.values()
+            if values.get("run_id") == run_id
+        )
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "flushed_records": self.flushed_records,
+            "failed_flushes": self.failed_flushes,
+            "dead_letter_records": self.dead_letter_records,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            backoff = self._retry_at - time.monotonic()
+            if backoff > 0:
+                await asyncio.sleep(backoff)
+            await self.flush()
+
+    async def _wait_for_space(self) -> None:
+        if self._pending < self.max_pending:
+            return
+        logger.warning(f"Write-behind queue full ({self._pending} records), waiting for a flush")
+        self._wakeup.set()
+        async with self._space:
+            await self._space.wait_for(lambda: self._pending < self.max_pending)
+
+    async def replay_dead_letters(self) -> Tuple[int, int]:
+        """Write the records in the dead-letter file; returns (written, still dead-lettered)"""
+        replaying = self.dead_letter_path.with_name(self.dead_letter_path.name + ".replaying")
+        dead_letters = await asyncio.to_thread(self._take_dead_letters, replaying)
+        written, remaining = 0, []
+        for i, dead_letter in enumerate(dead_letters):
+            single = WriteBatch.empty()
+            single.add(dead_letter["operation"], dead_letter["kind"], dead_letter["id"], dead_letter["values"])
+            try:
+                await self.flush_fn(single)
+                self._written(single)
+                written += 1
+            except Exception as e:
+                if not self.is_rejected(e):
+                    logger.error(f"Stopping replay, the database is unavailable: {e}")
+                    remaining.extend(dead_letters[i:])
+                    break
+                remaining.append({**dead_letter, "error": str(e)})
+        if remaining and not await asyncio.to_thread(self._append_dead_letters, remaining):
+            logger.error(f"Kept {replaying} for the next replay")
+            return written, len(remaining)
+        await asyncio.to_thread(replaying.unlink)
+        return written, len(remaining)
+
+    def _written(self, batch: WriteBatch) -> None:
+        if self.on_written is None:
+            return
+        try:
+            self.on_written(batch)
+        except Exception as e:
+            logger.error(f"Write-behind on_written callback failed: {e}")
+
+    def _retry_later(self, batch: WriteBatch, error: Exception) -> None:
+        """Requeue a batch that failed for reasons other than its data, backing off until the next attempt"""
+        self._failures += 1
+        delay = min(WRITE_BEHIND_RETRY_BASE_SECONDS * 2 ** (self._failures - 1), WRITE_BEHIND_RETRY_MAX_SECONDS)
+        self._retry_at = time.monotonic() + delay
+        logger.error(
+            f"Failed to flush {len(batch)} buffered proxy records ({self._failures} in a row), "
+            f"retrying in {delay:.1f}s: {error}"
+        )
+        self._requeue(batch)
+
+    async def _write_individually(self, batch: WriteBatch) -> bool:
+        """Write each record on its own, dead-lettering the ones the database rejects.
+
+        If the database becomes unavailable partway, the records not yet written
+        are requeued and False is returned.
+        """
+        rejected = []
+        records = batch.records()
+        for i, (operation, kind, record_id, values) in enumerate(records):
+            single = WriteBatch.empty()
+            single.add(operation, kind, record_id, values)
+            try:
+                await self.flush_fn(single)
+                self._written(single)
+                self.flushed_records += 1
+            except Exception as e:
+                if not self.is_rejected(e):
+                    rest = WriteBatch.empty()
+                    for record in records[i:]:
+                        rest.add(*record)
+                    self._retry_later(rest, e)
+                    await self._dead_letter(rejected)
+                    return False
+                logger.error(f"Dead-lettering {kind} {operation} {record_id}: {e}")
+                rejected.append((operation, kind, record_id, values, str(e)))
+        self._failures = 0
+        await self._dead_letter(rejected)
+        return True
+
+    async def _dead_letter(self, records: List[Tuple[str, str, UUID, Dict[str, Any], str]]) -> None:
+        if not records:
+            return
+        for _, kind, _, _, _ in records:
+            self.dead_letter_records += 1
+            metrics.dead_letter_records.inc(kind=kind)
+        await asyncio.to_thread(self._append_dead_letters, [
+            {"operation": operation, "kind": kind, "id": record_id, "values": values, "error": error}
+            for operation, kind, record_id, values, error in records
+        ])
+
+    def _append_dead_letters(self, dead_letters: List[Dict[str, Any]]) -> bool:
+        try:
+            self.dead_letter_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.dead_letter_path, "a") as f:
+                for dead_letter in dead_letters:
+                    f.write(json.dumps(dead_letter, default=_encode_value) + "\n")
+            return True
+        except OSError as e:
+            logger.error(f"Could not write {len(dead_letters)} dead-lettered records to {self.dead_letter_path}: {e}")
+            return False
+
+    def _take_dead_letters(self, replaying: Path) -> List[Dict[str, Any]]:
+        """Move the dead-letter file aside and read it, so records dead-lettered meanwhile go to a fresh file"""
+        # A file left by an interrupted replay is finished first; the current file waits for the next replay
+        if not replaying.exists():
+            if not self.dead_letter_path.exists():
+                return []
+            self.dead_letter_path.replace(replaying)
+        with open(replaying) as f:
+            return [json.loads(line, object_hook=_decode_value) for line in f if line.strip()]
+
+    def _added(self) -> None:
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self._wakeup.set()
+
+    def _drain(self) -> WriteBatch:
+        batch = WriteBatch(self._inserts, self._updates)
+        self._inserts = {k: {} for k in RECORD_KINDS}
+        self._updates = {k: {} for k in RECORD_KINDS}
+        self._pending = 0
+        return batch
+
+    def _requeue(self, batch: WriteBatch) -> None:
+        """Put a failed batch back in front of anything buffered since it was drained"""
+        for kind in RECORD_KINDS:
+            inserts = batch.inserts[kind]
+            for record_id, values in self._inserts[kind].items():
+                inserts[record_id] = values
+            for record_id in list(self._updates[kind]):
+                if record_id in inserts:
+                    inserts[record_id].update(self._updates[kind].pop(record_id))
+
+            updates = batch.updates[kind]
+            for record_id, values in self._updates[kind].items():
+                if record_id in updates:
+                    updates[record_id].update(values)
+                else:
+                    updates[record_id] = values
+
+            self._inserts[kind] = inserts
+            self._updates[kind] = updates
+        self._pending = sum(len(self._inserts[k]) + len(self._updates[k]) for k in RECORD_KINDS)
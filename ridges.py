@@ -408,6 +408,11 @@ def run(no_auto_update: bool):
         console.print(Panel("[bold yellow]⚠️  Proxy already running![/bold yellow]", title="🔄 Status", border_style="yellow"))
         return
     
+    # The proxy loads its tokenizer vocab at startup and never downloads it itself
+    if run_cmd("uv run -m proxy.tokenizer", capture=False)[0] != 0:
+        console.print(" Failed to provision the proxy tokenizer vocab", style="red")
+        return
+
     if no_auto_update:
         console.print(" Starting proxy server...", style="yellow")
         run_cmd("uv run -m proxy.main", capture=False)
@@ -471,6 +476,9 @@ def run():
     if is_running:
         services_already_running.append("Proxy")
         console.print("✅ Proxy already running!", style="green")
+    elif run_cmd("uv run -m proxy.tokenizer", capture=False)[0] != 0:
+        services_failed.append("Proxy")
+        console.print(" Failed to provision the proxy tokenizer vocab", style="red")
     else:
         if run_cmd(f"pm2 start 'uv run -m proxy.main' --name ridges-proxy", capture=False)[0] == 0:
             services_started.append("Proxy")
@@ -36,6 +36,12 @@ RIDGES_PROXY_URL = os.getenv("RIDGES_PROXY_URL", "http://52.1.119.189:8001")
 
 LOG_DRAIN_FREQUENCY = timedelta(minutes=10)
 
+# Event loop lag monitoring: how often the loop is probed, the lag that is logged as a warning,
+# and how often a summary is logged
+LOOP_LAG_CHECK_INTERVAL = float(os.getenv("LOOP_LAG_CHECK_INTERVAL", "0.5"))
+LOOP_LAG_WARN_THRESHOLD = float(os.getenv("LOOP_LAG_WARN_THRESHOLD", "0.25"))
+LOOP_LAG_REPORT_FREQUENCY = timedelta(minutes=1)
+
 # Log initial configuration
 from loggers.logging_utils import get_logger
 logger = get_logger(__name__)
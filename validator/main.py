@@ -9,6 +9,7 @@ load_dotenv("validator/.env")
 
 # Internal package imports
 from validator.socket.websocket_app import WebsocketApp
+from validator.utils.loop_lag import loop_lag_monitor
 from loggers.logging_utils import get_logger
 from pathlib import Path
 from ddtrace import tracer
@@ -22,6 +23,7 @@ async def main():
     """
     # await check_and_generate_embeddings()
     websocket_app = WebsocketApp()
+    loop_lag_monitor.start()
     try:
         await websocket_app.start()
     except KeyboardInterrupt:
@@ -0,0 +1,226 @@
+"""Host-capacity admission control for sandboxes."""
+
+import asyncio
+import os
+import shutil
+from collections import deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, AsyncIterator, Deque, Dict, Optional
+
+from validator.sandbox.constants import (
+    REPOS_BASE_DIR,
+    SANDBOX_ADMISSION_POLL_INTERVAL,
+    SANDBOX_AGENTS_PER_CORE,
+    SANDBOX_MAX_CONCURRENT_GENERATIONS,
+    SANDBOX_MAX_LOAD_PER_CORE,
+    SANDBOX_MAX_RAM_USAGE,
+    SANDBOX_MEMORY_HEADROOM_MB,
+    SANDBOX_MIN_FREE_DISK_GB,
+)
+from loggers.logging_utils import get_logger
+
+if TYPE_CHECKING:
+    from validator.sandbox.monitor import ContainerWatch
+
+logger = get_logger(__name__)
+
+# Peak memory samples kept, the number needed before reservations follow them, and the margin added
+PEAK_SAMPLES = 100
+MIN_PEAK_SAMPLES = 5
+PEAK_MARGIN = 1.25
+MIN_RESERVATION_MB = 256
+
+# Memory charged to the containers Docker runs, for cgroup v2 (systemd and cgroupfs drivers) and v1
+DOCKER_CGROUP_GLOBS = (
+    ("/sys/fs/cgroup/system.slice", "docker-*.scope/memory.current"),
+    ("/sys/fs/cgroup/docker", "*/memory.current"),
+)
+DOCKER_CGROUP_V1_USAGE = "/sys/fs/cgroup/memory/docker/memory.usage_in_bytes"
+
+
+class Admission:
+    """A sandbox admitted to run, with the memory set aside for it"""
+
+    def __init__(self, run_id: str, reservation_mb: float):
+        self.run_id = run_id
+        self.reservation_mb = reservation_mb
+        # Set once the sandbox's container is being monitored
+        self.watch: Optional["ContainerWatch"] = None
+
+    def usage_mb(self) -> float:
+        if self.watch is None or self.watch.memory_usage_mb is None:
+            return 0.0
+        return self.watch.memory_usage_mb
+
+    def outstanding_mb(self) -> float:
+        """Reserved memory the container hasn't taken yet, which free memory doesn't account for"""
+        return max(0.0, self.reservation_mb - self.usage_mb())
+
+
+class HostCapacity:
+    """Admits sandboxes only while the host has the cores, memory and disk for them.
+
+    Each admitted sandbox reserves memory. Until enough containers have been
+    observed that is SANDBOX_MAX_RAM_USAGE; afterwards it follows the 90th
+    percentile of the peak usage recent sandbox containers actually reached,
+    so the concurrency level adapts to what agents really use. A sandbox is
+    admitted when:
+
+    - the number running is below SANDBOX_AGENTS_PER_CORE per core (and the
+      optional SANDBOX_MAX_CONCURRENT_GENERATIONS cap),
+    - the 1-minute load per core is below SANDBOX_MAX_LOAD_PER_CORE, which
+      also accounts for grading containers,
+    - available memory, minus what admitted containers haven't taken yet,
+      leaves its reservation plus SANDBOX_MEMORY_HEADROOM_MB,
+    - at least SANDBOX_MIN_FREE_DISK_GB is free for working copies.
+
+    One sandbox is always admitted when none are running, so a small host
+    still makes progress.
+    """
+
+    def __init__(self, max_concurrent: int = SANDBOX_MAX_CONCURRENT_GENERATIONS):
+        self.max_concurrent = max_concurrent
+        self.cores = os.cpu_count() or 1
+        self._admitted: Dict[str, Admission] = {}
+        self._peaks: Deque[float] = deque(maxlen=PEAK_SAMPLES)
+        self._condition = asyncio.Condition()
+        self._waiting = 0
+        self.blocked_reason: Optional[str] = None
+
+    @asynccontextmanager
+    async def admit(self, run_id: str) -> AsyncIterator[Admission]:
+        """Wait until the host can take another sandbox and hold its admission for the block"""
+        async with self._condition:
+            self._waiting += 1
+            try:
+                while True:
+                    reason = self._refusal()
+                    if reason is None or not self._admitted:
+                        break
+                    if reason != self.blocked_reason:
+                        logger.info(f"Holding sandboxes back: {reason}")
+                        self.blocked_reason = reason
+                    try:
+                        # Resources also free up outside our control, so re-check periodically
+                        await asyncio.wait_for(self._condition.wait(), SANDBOX_ADMISSION_POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self._waiting -= 1
+            admission = Admission(run_id, self.reservation_mb())
+            self._admitted[run_id] = admission
+            self.blocked_reason = None
+        logger.info(f"Admitted sandbox {run_id} reserving {admission.reservation_mb:.0f}MB ({len(self._admitted)} running)")
+
+        try:
+            yield admission
+        finally:
+            async with self._condition:
+                self._admitted.pop(run_id, None)
+                if admission.watch is not None and admission.watch.peak_memory_mb > 0:
+                    self._peaks.append(admission.watch.peak_memory_mb)
+                self._condition.notify_all()
+
+    def reservation_mb(self) -> float:
+        """Memory to set aside for a new sandbox, from the peaks observed so far"""
+        if len(self._peaks) < MIN_PEAK_SAMPLES:
+            return float(SANDBOX_MAX_RAM_USAGE)
+        peaks = sorted(self._peaks)
+        p90 = peaks[min(len(peaks) - 1, int(len(peaks) * 0.9))]
+        return min(float(SANDBOX_MAX_RAM_USAGE), max(MIN_RESERVATION_MB, p90 * PEAK_MARGIN))
+
+    def concurrency_limit(self) -> int:
+        """Sandboxes the host could run at the current reservation size, ignoring current load"""
+        total_mb = _meminfo().get("MemTotal", 0) / 1024
+        limits = [int(self.cores * SANDBOX_AGENTS_PER_CORE)]
+        if total_mb:
+            limits.append(int((total_mb - SANDBOX_MEMORY_HEADROOM_MB) // self.reservation_mb()))
+        if self.max_concurrent:
+            limits.append(self.max_concurrent)
+        return max(1, min(limits))
+
+    def state(self) -> Dict[str, Any]:
+        """Current admission state and host measurements"""
+        meminfo = _meminfo()
+        return {
+            "running": len(self._admitted),
+            "waiting": self._waiting,
+            "blocked_reason": self.blocked_reason,
+            "concurrency_limit": self.concurrency_limit(),
+            "reservation_mb": round(self.reservation_mb()),
+            "observed_peaks": len(self._peaks),
+            "outstanding_reservations_mb": round(sum(a.outstanding_mb() for a in self._admitted.values())),
+            "cores": self.cores,
+            "load_per_core": round(_load_average() / self.cores, 2),
+            "memory_available_mb": round(meminfo.get("MemAvailable", 0) / 1024),
+            "docker_memory_mb": _docker_memory_mb(),
+            "disk_free_gb": round(_disk_free_gb(), 1),
+        }
+
+    def _refusal(self) -> Optional[str]:
+        """Why another sandbox can't start right now, or None if it can"""
+        running = len(self._admitted)
+        if self.max_concurrent and running >= self.max_concurrent:
+            return f"{running} running, the SANDBOX_MAX_CONCURRENT_GENERATIONS cap"
+        if running >= self.cores * SANDBOX_AGENTS_PER_CORE:
+            return f"{running} running on {self.cores} cores"
+        load_per_core = _load_average() / self.cores
+        if load_per_core > SANDBOX_MAX_LOAD_PER_CORE:
+            return f"load {load_per_core:.2f} per core"
+        available_mb = _meminfo().get("MemAvailable")
+        if available_mb is not None:
+            free_mb = available_mb / 1024 - sum(a.outstanding_mb() for a in self._admitted.values())
+            needed_mb = self.reservation_mb() + SANDBOX_MEMORY_HEADROOM_MB
+            if free_mb < needed_mb:
+                return f"{free_mb:.0f}MB memory free, {needed_mb:.0f}MB needed"
+        disk_free_gb = _disk_free_gb()
+        if disk_free_gb < SANDBOX_MIN_FREE_DISK_GB:
+            return f"{disk_free_gb:.1f}GB disk free"
+        return None
+
+
+def _meminfo() -> Dict[str, int]:
+    """/proc/meminfo in KiB, empty where unavailable"""
+    try:
+        with open("/proc/meminfo") as f:
+            return {line.split(":")[0]: int(line.split()[1]) for line in f if len(line.split()) >= 2}
+    except (OSError, ValueError):
+        return {}
+
+
+def _load_average() -> float:
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return 0.0
+
+
+def _disk_free_gb() -> float:
+    path = REPOS_BASE_DIR if REPOS_BASE_DIR.exists() else REPOS_BASE_DIR.parent
+    try:
+        return shutil.disk_usage(path).free / 1024 ** 3
+    except OSError:
+        return float("inf")
+
+
+def _docker_memory_mb() -> Optional[int]:
+    """Memory used by all Docker containers according to their cgroups, if visible"""
+    total, found = 0, False
+    for root, pattern in DOCKER_CGROUP_GLOBS:
+        for path in Path(root).glob(pattern):
+            try:
+                total += int(path.read_text())
+                found = True
+            except (OSError, ValueError):
+                continue
+    if not found:
+        try:
+            total, found = int(Path(DOCKER_CGROUP_V1_USAGE).read_text()), True
+        except (OSError, ValueError):
+            pass
+    return round(total / (1024 * 1024)) if found else None
+
+
+# Global host capacity, shared by the sandboxes of every evaluation so observed peaks carry over
+host_capacity = HostCapacity()
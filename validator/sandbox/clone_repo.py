@@ -1,74 +1,112 @@
+import os
 import shutil
+import uuid
 from pathlib import Path
 from typing import Optional
-import time
 from ddtrace import tracer
+from filelock import FileLock
 from git import Repo
-from git.exc import GitCommandError, InvalidGitRepositoryError
+from git.exc import GitCommandError, InvalidGitRepositoryError, NoSuchPathError
 
+from validator.sandbox.constants import REPO_MIRROR_DIR
 from loggers.logging_utils import get_logger
 
 logger = get_logger(__name__)
 
+
+def _upstream_url(repo_name: str) -> str:
+    return f"https://github.com/{repo_name}.git"
+
+
+def _has_commit(repo: Repo, commit: str) -> bool:
+    try:
+        repo.git.cat_file("-e", f"{commit}^{{commit}}")
+        return True
+    except GitCommandError:
+        return False
+
+
+def _open_repo(path: Path) -> Optional[Repo]:
+    try:
+        return Repo(path)
+    except (InvalidGitRepositoryError, NoSuchPathError):
+        return None
+
+
+@tracer.wrap(resource="mirror-repo")
+def mirror_repo(repo_name: str, commit: Optional[str] = None) -> Path:
+    """Path of the repository's bare mirror, created or fetched so it contains `commit` (blocking operation).
+
+    The mirror is cloned once per upstream repository. A commit it doesn't
+    have yet is fetched on its own, which only transfers the missing objects,
+    falling back to fetching every ref. Workers share mirrors through a file lock.
+    """
+    REPO_MIRROR_DIR.mkdir(parents=True, exist_ok=True)
+    mirror_path = REPO_MIRROR_DIR / f"{repo_name.replace('/', '_')}.git"
+
+    with FileLock(str(REPO_MIRROR_DIR / f"{mirror_path.name}.lock")):
+        mirror = _open_repo(mirror_path)
+        if mirror is None:
+            logger.info(f"Creating mirror of {repo_name} at {mirror_path}")
+            building = REPO_MIRROR_DIR / f".{mirror_path.name}.{uuid.uuid4().hex[:8]}"
+            try:
+                Repo.clone_from(_upstream_url(repo_name), building, mirror=True)
+                # Clones hard-link the mirror's packs, so they must not be repacked under them
+                with Repo(building).config_writer() as config:
+                    config.set_value("gc", "auto", "0")
+                shutil.rmtree(mirror_path, ignore_errors=True)
+                os.rename(building, mirror_path)
+            finally:
+                shutil.rmtree(building, ignore_errors=True)
+            mirror = Repo(mirror_path)
+
+        if commit and not _has_commit(mirror, commit):
+            logger.info(f"Fetching {commit} into mirror of {repo_name}")
+            try:
+                # Keep a ref so the commit is never pruned and is cloned with the branches
+                mirror.git.fetch("origin", f"{commit}:refs/commits/{commit}")
+            except GitCommandError as e:
+                logger.warning(f"Fetching {commit} of {repo_name} by hash failed, fetching all refs: {e}")
+                mirror.git.fetch("origin")
+            if not _has_commit(mirror, commit):
+                raise ValueError(f"Commit {commit} not found in {repo_name}")
+    return mirror_path
+
+
 @tracer.wrap(resource="clone-repo")
 def clone_repo(path: Path, repo_name: str, base_commit: Optional[str] = None) -> Path:
+    """Check out `repo_name` at `base_commit` in `path`, cloning from the local mirror if needed (blocking operation).
+
+    The clone hard-links the mirror's objects instead of downloading them, and
+    is self-contained so it can be mounted without the mirror. It is built
+    next to `path` and renamed into place, so `path` never holds a partial clone;
+    a file lock makes concurrent calls for the same path wait for each other.
+    """
     try:
-        path.mkdir(parents=True, exist_ok=True)
+        path.parent.mkdir(parents=True, exist_ok=True)
 
-        # If the directory already looks like a git repository, just reuse it.
-        if (path / ".git").exists():
-            try:
-                repo = Repo(path)
+        with FileLock(str(path.parent / f".{path.name}.lock")):
+            repo = _open_repo(path)
+            if repo is not None and (not base_commit or _has_commit(repo, base_commit)):
                 logger.debug(f"Reusing existing repository at {path}")
-            except InvalidGitRepositoryError:
-                # Directory exists but isn't a valid repo – clean it and reclone once
-                logger.warning(f"Existing directory at {path} is not a valid git repo; recloning…")
-                shutil.rmtree(path, ignore_errors=True)
-                repo = Repo.clone_from(f"https://github.com/{repo_name}.git", path)
-                logger.debug(f"Repository cloned to {path}")
-        else:
-            # Empty or non-existent directory → fresh clone
-            if any(path.iterdir()):
-                logger.debug(f"Directory {path} exists but is not a git repo; recloning…")
-                shutil.rmtree(path, ignore_errors=True)
-                path.mkdir(parents=True, exist_ok=True)
-            try:
-                repo = Repo.clone_from(f"https://github.com/{repo_name}.git", path)
-                logger.debug(f"Repository cloned to {path}")
-            except GitCommandError as gce:
-                if "already exists and is not an empty directory" in str(gce):
-                    # The directory is being cloned by another worker, or we raced. Reuse.
-                    logger.info(f"Clone raced for {repo_name}; reusing existing directory {path}.")
-                    # Wait briefly for .git to materialize if another clone is still in progress
-                    for _ in range(5):
-                        if (path / ".git").exists():
-                            break
-                        time.sleep(1)
-                    try:
-                        repo = Repo(path)
-                    except InvalidGitRepositoryError:
-                        # Still not a git repo – treat as empty clone (should be rare)
-                        logger.warning(f"Path {path} still not a valid repo after race; retrying clone once…")
-                        shutil.rmtree(path, ignore_errors=True)
-                        path.mkdir(parents=True, exist_ok=True)
-                        repo = Repo.clone_from(f"https://github.com/{repo_name}.git", path)
-                else:
-                    raise
-
-        if base_commit:
-            try:
-                repo.git.checkout(base_commit)
+            else:
+                mirror_path = mirror_repo(repo_name, base_commit)
+                building = path.parent / f".{path.name}.{uuid.uuid4().hex[:8]}"
+                try:
+                    repo = Repo.clone_from(str(mirror_path), building, local=True, no_checkout=True)
+                    repo.remote("origin").set_url(_upstream_url(repo_name))
+                    repo.git.checkout("-f", "--detach", base_commit or "HEAD")
+                    shutil.rmtree(path, ignore_errors=True)
+                    os.rename(building, path)
+                finally:
+                    shutil.rmtree(building, ignore_errors=True)
+                logger.debug(f"Repository cloned to {path} from {mirror_path} at {base_commit or 'HEAD'}")
+                return path
+
+            if base_commit:
+                repo.git.checkout("-f", "--detach", base_commit)
                 logger.debug(f"Checked out base commit {base_commit}")
-            except GitCommandError as gce:
-                # Handle possible stale lock file
-                lock_file = path / ".git" / "index.lock"
-                if lock_file.exists():
-                    logger.warning(f"Removing stale index.lock at {lock_file}")
-                    lock_file.unlink(missing_ok=True)
-                    repo.git.checkout(base_commit)
-                else:
-                    raise
         return path
     except Exception as e:
         logger.exception(f"Failed to clone repository: {e}")
-        raise
\ No newline at end of file
+        raise
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 # Get the current directory where this file is located
@@ -10,6 +11,14 @@ MAIN_FILE = str(CURRENT_DIR / "agent_runner.py")
 # docker build -t sandbox-runner .
 SANDBOX_DOCKER_IMAGE = "ghcr.io/ridgesai/ridges/sandbox:latest"
 
+# Per-instance sandbox images (ghcr.io/ridgesai/ridges/sandbox-<instance_id>:latest) are kept up to
+# date by digest and evicted least recently used once their unshared layers exceed SANDBOX_IMAGE_CACHE_MAX_GB.
+# A registry digest check is trusted for SANDBOX_IMAGE_DIGEST_TTL seconds
+SANDBOX_INSTANCE_IMAGE_PREFIX = "ghcr.io/ridgesai/ridges/sandbox-"
+SANDBOX_IMAGE_CACHE_MAX_BYTES = int(float(os.getenv("SANDBOX_IMAGE_CACHE_MAX_GB", "100")) * 1024 ** 3)
+SANDBOX_IMAGE_DIGEST_TTL = 10 * 60
+SANDBOX_IMAGE_USAGE_FILE = Path(__file__).parent.parent / "image_usage.json"
+
 # The mounted directories/files (these paths exist only in the sandbox)
 # The real paths are stored in the Sandbox object but the mounted paths are constant
 SANDBOX_DIR = "/sandbox"
@@ -28,6 +37,39 @@ SANDBOX_SOURCE_AGENT_MAIN_FILE = SANDBOX_SOURCE_DIR + "/agent.py" # NOTE: We don
 SANDBOX_MAX_RAM_USAGE = 512 * 4 # MiB 
 SANDBOX_MAX_RUNTIME = 20 * 60 # seconds
 
+# How often the shared reader samples the memory usage of all running sandboxes
+SANDBOX_STATS_INTERVAL = 1 # seconds
+
+# Sandbox containers are pre-created (stopped) when an evaluation arrives; at most this many
+# image pulls and container creations run at once
+SANDBOX_PREWARM_CONCURRENCY = 8
+
+# Threads for blocking Docker, git and filesystem calls made on behalf of the sandboxes
+SANDBOX_EXECUTOR_WORKERS = 32
+
+# Agent containers generating patches at once. Sandboxes are admitted by host capacity (see
+# capacity.py); this is an optional hard cap on top (0 = none). Grading has its own limit below,
+# so the two stages overlap
+SANDBOX_MAX_CONCURRENT_GENERATIONS = int(os.getenv("SANDBOX_MAX_CONCURRENT_GENERATIONS", "0"))
+
+# Host capacity admission: agents per core (they mostly wait on the LLM), the 1-minute load per
+# core above which no more agents start, memory kept free beyond what admitted sandboxes are
+# expected to use, and the disk space a new sandbox needs
+SANDBOX_AGENTS_PER_CORE = float(os.getenv("SANDBOX_AGENTS_PER_CORE", "2"))
+SANDBOX_MAX_LOAD_PER_CORE = float(os.getenv("SANDBOX_MAX_LOAD_PER_CORE", "1.5"))
+SANDBOX_MEMORY_HEADROOM_MB = int(os.getenv("SANDBOX_MEMORY_HEADROOM_MB", "1024"))
+SANDBOX_MIN_FREE_DISK_GB = float(os.getenv("SANDBOX_MIN_FREE_DISK_GB", "10"))
+SANDBOX_ADMISSION_POLL_INTERVAL = 2 # seconds
+
+# SWE-bench grading: concurrent run_instance jobs (0 sizes the pool to the host's cores and RAM at
+# GRADING_RAM_PER_JOB_GB each), concurrent environment image builds, the run_instance timeout, and
+# the expected duration of an instance that hasn't been graded before
+GRADING_MAX_WORKERS = int(os.getenv("GRADING_MAX_WORKERS", "0"))
+GRADING_RAM_PER_JOB_GB = float(os.getenv("GRADING_RAM_PER_JOB_GB", "4"))
+GRADING_MAX_BUILDS = int(os.getenv("GRADING_MAX_BUILDS", "2"))
+GRADING_TIMEOUT = 1800 # seconds
+GRADING_DEFAULT_DURATION = 300 # seconds
+
 # The name of the network that the sandbox will be connected to
 SANDBOX_NETWORK_NAME = "sandbox-network"
 
@@ -40,4 +82,21 @@ PROXY_DOCKER_IMAGE = "ghcr.io/ridgesai/ridges/proxy:latest"
 # Repositories will be stored at validator/repos/<org>/<repo>
 REPOS_BASE_DIR = Path(__file__).parent.parent / "repos"
 REPO_CACHE_DIR = Path(__file__).parent.parent / "repo_cache"
+
+# One bare mirror per upstream repository; per-commit clones in REPO_CACHE_DIR hard-link its objects
+REPO_MIRROR_DIR = REPO_CACHE_DIR / "mirrors"
+
+# The SWE-bench dataset the validator evaluates on, and where its compact instance index is cached
+SWEBENCH_DATASET_NAME = "SWE-bench/SWE-bench_Verified"
+SWEBENCH_DATASET_SPLIT = "test"
+SWEBENCH_INDEX_CACHE_DIR = Path(__file__).parent.parent / "swebench_cache"
+
+# Repositories at an instance's base commit with its test_patch committed, shared by all runs of
+# the instance and evicted least recently used first beyond REPO_SNAPSHOT_MAX_GB
+REPO_SNAPSHOT_DIR = REPO_CACHE_DIR / "snapshots"
+REPO_SNAPSHOT_MAX_BYTES = int(float(os.getenv("REPO_SNAPSHOT_MAX_GB", "50")) * 1024 ** 3)
+
+# How per-run working copies are made from the repository cache: "auto" (the cheapest strategy
+# the host supports), "reflink", "overlay", "hardlink" or "copy". See workspace.py
+SANDBOX_WORKSPACE_STRATEGY = os.getenv("SANDBOX_WORKSPACE_STRATEGY", "auto")
 AGENTS_BASE_DIR = Path(__file__).parent.parent / "agents" 
\ No newline at end of file
@@ -0,0 +1,59 @@
+"""Bounded thread pool for the blocking Docker, git and filesystem work of the sandboxes.
+
+docker-py, GitPython and subprocess are synchronous. Running them on the event
+loop would stall the websocket shared with every sandbox, so every such call
+goes through run_blocking instead.
+"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, TypeVar
+
+from validator.sandbox.constants import SANDBOX_EXECUTOR_WORKERS
+
+T = TypeVar("T")
+
+_executor = ThreadPoolExecutor(max_workers=SANDBOX_EXECUTOR_WORKERS, thread_name_prefix="sandbox-io")
+
+# Calls waiting for a thread and calls running on one, updated from both the loop and the pool threads
+_counts_lock = threading.Lock()
+_queued = 0
+_active = 0
+
+
+def _call(func: Callable[[], T]) -> T:
+    global _queued, _active
+    with _counts_lock:
+        _queued -= 1
+        _active += 1
+    try:
+        return func()
+    finally:
+        with _counts_lock:
+            _active -= 1
+
+
+def _discard_if_cancelled(future: Future) -> None:
+    # A call cancelled while still queued never reaches _call
+    global _queued
+    if future.cancelled():
+        with _counts_lock:
+            _queued -= 1
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking call on the sandbox thread pool and wait for it without blocking the loop"""
+    global _queued
+    with _counts_lock:
+        _queued += 1
+    future = _executor.submit(_call, functools.partial(func, *args, **kwargs))
+    future.add_done_callback(_discard_if_cancelled)
+    return await asyncio.wrap_future(future)
+
+
+def executor_stats() -> Dict[str, int]:
+    """Pool size, the calls running on it and the calls waiting for a free thread"""
+    with _counts_lock:
+        return {"workers": SANDBOX_EXECUTOR_WORKERS, "active": _active, "queued": _queued}
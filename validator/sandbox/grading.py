@@ -0,0 +1,173 @@
+"""Validator-wide scheduler for SWE-bench grading jobs."""
+
+import asyncio
+import functools
+import heapq
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Set, Tuple
+
+import docker
+from swebench.harness.docker_build import build_env_images
+from swebench.harness.run_evaluation import run_instance
+from swebench.harness.test_spec.test_spec import TestSpec
+
+from validator.sandbox.constants import (
+    GRADING_DEFAULT_DURATION,
+    GRADING_MAX_BUILDS,
+    GRADING_MAX_WORKERS,
+    GRADING_RAM_PER_JOB_GB,
+    GRADING_TIMEOUT,
+)
+from loggers.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+# Weight of the newest observation in the per-instance and per-repo duration estimates
+DURATION_EWMA_ALPHA = 0.3
+
+
+def default_grading_workers() -> int:
+    """Concurrent grading jobs the host can take: one per core, limited by RAM"""
+    cores = os.cpu_count() or 1
+    try:
+        ram_gb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3
+    except (AttributeError, ValueError, OSError):
+        return cores
+    return max(1, min(cores, int(ram_gb // GRADING_RAM_PER_JOB_GB)))
+
+
+class GradingJob:
+    def __init__(self, test_spec: TestSpec, prediction: dict, run_id: str, client: docker.DockerClient,
+                 expected_duration: float):
+        self.test_spec = test_spec
+        self.prediction = prediction
+        self.run_id = run_id
+        self.client = client
+        self.expected_duration = expected_duration
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class GradingScheduler:
+    """Runs SWE-bench grading for all sandboxes on a bounded pool.
+
+    Environment images are built once however many sandboxes need them, with
+    builds that share a base image serialized so the base is built only once
+    too. run_instance jobs then wait in a queue ordered by expected duration,
+    longest first: the slowest instance of an evaluation is its critical path,
+    so starting it first shortens the evaluation. Expected durations are learned
+    from previous runs of the instance, or of its repository.
+    """
+
+    def __init__(self, max_workers: int = 0, max_builds: int = GRADING_MAX_BUILDS):
+        self.max_workers = max_workers or default_grading_workers()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers + max_builds, thread_name_prefix="grading")
+        self._build_semaphore = asyncio.Semaphore(max_builds)
+        # Environment image builds in progress, and the images built so far
+        self._builds: Dict[str, asyncio.Task] = {}
+        self._built: Set[str] = set()
+        self._base_locks: Dict[str, asyncio.Lock] = {}
+        self._queue: List[Tuple[float, int, GradingJob]] = []
+        self._sequence = itertools.count()
+        self._running = 0
+        self._durations: Dict[str, float] = {}
+        self._repo_durations: Dict[str, float] = {}
+        logger.info(f"Grading up to {self.max_workers} SWE-bench instances at once")
+
+    async def grade(self, test_spec: TestSpec, prediction: dict, run_id: str, client: docker.DockerClient):
+        """Build the instance's environment image if needed, then run its tests; returns run_instance's result"""
+        await self._ensure_env_image(test_spec, client)
+
+        expected_duration = self.expected_duration(test_spec.instance_id, test_spec.repo)
+        job = GradingJob(test_spec, prediction, run_id, client, expected_duration)
+        heapq.heappush(self._queue, (-job.expected_duration, next(self._sequence), job))
+        # Dispatch on the next iteration, once every job released by the same build is queued
+        asyncio.get_running_loop().call_soon(self._dispatch)
+        return await job.future
+
+    def expected_duration(self, instance_id: str, repo: str) -> float:
+        return self._durations.get(instance_id, self._repo_durations.get(repo, GRADING_DEFAULT_DURATION))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "max_workers": self.max_workers,
+            "running": self._running,
+            "queued": len(self._queue),
+            "building": len(self._builds),
+            "built_images": len(self._built),
+        }
+
+    async def _ensure_env_image(self, test_spec: TestSpec, client: docker.DockerClient) -> None:
+        key = test_spec.env_image_key
+        if key in self._built:
+            return
+        task = self._builds.get(key)
+        if task is None:
+            # First request for this image, or retry after a failed build
+            task = asyncio.create_task(self._build_env_image(test_spec, client))
+            task.add_done_callback(functools.partial(self._build_finished, key))
+            self._builds[key] = task
+        await asyncio.shield(task)
+
+    def _build_finished(self, key: str, task: asyncio.Task) -> None:
+        del self._builds[key]
+        if not task.cancelled() and task.exception() is None:
+            self._built.add(key)
+
+    async def _build_env_image(self, test_spec: TestSpec, client: docker.DockerClient) -> None:
+        base_lock = self._base_locks.setdefault(test_spec.base_image_key, asyncio.Lock())
+        async with base_lock, self._build_semaphore:
+            started = time.monotonic()
+            await asyncio.get_running_loop().run_in_executor(
+                self._executor, lambda: build_env_images(client, [test_spec], max_workers=1)
+            )
+            logger.info(f"Environment image {test_spec.env_image_key} ready after {time.monotonic() - started:.1f}s")
+
+    def _dispatch(self) -> None:
+        """Start queued jobs while there are free workers"""
+        while self._queue and self._running < self.max_workers:
+            _, _, job = heapq.heappop(self._queue)
+            if job.future.cancelled():
+                continue
+            self._running += 1
+            asyncio.create_task(self._run(job))
+
+    async def _run(self, job: GradingJob) -> None:
+        started = time.monotonic()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self._executor,
+                lambda: run_instance(
+                    test_spec=job.test_spec,
+                    pred=job.prediction,
+                    rm_image=False,
+                    force_rebuild=False,
+                    client=job.client,
+                    run_id=job.run_id,
+                    timeout=GRADING_TIMEOUT,
+                    rewrite_reports=False,
+                ),
+            )
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self._record_duration(job.test_spec, time.monotonic() - started)
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._running -= 1
+            self._dispatch()
+
+    def _record_duration(self, test_spec: TestSpec, duration: float) -> None:
+        for durations, key in ((self._durations, test_spec.instance_id), (self._repo_durations, test_spec.repo)):
+            previous = durations.get(key)
+            durations[key] = duration if previous is None else (
+                DURATION_EWMA_ALPHA * duration + (1 - DURATION_EWMA_ALPHA) * previous
+            )
+
+
+# Global grading scheduler, shared by the sandboxes of every evaluation
+grading_scheduler = GradingScheduler(GRADING_MAX_WORKERS)
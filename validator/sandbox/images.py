@@ -0,0 +1,179 @@
+"""Sandbox image management: digest-checked prefetching and a disk-bounded LRU of instance images."""
+
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Iterable, List, Tuple
+
+import docker
+
+from validator.sandbox.constants import (
+    SANDBOX_DOCKER_IMAGE,
+    SANDBOX_IMAGE_CACHE_MAX_BYTES,
+    SANDBOX_IMAGE_DIGEST_TTL,
+    SANDBOX_IMAGE_USAGE_FILE,
+    SANDBOX_INSTANCE_IMAGE_PREFIX,
+    SANDBOX_PREWARM_CONCURRENCY,
+)
+from validator.sandbox.executor import run_blocking
+from validator.sandbox.sandbox import get_sandbox_image_for_instance
+from loggers.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class ImageManager:
+    """Keeps the per-instance sandbox images current without pulling on every run.
+
+    An image is pulled only when the registry's digest for its tag differs
+    from the local copy's, and a successful check is trusted for
+    SANDBOX_IMAGE_DIGEST_TTL. Every image of an evaluation is resolved in
+    parallel as soon as the evaluation arrives, with progress logged as they
+    complete. Afterwards, instance images not used recently are removed until
+    their unshared layers fit in SANDBOX_IMAGE_CACHE_MAX_GB; last use is
+    persisted so the order survives restarts.
+    """
+
+    def __init__(self, max_bytes: int = SANDBOX_IMAGE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._semaphore = asyncio.Semaphore(SANDBOX_PREWARM_CONCURRENCY)
+        # Image name -> (resolving task, monotonic time it was started)
+        self._resolved: Dict[str, Tuple[asyncio.Task, float]] = {}
+        self._last_used: Dict[str, float] = self._load_usage()
+        self._progress = {"total": 0, "current": 0, "pulled": 0, "local": 0, "failed": 0}
+
+    async def prefetch(self, client: docker.DockerClient, instance_ids: Iterable[str]) -> None:
+        """Resolve the images of all instances in parallel, then evict old images; never raises"""
+        image_names = list(dict.fromkeys(get_sandbox_image_for_instance(instance_id) for instance_id in instance_ids))
+        self._progress = {"total": len(image_names), "current": 0, "pulled": 0, "local": 0, "failed": 0}
+        started = time.monotonic()
+        await asyncio.gather(*(self._resolve(client, image_name) for image_name in image_names), return_exceptions=True)
+        logger.info(f"Prefetched sandbox images in {time.monotonic() - started:.1f}s: {self.progress()}")
+        try:
+            await run_blocking(self._evict, client, set(image_names))
+        except Exception as e:
+            logger.warning(f"Failed to evict old sandbox images: {e}")
+
+    async def image_for(self, client: docker.DockerClient, instance_id: str) -> str:
+        """The image to run an instance with: its current instance image, or the default sandbox image"""
+        return await self._resolve(client, get_sandbox_image_for_instance(instance_id))
+
+    def progress(self) -> Dict[str, int]:
+        """Images of the latest prefetch: total, already current, pulled, local (an existing copy that could
+        not be checked or updated) and failed (the default sandbox image is used instead)"""
+        return dict(self._progress)
+
+    async def _resolve(self, client: docker.DockerClient, image_name: str) -> str:
+        entry = self._resolved.get(image_name)
+        if entry is None or time.monotonic() - entry[1] > SANDBOX_IMAGE_DIGEST_TTL or self._failed(entry[0]):
+            entry = (asyncio.create_task(self._resolve_with_limit(client, image_name)), time.monotonic())
+            self._resolved[image_name] = entry
+        resolved = await asyncio.shield(entry[0])
+        self._last_used[image_name] = time.time()
+        return resolved
+
+    @staticmethod
+    def _failed(task: asyncio.Task) -> bool:
+        return task.done() and (task.cancelled() or task.exception() is not None)
+
+    async def _resolve_with_limit(self, client: docker.DockerClient, image_name: str) -> str:
+        async with self._semaphore:
+            resolved, outcome = await run_blocking(self._ensure_current, client, image_name)
+        self._progress[outcome] = self._progress.get(outcome, 0) + 1
+        done = sum(count for key, count in self._progress.items() if key != "total")
+        if self._progress["total"]:
+            logger.info(f"Sandbox images: {done}/{self._progress['total']} ready ({image_name} {outcome})")
+        return resolved
+
+    def _ensure_current(self, client: docker.DockerClient, image_name: str) -> Tuple[str, str]:
+        """Pull the image if the registry has a newer digest (blocking operation); returns (image, outcome)"""
+        local_digests: List[str] = []
+        try:
+            local_digests = client.images.get(image_name).attrs.get("RepoDigests") or []
+        except docker.errors.ImageNotFound:
+            pass
+
+        try:
+            remote_digest = client.images.get_registry_data(image_name).id
+        except Exception as e:
+            remote_digest = None
+            logger.warning(f"Could not check the registry digest of {image_name}: {e}")
+
+        repository = image_name.rsplit(":", 1)[0]
+        if remote_digest is not None and f"{repository}@{remote_digest}" in local_digests:
+            logger.debug(f"Image {image_name} is current ({remote_digest})")
+            return image_name, "current"
+
+        if remote_digest is not None:
+            logger.info(f"Pulling {image_name} ({remote_digest})")
+            try:
+                client.images.pull(image_name)
+                logger.info(f"Successfully pulled image: {image_name}")
+                return image_name, "pulled"
+            except Exception as e:
+                logger.warning(f"Failed to pull commit-specific image {image_name}: {e}")
+
+        # Check if image exists locally as fallback
+        if local_digests or self._exists(client, image_name):
+            logger.info(f"Using existing local image: {image_name}")
+            return image_name, "local"
+        logger.info(f"Falling back to default sandbox image: {SANDBOX_DOCKER_IMAGE}")
+        return SANDBOX_DOCKER_IMAGE, "failed"
+
+    @staticmethod
+    def _exists(client: docker.DockerClient, image_name: str) -> bool:
+        try:
+            client.images.get(image_name)
+            return True
+        except docker.errors.ImageNotFound:
+            return False
+
+    def _evict(self, client: docker.DockerClient, keep: set) -> None:
+        """Remove least recently used instance images until their unshared layers fit (blocking operation)"""
+        images = []
+        for image in client.df().get("Images") or []:
+            tags = [tag for tag in image.get("RepoTags") or [] if tag.startswith(SANDBOX_INSTANCE_IMAGE_PREFIX)]
+            if not tags:
+                continue
+            # Layers shared with other images (the sandbox base) are freed only with the last of them
+            shared = max(image.get("SharedSize") or 0, 0)
+            unique_size = max((image.get("Size") or 0) - shared, 0)
+            images.append((max(self._last_used.get(tag, 0.0) for tag in tags), tags, unique_size))
+
+        total = sum(size for _, _, size in images)
+        for _, tags, size in sorted(images, key=lambda entry: entry[0]):
+            if total <= self.max_bytes:
+                break
+            if keep.intersection(tags):
+                continue
+            try:
+                for tag in tags:
+                    client.images.remove(tag)
+                    self._last_used.pop(tag, None)
+                    self._resolved.pop(tag, None)
+                total -= size
+                logger.info(f"Evicted sandbox image {', '.join(tags)} ({size / 1024 ** 3:.1f}GB)")
+            except docker.errors.APIError as e:
+                # Still used by a container
+                logger.debug(f"Could not evict {', '.join(tags)}: {e}")
+        self._save_usage()
+
+    @staticmethod
+    def _load_usage() -> Dict[str, float]:
+        try:
+            return json.loads(SANDBOX_IMAGE_USAGE_FILE.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _save_usage(self) -> None:
+        try:
+            partial = SANDBOX_IMAGE_USAGE_FILE.with_suffix(".tmp")
+            partial.write_text(json.dumps(self._last_used))
+            os.replace(partial, SANDBOX_IMAGE_USAGE_FILE)
+        except OSError as e:
+            logger.warning(f"Could not save sandbox image usage: {e}")
+
+
+# Global image manager, shared by every evaluation so digest checks and usage carry over
+image_manager = ImageManager()
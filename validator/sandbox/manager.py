@@ -1,7 +1,7 @@
 import asyncio
 import shutil
 from pathlib import Path
-from typing import TYPE_CHECKING, List, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional
 from datetime import datetime, timezone
 
 import docker
@@ -14,10 +14,19 @@ from validator.sandbox.constants import (
     PROXY_CONTAINER_NAME,
     PROXY_DOCKER_IMAGE,
     REPOS_BASE_DIR,
+    SANDBOX_DIR,
+    SANDBOX_DOCKER_IMAGE,
+    SANDBOX_MAX_RAM_USAGE,
     SANDBOX_NETWORK_NAME,
+    SANDBOX_PREWARM_CONCURRENCY,
 )
 from validator.sandbox.schema import EvaluationRun, SwebenchProblem
-from validator.sandbox.sandbox import Sandbox
+from validator.sandbox.capacity import host_capacity
+from validator.sandbox.executor import run_blocking
+from validator.sandbox.grading import grading_scheduler
+from validator.sandbox.images import image_manager
+from validator.sandbox.monitor import ContainerMonitor
+from validator.sandbox.sandbox import Sandbox, get_sandbox_volumes
 from loggers.logging_utils import get_logger
 
 if TYPE_CHECKING:
@@ -25,6 +34,95 @@ if TYPE_CHECKING:
 
 logger = get_logger(__name__)
 
+class WarmSandboxPool:
+    """Stopped sandbox containers created ahead of time, one per evaluation run.
+
+    As soon as an evaluation's runs are known, its instance images are
+    prefetched and a container is created for every run in the background,
+    while the agent is downloaded and the repositories are prepared. Starting a sandbox
+    then only has to start its container. Mounts are fixed at creation, which
+    works because every host path a sandbox mounts is derived from its run.
+    """
+
+    def __init__(self, docker_client: docker.DockerClient):
+        self.docker = docker_client
+        self._semaphore = asyncio.Semaphore(SANDBOX_PREWARM_CONCURRENCY)
+        self._prefetch: Optional[asyncio.Task] = None
+        self._containers: Dict[str, asyncio.Task] = {}
+
+    def prewarm(self, evaluation_runs: List[EvaluationRun], agent_dir: Path) -> None:
+        """Start creating a container for each run that doesn't have one yet"""
+        if self._prefetch is None or self._prefetch.done():
+            self._prefetch = asyncio.create_task(image_manager.prefetch(
+                self.docker, [evaluation_run.swebench_instance_id for evaluation_run in evaluation_runs]
+            ))
+        for evaluation_run in evaluation_runs:
+            if evaluation_run.run_id not in self._containers:
+                self._containers[evaluation_run.run_id] = asyncio.create_task(
+                    self._prewarm_container(evaluation_run, agent_dir)
+                )
+
+    async def acquire(self, evaluation_run: EvaluationRun, agent_dir: Path) -> Container:
+        """Start the run's pre-created container, creating one now if prewarming didn't"""
+        container = None
+        task = self._containers.pop(evaluation_run.run_id, None)
+        if task is not None:
+            container = await task
+        if container is None:
+            try:
+                image_name = await self._image_for(evaluation_run.swebench_instance_id)
+                container = await run_blocking(self._create_container, image_name, evaluation_run, agent_dir)
+            except docker.errors.ImageNotFound:
+                raise SystemExit(f"No docker image for {SANDBOX_DOCKER_IMAGE}. Run `./ridges.py validator run` to build the images")
+            except docker.errors.APIError as e:
+                if "No such image" in str(e):
+                    raise SystemExit(f"No docker image for {SANDBOX_DOCKER_IMAGE}. Run `./ridges.py validator run` to build the images")
+                raise
+        await run_blocking(container.start)
+        return container
+
+    def drain(self) -> List[Container]:
+        """Cancel pending prewarming; returns the containers that were never started, for removal"""
+        unused = []
+        for task in self._containers.values():
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled() and task.result() is not None:
+                unused.append(task.result())
+        self._containers.clear()
+        if self._prefetch is not None:
+            self._prefetch.cancel()
+            self._prefetch = None
+        return unused
+
+    async def _prewarm_container(self, evaluation_run: EvaluationRun, agent_dir: Path) -> Optional[Container]:
+        try:
+            image_name = await self._image_for(evaluation_run.swebench_instance_id)
+            async with self._semaphore:
+                return await run_blocking(self._create_container, image_name, evaluation_run, agent_dir)
+        except Exception as e:
+            logger.warning(f"Failed to prewarm container for {evaluation_run.run_id}: {e}")
+            return None
+
+    async def _image_for(self, instance_id: str) -> str:
+        return await image_manager.image_for(self.docker, instance_id)
+
+    def _create_container(self, image_name: str, evaluation_run: EvaluationRun, agent_dir: Path) -> Container:
+        """Create the run's container without starting it (blocking operation)"""
+        return self.docker.containers.create(
+            auto_remove=True,
+            image=image_name,
+            network=SANDBOX_NETWORK_NAME,
+            volumes=get_sandbox_volumes(evaluation_run, agent_dir),
+            working_dir=SANDBOX_DIR,
+            environment={
+                "AI_PROXY_URL": "http://sandbox-proxy",
+                "AI_EMBEDDING_PROXY_URL": "http://sandbox-proxy"
+            },
+            # Add CPU and memory limits to prevent resource exhaustion
+            mem_limit=f"{SANDBOX_MAX_RAM_USAGE}m",
+        )
+
 class SandboxManager:
     """Manages sandbox orchestration and Docker infrastructure"""
     
@@ -40,6 +138,12 @@ class SandboxManager:
         
         self.sandboxes: List[Sandbox] = []
         self.proxy_container: Optional[Container] = None
+        self.warm_pool = WarmSandboxPool(self.docker)
+        self.container_monitor = ContainerMonitor(self.docker)
+        
+        # Patch generation is admitted by host capacity, separately from grading (see grading.py),
+        # so agents keep generating while finished sandboxes are graded
+        self.admission = host_capacity
         
         # Setup infrastructure
         self._setup_network()
@@ -83,6 +187,10 @@ class SandboxManager:
         network = self.docker.networks.get(SANDBOX_NETWORK_NAME)
         network.connect(self.proxy_container)
     
+    def prewarm_sandboxes(self, evaluation_runs: List[EvaluationRun], agent_dir: Path) -> None:
+        """Pull images and create stopped containers for the runs in the background"""
+        self.warm_pool.prewarm(evaluation_runs, agent_dir)
+    
     @tracer.wrap(resource="create-sandbox")
     async def create_sandbox(self, evaluation_run: EvaluationRun, problem: SwebenchProblem, agent_dir: Path) -> Sandbox:
         """Create a new sandbox for evaluation"""
@@ -97,7 +205,14 @@ class SandboxManager:
     
     @tracer.wrap(resource="run-all-sandboxes")
     async def run_all_sandboxes(self) -> None:
-        """Run all sandboxes in parallel"""
+        """Run all sandboxes as a generate-then-grade pipeline.
+
+        Every sandbox starts at once but waits until the host has capacity for
+        its agent; once its patch is generated it moves on to grading and frees
+        that capacity. Sandboxes whose instances take longest to grade are
+        admitted first, so their grading, the evaluation's critical path,
+        starts earliest.
+        """
         async def run_sandbox_with_error_handling(sandbox: Sandbox):
             """Run a single sandbox with error handling"""
             try:
@@ -109,10 +224,19 @@ class SandboxManager:
                 sandbox.evaluation_run.solved = False
                 await sandbox._send_update()
         
-        # Create tasks for all sandboxes to run in parallel
+        # Create tasks for all sandboxes to run in parallel; waiting sandboxes are admitted in this order
+        ordered = sorted(
+            self.sandboxes,
+            key=lambda sandbox: grading_scheduler.expected_duration(sandbox.problem.instance_id, sandbox.problem.repo),
+            reverse=True,
+        )
+        logger.info(
+            f"Running {len(ordered)} sandboxes with up to {grading_scheduler.max_workers} grading at once; "
+            f"host capacity: {self.admission.state()}"
+        )
         tasks = [
             asyncio.create_task(run_sandbox_with_error_handling(sandbox))
-            for sandbox in self.sandboxes
+            for sandbox in ordered
         ]
         
         # Run all tasks concurrently
@@ -120,7 +244,7 @@ class SandboxManager:
             await asyncio.gather(*tasks, return_exceptions=True)
     
     @tracer.wrap(resource="cleanup-sandbox-manager")
-    def cleanup(self, force_cancel: bool = True) -> None:
+    async def cleanup(self, force_cancel: bool = True) -> None:
         """Clean up sandbox resources"""
         # Cancel running sandboxes
         if force_cancel:
@@ -128,6 +252,27 @@ class SandboxManager:
                 if hasattr(sandbox, '_task') and sandbox._task and not sandbox._task.done():
                     sandbox._task.cancel()
         
+        # Drop containers that were prewarmed but never used
+        unused_containers = self.warm_pool.drain()
+        self.container_monitor.stop()
+        
+        await run_blocking(self._remove_resources, unused_containers, force_cancel)
+        
+        if force_cancel:
+            self.sandboxes.clear()
+        else:
+            # Remove only completed sandboxes
+            self.sandboxes = [s for s in self.sandboxes if hasattr(s, 'evaluation_run') and 
+                             s.evaluation_run.status not in ["result_scored"]]
+    
+    def _remove_resources(self, unused_containers: List[Container], force_cancel: bool) -> None:
+        """Remove containers and directories left by the sandboxes (blocking operation)"""
+        for container in unused_containers:
+            try:
+                container.remove(force=True)
+            except Exception:
+                pass
+        
         # Clean up sandboxes
         for sandbox in self.sandboxes:
             try:
@@ -164,9 +309,3 @@ class SandboxManager:
                         shutil.rmtree(path, ignore_errors=True)
                 except Exception:
                     pass
-            
-            self.sandboxes.clear()
-        else:
-            # Remove only completed sandboxes
-            self.sandboxes = [s for s in self.sandboxes if hasattr(s, 'evaluation_run') and 
-                             s.evaluation_run.status not in ["result_scored"]]
@@ -0,0 +1,168 @@
+"""Shared container monitoring for all sandboxes of a SandboxManager.
+
+One Docker events subscription reports container exits, and one reader thread
+samples the memory usage of every watched container. Both fan out to the
+per-container ContainerWatch objects the sandboxes wait on, so the cost of
+monitoring does not grow with the number of sandboxes.
+"""
+
+import asyncio
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+import docker
+from docker.errors import NotFound as DockerNotFound
+
+from validator.sandbox.constants import SANDBOX_MAX_RAM_USAGE, SANDBOX_STATS_INTERVAL
+from loggers.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+# Docker events that end (or explain the end of) a sandbox container
+CONTAINER_EVENTS = ["die", "oom", "kill"]
+
+# Memory usage files of a container's cgroup, for cgroup v2 (systemd and cgroupfs drivers) and v1
+CGROUP_MEMORY_PATHS = (
+    "/sys/fs/cgroup/system.slice/docker-{id}.scope/memory.current",
+    "/sys/fs/cgroup/docker/{id}/memory.current",
+    "/sys/fs/cgroup/memory/docker/{id}/memory.usage_in_bytes",
+)
+
+
+class ContainerWatch:
+    """What the shared monitor has observed about one container"""
+
+    def __init__(self, container_id: str):
+        self.container_id = container_id
+        self.exited = asyncio.Event()
+        self.memory_exceeded = asyncio.Event()
+        # Events seen for the container, e.g. ["kill", "die"] or ["oom", "die"]
+        self.events = []
+        self.exit_code: Optional[int] = None
+        self.memory_usage_mb: Optional[float] = None
+        self.peak_memory_mb = 0.0
+
+    def _on_event(self, action: str, attributes: Dict[str, str]) -> None:
+        self.events.append(action)
+        if action == "die":
+            exit_code = attributes.get("exitCode")
+            self.exit_code = int(exit_code) if exit_code is not None and exit_code.isdigit() else None
+            self.exited.set()
+
+    def _on_memory(self, usage_mb: float) -> None:
+        self.memory_usage_mb = usage_mb
+        self.peak_memory_mb = max(self.peak_memory_mb, usage_mb)
+        if usage_mb > SANDBOX_MAX_RAM_USAGE:
+            self.memory_exceeded.set()
+
+
+class ContainerMonitor:
+    """One Docker events subscription and one memory reader, fanned out to ContainerWatch objects"""
+
+    def __init__(self, docker_client: docker.DockerClient):
+        self.docker = docker_client
+        self._watches: Dict[str, ContainerWatch] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopped = threading.Event()
+        self._events = None
+        self._threads = []
+
+    def watch(self, container_id: str) -> ContainerWatch:
+        """Start reporting exits and memory usage for a container; must be called on the event loop"""
+        if self._loop is None:
+            self._start(asyncio.get_running_loop())
+        watch = ContainerWatch(container_id)
+        self._watches[container_id] = watch
+        return watch
+
+    def unwatch(self, container_id: str) -> None:
+        self._watches.pop(container_id, None)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._events is not None:
+            try:
+                self._events.close()
+            except Exception:
+                pass
+        self._watches.clear()
+
+    def _start(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        for target, name in ((self._read_events, "sandbox-events"), (self._read_memory, "sandbox-stats")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _dispatch(self, container_id: str, method: str, *args) -> None:
+        """Deliver an observation to the container's watch on the event loop"""
+        def deliver():
+            watch = self._watches.get(container_id)
+            if watch is not None:
+                getattr(watch, method)(*args)
+        try:
+            self._loop.call_soon_threadsafe(deliver)
+        except RuntimeError:
+            # The loop is closed; nobody is waiting anymore
+            self._stopped.set()
+
+    def _read_events(self) -> None:
+        """Follow container events, resubscribing if the stream drops"""
+        while not self._stopped.is_set():
+            try:
+                self._events = self.docker.events(
+                    decode=True, filters={"type": "container", "event": CONTAINER_EVENTS}
+                )
+                # Catch up on exits that happened before this subscription was in place
+                self._reconcile()
+                for event in self._events:
+                    container_id = event.get("id") or event.get("Actor", {}).get("ID")
+                    if container_id in self._watches:
+                        self._dispatch(
+                            container_id, "_on_event", event.get("Action") or event.get("status"),
+                            event.get("Actor", {}).get("Attributes", {}),
+                        )
+            except Exception as e:
+                if self._stopped.is_set():
+                    break
+                logger.warning(f"Docker events stream failed, resubscribing: {e}")
+            self._stopped.wait(1)
+
+    def _reconcile(self) -> None:
+        """Mark watched containers that exited while no events stream was listening"""
+        for container_id in list(self._watches):
+            try:
+                container = self.docker.containers.get(container_id)
+                exited = container.status in ("exited", "dead", "removing")
+            except DockerNotFound:
+                exited = True
+            except Exception:
+                continue
+            if exited:
+                self._dispatch(container_id, "_on_event", "die", {})
+
+    def _read_memory(self) -> None:
+        """Sample the memory usage of every watched container each SANDBOX_STATS_INTERVAL"""
+        while not self._stopped.wait(SANDBOX_STATS_INTERVAL):
+            for container_id in list(self._watches):
+                usage = self._memory_usage(container_id)
+                if usage is not None:
+                    self._dispatch(container_id, "_on_memory", usage / (1024 * 1024))
+
+    def _memory_usage(self, container_id: str) -> Optional[int]:
+        """Memory usage in bytes, from the cgroup if visible to us, otherwise from the Docker API"""
+        for path in CGROUP_MEMORY_PATHS:
+            try:
+                return int(Path(path.format(id=container_id)).read_text())
+            except (OSError, ValueError):
+                continue
+        try:
+            memory_stats = self.docker.api.stats(container_id, stream=False).get("memory_stats", {})
+        except Exception:
+            return None
+        # Try different memory usage keys
+        for key in ["usage", "current", "memory.current"]:
+            if key in memory_stats:
+                return memory_stats[key]
+        return None
@@ -13,19 +13,23 @@ from ddtrace import tracer
 import docker
 from docker.errors import NotFound as DockerNotFound
 from docker.models.containers import Container
-from swebench.harness.docker_build import build_env_images
-from swebench.harness.run_evaluation import load_swebench_dataset, make_test_spec, run_instance
 
 from validator.sandbox.clone_repo import clone_repo
+from validator.sandbox.executor import run_blocking
+from validator.sandbox.grading import grading_scheduler
 from validator.sandbox.constants import (
     MAIN_FILE, REPOS_BASE_DIR, REPO_CACHE_DIR, SANDBOX_DIR, SANDBOX_DOCKER_IMAGE,
     SANDBOX_INPUT_FILE, SANDBOX_MAIN_FILE, SANDBOX_NETWORK_NAME, SANDBOX_OUTPUT_FILE,
     SANDBOX_REPO_DIR, SANDBOX_SOURCE_DIR, SANDBOX_MAX_RAM_USAGE, SANDBOX_MAX_RUNTIME
 )
 from validator.sandbox.schema import EvaluationRun, SandboxInput, SwebenchProblem
+from validator.sandbox.snapshots import snapshot_cache
+from validator.sandbox.workspace import create_workspace, remove_workspace
+from validator.utils.swebench_index import swebench_index
 from loggers.logging_utils import get_logger
 
 if TYPE_CHECKING:
+    from validator.sandbox.capacity import Admission
     from validator.sandbox.manager import SandboxManager
 
 logger = get_logger(__name__)
@@ -45,6 +49,34 @@ def get_sandbox_image_for_instance(instance_id: str) -> str:
     # Fallback to default image
     return SANDBOX_DOCKER_IMAGE
 
+def get_sandbox_io_dir(agent_dir: Path, run_id: str) -> Path:
+    """Host directory holding the input/output files of an evaluation run"""
+    return agent_dir.absolute() / f"io-{run_id}"
+
+def get_sandbox_repo_dir(run_id: str) -> Path:
+    """Host directory holding the working copy of the repository for an evaluation run"""
+    return (REPOS_BASE_DIR / run_id).absolute()
+
+def get_sandbox_volumes(evaluation_run: EvaluationRun, agent_dir: Path) -> Dict[str, Dict[str, str]]:
+    """Mounts for an evaluation run's container.
+
+    The host paths depend only on the run, so the container can be created
+    before they are populated; they must exist by the time it is started.
+    """
+    io_dir = get_sandbox_io_dir(agent_dir, evaluation_run.run_id)
+    volumes = {
+        str(MAIN_FILE): {"bind": SANDBOX_MAIN_FILE, "mode": "ro"},
+        str(io_dir / "input.json"): {"bind": SANDBOX_INPUT_FILE, "mode": "ro"},
+        str(io_dir / "output.json"): {"bind": SANDBOX_OUTPUT_FILE, "mode": "rw"},
+        str(agent_dir.absolute()): {"bind": SANDBOX_SOURCE_DIR, "mode": "ro"},
+        str(get_sandbox_repo_dir(evaluation_run.run_id)): {"bind": SANDBOX_REPO_DIR, "mode": "rw"},
+    }
+    # Mount pre-embedded file if exists
+    embed_file = Path(__file__).parent.parent / 'repo_embeds' / f'{evaluation_run.swebench_instance_id}.json.gz'
+    if embed_file.exists():
+        volumes[str(embed_file)] = {'bind': PRE_EMBEDDED_MOUNT, 'mode': 'ro'}
+    return volumes
+
 class Sandbox:
     """Async sandbox for running agent evaluations"""
     
@@ -56,6 +88,9 @@ class Sandbox:
         self.manager = manager
         self.container: Optional[Container] = None
         self.repo_dir: Optional[Path] = None
+        self.snapshot_dir: Optional[Path] = None
+        self.generation_started_at: Optional[datetime] = None
+        self.admission: Optional["Admission"] = None
         self._cancelled = asyncio.Event()
         
         # Validate agent directory
@@ -67,10 +102,14 @@ class Sandbox:
         """Run the complete sandbox evaluation pipeline"""
         
         try:
-            # Generate patch
-            await self._generate_patch()
+            # Generate patch, once the host has capacity for another agent
+            async with self.manager.admission.admit(self.evaluation_run.run_id) as admission:
+                self.admission = admission
+                self.generation_started_at = datetime.now(timezone.utc)
+                await self._generate_patch()
             
-            # Evaluate patch if generated
+            # Evaluate patch if generated; grading is bounded by the grading scheduler, so the
+            # capacity is already free for another agent
             if self.evaluation_run.response:
                 self.evaluation_run.status = "eval_started"
                 self.evaluation_run.eval_started_at = datetime.now(timezone.utc)
@@ -110,7 +149,7 @@ class Sandbox:
         self.repo_dir = await self._setup_repository(repo_name, base_commit)
         
         # Create input/output files
-        io_dir = self.agent_dir / f"io-{self.evaluation_run.run_id}"
+        io_dir = get_sandbox_io_dir(self.agent_dir, self.evaluation_run.run_id)
         io_dir.mkdir(parents=True, exist_ok=True)
         input_file = io_dir / "input.json"
         output_file = io_dir / "output.json"
@@ -126,57 +165,8 @@ class Sandbox:
         input_file.write_text(input.model_dump_json())
         output_file.touch()
         
-        # Run container
-        try:
-            volumes = {
-                str(MAIN_FILE): {"bind": SANDBOX_MAIN_FILE, "mode": "ro"},
-                str(input_file): {"bind": SANDBOX_INPUT_FILE, "mode": "ro"},
-                str(output_file): {"bind": SANDBOX_OUTPUT_FILE, "mode": "rw"},
-                str(self.agent_dir): {"bind": SANDBOX_SOURCE_DIR, "mode": "ro"},
-                str(self.repo_dir): {"bind": SANDBOX_REPO_DIR, "mode": "rw"},
-            }
-            # Mount pre-embedded file if exists
-            embed_file = Path(__file__).parent.parent / 'repo_embeds' / f'{self.evaluation_run.swebench_instance_id}.json.gz'
-            if embed_file.exists():
-                volumes[str(embed_file)] = {'bind': PRE_EMBEDDED_MOUNT, 'mode': 'ro'}
-
-            # Get image name and always pull the latest version from GHCR
-            image_name = get_sandbox_image_for_instance(self.evaluation_run.swebench_instance_id)
-            logger.info(f"Pulling latest version of image: {image_name}")
-            try:
-                self.manager.docker.images.pull(image_name)
-                logger.info(f"Successfully pulled image: {image_name}")
-            except Exception as e:
-                logger.warning(f"Failed to pull commit-specific image {image_name}: {e}")
-                # Check if image exists locally as fallback
-                try:
-                    self.manager.docker.images.get(image_name)
-                    logger.info(f"Using existing local image: {image_name}")
-                except docker.errors.ImageNotFound:
-                    logger.info(f"Falling back to default sandbox image: {SANDBOX_DOCKER_IMAGE}")
-                    image_name = SANDBOX_DOCKER_IMAGE
-
-            self.container = self.manager.docker.containers.run(
-                remove=True,
-                image=image_name,
-                network=SANDBOX_NETWORK_NAME,
-                volumes=volumes,
-                working_dir=SANDBOX_DIR,
-                environment={
-                    "AI_PROXY_URL": "http://sandbox-proxy",
-                    "AI_EMBEDDING_PROXY_URL": "http://sandbox-proxy"
-                },
-                detach=True,
-                # Add CPU and memory limits to prevent resource exhaustion
-                mem_limit=f"{SANDBOX_MAX_RAM_USAGE}m",
-            )
-            
-        except docker.errors.ImageNotFound:
-            raise SystemExit(f"No docker image for {SANDBOX_DOCKER_IMAGE}. Run `./ridges.py validator run` to build the images")
-        except docker.errors.APIError as e:
-            if "No such image" in str(e):
-                raise SystemExit(f"No docker image for {SANDBOX_DOCKER_IMAGE}. Run `./ridges.py validator run` to build the images")
-            raise
+        # Start the container pre-created for this run, or create one now
+        self.container = await self.manager.warm_pool.acquire(self.evaluation_run, self.agent_dir)
         
         # Monitor container with asyncio timeout as additional safety
         try:
@@ -185,15 +175,12 @@ class Sandbox:
             logger.error(f"Container monitoring timed out for {self.evaluation_run.run_id}, force killing")
             try:
                 # Try graceful stop first
-                try:
-                    self.container.stop(timeout=5)
-                except Exception:
-                    self.container.kill()
+                await run_blocking(self._stop_container)
                 # Wait a bit for graceful shutdown
                 await asyncio.sleep(2)
                 # Force remove if still exists
                 try:
-                    self.container.remove(force=True)
+                    await run_blocking(self.container.remove, force=True)
                 except Exception:
                     pass
             except Exception as e:
@@ -225,166 +212,118 @@ class Sandbox:
         """Setup repository from cache or clone"""
         cache_key = f"{repo_name.replace('/', '_')}_{base_commit}"
         cache_path = REPO_CACHE_DIR / cache_key
-        repo_path = REPOS_BASE_DIR / self.evaluation_run.run_id
+        repo_path = get_sandbox_repo_dir(self.evaluation_run.run_id)
         
         REPO_CACHE_DIR.mkdir(parents=True, exist_ok=True)
         repo_path.parent.mkdir(parents=True, exist_ok=True)
         
         # Clone to cache if needed
         if not cache_path.exists():
-            await asyncio.get_event_loop().run_in_executor(
-                None, clone_repo, cache_path, repo_name, base_commit
-            )
-        
-        # Copy from cache
-        if repo_path.exists():
-            shutil.rmtree(repo_path, ignore_errors=True)
-        shutil.copytree(cache_path, repo_path)
-
-        try:
-            from swebench.harness.run_evaluation import load_swebench_dataset  # local import to avoid at module load
-
-            instance_id = self.evaluation_run.swebench_instance_id
-            instance = load_swebench_dataset(
-                "SWE-bench/SWE-bench_Verified",
-                "test",
-                [instance_id],
-            )[0]
-
-            test_patch = instance.get("test_patch")
-            if test_patch:
-                proc = subprocess.run(
-                    ["git", "apply", "--verbose", "--reject", "--unidiff-zero", "-"],
-                    cwd=repo_path,
-                    input=test_patch,
-                    text=True,
-                    capture_output=True,
-                )
-                if proc.returncode != 0:
-                    logger.error(
-                        "Failed to apply test_patch for %s: %s %s",
-                        instance_id,
-                        proc.stdout,
-                        proc.stderr,
-                    )
-                    raise RuntimeError(
-                        f"Failed to apply test_patch for {instance_id}. See logs for details."
-                    )
-                else:
-                    logger.info("Successfully applied test_patch for %s", instance_id)
-                    try:
-                        subprocess.run(["git", "add", "-A"], cwd=repo_path, check=True)
-                        subprocess.run([
-                            "git",
-                            "-c",
-                            "user.email=tao@localhost",
-                            "-c",
-                            "user.name=Tao God",
-                            "commit",
-                            "-m",
-                            "updates",
-                        ], cwd=repo_path, check=True)
-                        logger.info("Committed test_patch for %s", instance_id)
-                    except Exception as ce:
-                        logger.warning("Could not commit test_patch for %s: %s", instance_id, ce)
-        except Exception as e:
-            # Reraise to fail early – the sandbox should not continue with an incomplete test suite
-            raise
+            await run_blocking(clone_repo, cache_path, repo_name, base_commit)
         
+        # Create the working copy without blocking the other sandboxes
+        await run_blocking(self._prepare_workspace, cache_path, repo_path)
         return repo_path
     
+    @tracer.wrap(resource="prepare-workspace")
+    def _prepare_workspace(self, cache_path: Path, repo_path: Path) -> None:
+        """Create the run's working copy from the instance's prepared snapshot (blocking operation)"""
+        instance_id = self.evaluation_run.swebench_instance_id
+        instance = swebench_index.instance(instance_id)
+
+        # The base commit with the test_patch committed, built once per instance and shared by all runs
+        self.snapshot_dir = snapshot_cache.acquire(
+            instance_id, cache_path, self.problem.base_commit, instance.get("test_patch")
+        )
+        strategy = create_workspace(self.snapshot_dir, repo_path)
+        logger.debug(f"Created {strategy} workspace for {self.evaluation_run.run_id} at {repo_path}")
+    
     @tracer.wrap(resource="monitor-container")
     async def _monitor_container(self) -> None:
-        """Monitor container execution with resource limits"""
+        """Wait for the container to exit, enforcing resource limits"""
         logger.info(f"Starting container monitoring for {self.evaluation_run.run_id}")
         container_start_time = datetime.now(timezone.utc)
+        monitor = self.manager.container_monitor
+        watch = monitor.watch(self.container.id)
+        if self.admission is not None:
+            # Lets admission control see the container's memory and learn its peak
+            self.admission.watch = watch
         
-        while True:
+        try:
+            # The container may have exited before it was watched
+            if await self._container_exited():
+                logger.info(f"Container {self.evaluation_run.run_id} exited normally")
+                return
+            
+            # Runtime limit - use container start time as fallback
+            sandbox_start_time = self.generation_started_at or container_start_time
+            remaining = SANDBOX_MAX_RUNTIME - (datetime.now(timezone.utc) - sandbox_start_time).total_seconds()
+            
+            waiters = [
+                asyncio.create_task(watch.exited.wait()),
+                asyncio.create_task(watch.memory_exceeded.wait()),
+                asyncio.create_task(self._cancelled.wait()),
+            ]
+            try:
+                await asyncio.wait(waiters, timeout=max(remaining, 0), return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+            
+            if watch.exited.is_set():
+                logger.info(
+                    f"Container {self.evaluation_run.run_id} exited with code {watch.exit_code} "
+                    f"(events: {', '.join(watch.events)})"
+                )
+                return
+            
             if self._cancelled.is_set():
                 logger.info(f"Container monitoring cancelled for {self.evaluation_run.run_id}")
-                try:
-                    self.container.stop(timeout=5)
-                except Exception:
-                    self.container.kill()
+                await run_blocking(self._stop_container)
                 raise asyncio.CancelledError()
             
+            if watch.memory_exceeded.is_set():
+                logger.warning(f"Container {self.evaluation_run.run_id} exceeded RAM limit: {watch.memory_usage_mb:.1f}MB")
+                await run_blocking(self._stop_container)
+                raise MemoryError(f"RAM limit exceeded: {watch.memory_usage_mb:.1f}MB")
+            
+            runtime = (datetime.now(timezone.utc) - sandbox_start_time).total_seconds()
+            logger.error(f"Container {self.evaluation_run.run_id} exceeded runtime limit: {runtime:.1f}s")
             try:
-                self.container.reload()
-                status = self.container.status
-                logger.debug(f"Container {self.evaluation_run.run_id} status: {status}")
-                
-                if status == "exited":
-                    logger.info(f"Container {self.evaluation_run.run_id} exited normally")
-                    break
-                elif status in ["dead", "removing"]:
-                    logger.info(f"Container {self.evaluation_run.run_id} is {status}")
-                    break
-                
-                # Check memory usage
+                # Try graceful stop first, then force kill
+                await run_blocking(self.container.stop, timeout=5)
+                logger.info(f"Successfully stopped container {self.evaluation_run.run_id}")
+            except Exception as stop_error:
+                logger.warning(f"Failed to stop container gracefully, force killing: {stop_error}")
                 try:
-                    stats = self.container.stats(stream=False)
-                    memory_stats = stats.get("memory_stats", {})
-                    
-                    # Try different memory usage keys
-                    for key in ["usage", "current", "memory.current"]:
-                        if key in memory_stats:
-                            usage_mb = memory_stats[key] / (1024 * 1024)
-                            if usage_mb > SANDBOX_MAX_RAM_USAGE:
-                                logger.warning(f"Container {self.evaluation_run.run_id} exceeded RAM limit: {usage_mb:.1f}MB")
-                                try:
-                                    self.container.stop(timeout=5)
-                                except Exception:
-                                    self.container.kill()
-                                raise MemoryError(f"RAM limit exceeded: {usage_mb:.1f}MB")
-                            break
-                except Exception as e:
-                    logger.debug(f"Failed to get container stats for {self.evaluation_run.run_id}: {e}")
-                    pass  # Continue monitoring even if stats fail
-                
-                # Check runtime limit - use container start time as fallback
-                sandbox_start_time = self.evaluation_run.sandbox_created_at or container_start_time
-                runtime = (datetime.now(timezone.utc) - sandbox_start_time).total_seconds()
-                
-                if runtime > SANDBOX_MAX_RUNTIME:
-                    logger.error(f"Container {self.evaluation_run.run_id} exceeded runtime limit: {runtime:.1f}s")
-                    try:
-                        # Try graceful stop first, then force kill
-                        self.container.stop(timeout=5)
-                        logger.info(f"Successfully stopped container {self.evaluation_run.run_id}")
-                    except Exception as stop_error:
-                        logger.warning(f"Failed to stop container gracefully, force killing: {stop_error}")
-                        try:
-                            self.container.kill()
-                            logger.info(f"Successfully killed container {self.evaluation_run.run_id}")
-                        except Exception as kill_error:
-                            logger.error(f"Failed to kill container {self.evaluation_run.run_id}: {kill_error}")
-                    raise TimeoutError(f"Runtime limit exceeded: {runtime:.1f}s")
-                
-                # Log progress every 5 minutes for long-running containers
-                if runtime > 0 and runtime % 300 == 0:  # Every 5 minutes
-                    logger.info(f"Container {self.evaluation_run.run_id} still running after {runtime:.0f}s")
-                
-            except DockerNotFound:
-                # Container was auto-removed by Docker (remove=True) - evaluation completed
-                logger.info(f"Container {self.evaluation_run.run_id} was auto-removed, evaluation completed")
-                break
-            except (TimeoutError, MemoryError):
-                # Re-raise timeout and memory errors
-                raise
-            except Exception as e:
-                if "exited" in str(e).lower():
-                    logger.info(f"Container {self.evaluation_run.run_id} exited: {e}")
-                    break
-                logger.warning(f"Container monitoring error for {self.evaluation_run.run_id}: {e}")
-            
-            await asyncio.sleep(1)
+                    await run_blocking(self.container.kill)
+                    logger.info(f"Successfully killed container {self.evaluation_run.run_id}")
+                except Exception as kill_error:
+                    logger.error(f"Failed to kill container {self.evaluation_run.run_id}: {kill_error}")
+            raise TimeoutError(f"Runtime limit exceeded: {runtime:.1f}s")
+        finally:
+            monitor.unwatch(self.container.id)
+    
+    async def _container_exited(self) -> bool:
+        try:
+            await run_blocking(self.container.reload)
+        except DockerNotFound:
+            # Container was auto-removed by Docker (auto_remove=True) - evaluation completed
+            return True
+        return self.container.status in ["exited", "dead", "removing"]
     
+    def _stop_container(self) -> None:
+        """Stop the container gracefully, killing it if that fails (blocking operation)"""
+        try:
+            self.container.stop(timeout=5)
+        except Exception:
+            self.container.kill()
     
     @tracer.wrap(resource="evaluate-patch")
     async def _evaluate_patch(self) -> None:
         """Evaluate patch using SWE-bench"""
         # Check if patch applies
-        patch_error = self._check_patch_applies()
+        patch_error = await run_blocking(self._check_patch_applies)
         if patch_error:
             logger.error(f"Patch application failed: {patch_error}")
             self.evaluation_run.error = f"Patch failed to apply: {patch_error}"
@@ -392,7 +331,7 @@ class Sandbox:
             return
         
         # Run SWE-bench evaluation
-        await asyncio.get_event_loop().run_in_executor(None, self._run_swebench_evaluation)
+        await self._run_swebench_evaluation()
     
     @tracer.wrap(resource="check-if-patch-applies")
     def _check_patch_applies(self) -> Optional[str]:
@@ -431,32 +370,21 @@ class Sandbox:
             patch_path.unlink(missing_ok=True)
     
     @tracer.wrap(resource="run-swebench-evaluation")
-    def _run_swebench_evaluation(self) -> None:
-        """Run SWE-bench evaluation (blocking operation)"""
+    async def _run_swebench_evaluation(self) -> None:
+        """Run SWE-bench evaluation through the validator's grading scheduler"""
         instance_id = self.evaluation_run.swebench_instance_id
         
         try:
-            # Load instance and create prediction
-            instance = load_swebench_dataset("SWE-bench/SWE-bench_Verified", "test", [instance_id])[0]
+            # Create prediction
             prediction = {
                 "instance_id": instance_id,
                 "model_name_or_path": self.evaluation_run.run_id,
                 "model_patch": self.evaluation_run.response,
             }
-            test_spec = make_test_spec(instance)
+            test_spec = swebench_index.test_spec(instance_id)
             
-            # Build environment and run evaluation
-            build_env_images(self.manager.docker, [test_spec], max_workers=4)
-            result = run_instance(
-                test_spec=test_spec,
-                pred=prediction,
-                rm_image=False,
-                force_rebuild=False,
-                client=self.manager.docker,
-                run_id=self.evaluation_run.run_id,
-                timeout=1800,
-                rewrite_reports=False,
-            )
+            # Build environment (once across sandboxes) and run evaluation
+            result = await grading_scheduler.grade(test_spec, prediction, self.evaluation_run.run_id, self.manager.docker)
             
             # Process results
             if result:
@@ -490,11 +418,14 @@ class Sandbox:
     def cleanup(self) -> None:
         """Clean up sandbox resources"""
         # Sandbox container has --rm (remove=True) so it will be removed automatically
-        if self.repo_dir and self.repo_dir.exists():
+        if self.repo_dir:
             try:
-                shutil.rmtree(self.repo_dir, ignore_errors=True)
+                remove_workspace(self.repo_dir)
             except Exception:
                 pass
+        if self.snapshot_dir:
+            snapshot_cache.release(self.snapshot_dir)
+            self.snapshot_dir = None
     
     @tracer.wrap(resource="cancel-sandbox")
     async def cancel(self) -> None:
@@ -0,0 +1,214 @@
+"""Prepared repository snapshots: an instance's base commit with its test_patch committed.
+
+The prepared tree is identical for every agent evaluated on an instance, so it
+is built once per (instance_id, base_commit, test_patch hash), validated, and
+then used read-only as the source of each run's working copy.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Optional
+
+from filelock import FileLock, Timeout
+
+from validator.sandbox.constants import REPO_SNAPSHOT_DIR, REPO_SNAPSHOT_MAX_BYTES
+from validator.sandbox.workspace import create_workspace
+from loggers.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class SnapshotCache:
+    """Size-bounded, least-recently-used cache of prepared snapshots.
+
+    Each snapshot directory has a sibling ``<name>.json`` manifest that is
+    written only once the snapshot has been built and validated; its mtime
+    records the last use. Snapshots in use by this process (an overlay
+    workspace keeps reading from its snapshot) are never evicted.
+    """
+
+    def __init__(self, root: Path = REPO_SNAPSHOT_DIR, max_bytes: int = REPO_SNAPSHOT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._in_use: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def snapshot_name(instance_id: str, base_commit: str, test_patch: str) -> str:
+        patch_hash = hashlib.sha256(test_patch.encode()).hexdigest()[:16]
+        return f"{instance_id}_{base_commit[:12]}_{patch_hash}"
+
+    def acquire(self, instance_id: str, base_path: Path, base_commit: str, test_patch: Optional[str]) -> Path:
+        """Path of the instance's snapshot, built from the base clone if needed (blocking operation).
+
+        The caller must release() it once the run's working copy no longer needs it.
+        """
+        name = self.snapshot_name(instance_id, base_commit, test_patch or "")
+        path = self.root / name
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        with FileLock(str(self.root / f"{name}.lock")):
+            manifest = self._read_manifest(name)
+            if manifest is None:
+                manifest = self._build(name, instance_id, base_path, base_commit, test_patch)
+            else:
+                logger.debug(f"Reusing prepared snapshot {name}")
+                os.utime(self.root / f"{name}.json")
+            with self._lock:
+                self._in_use[name] = self._in_use.get(name, 0) + 1
+
+        self._evict()
+        return path
+
+    def release(self, path: Path) -> None:
+        with self._lock:
+            count = self._in_use.get(path.name, 0) - 1
+            if count > 0:
+                self._in_use[path.name] = count
+            else:
+                self._in_use.pop(path.name, None)
+
+    def _read_manifest(self, name: str) -> Optional[dict]:
+        try:
+            manifest = json.loads((self.root / f"{name}.json").read_text())
+        except (OSError, ValueError):
+            return None
+        if not (self.root / name / ".git").exists():
+            return None
+        return manifest
+
+    def _build(self, name: str, instance_id: str, base_path: Path, base_commit: str, test_patch: Optional[str]) -> dict:
+        logger.info(f"Preparing snapshot {name}")
+        path = self.root / name
+        building = self.root / f".{name}.{uuid.uuid4().hex[:8]}"
+        try:
+            create_workspace(base_path, building, strategy="hardlink")
+            if test_patch:
+                self._commit_test_patch(building, instance_id, test_patch)
+            head = self._validate(building, base_commit, bool(test_patch))
+
+            shutil.rmtree(path, ignore_errors=True)
+            os.rename(building, path)
+        finally:
+            shutil.rmtree(building, ignore_errors=True)
+
+        manifest = {
+            "instance_id": instance_id,
+            "base_commit": base_commit,
+            "test_patch_sha256": hashlib.sha256((test_patch or "").encode()).hexdigest(),
+            "head": head,
+            "size_bytes": _unique_size(path),
+            "created_at": time.time(),
+        }
+        manifest_path = self.root / f"{name}.json"
+        partial = manifest_path.with_suffix(".json.tmp")
+        partial.write_text(json.dumps(manifest))
+        os.replace(partial, manifest_path)
+        return manifest
+
+    @staticmethod
+    def _commit_test_patch(path: Path, instance_id: str, test_patch: str) -> None:
+        proc = subprocess.run(
+            ["git", "apply", "--verbose", "--reject", "--unidiff-zero", "-"],
+            cwd=path,
+            input=test_patch,
+            text=True,
+            capture_output=True,
+        )
+        if proc.returncode != 0:
+            logger.error(
+                "Failed to apply test_patch for %s: %s %s",
+                instance_id,
+                proc.stdout,
+                proc.stderr,
+            )
+            # Fail early – a sandbox should not continue with an incomplete test suite
+            raise RuntimeError(
+                f"Failed to apply test_patch for {instance_id}. See logs for details."
+            )
+        logger.info("Successfully applied test_patch for %s", instance_id)
+        subprocess.run(["git", "add", "-A"], cwd=path, check=True)
+        subprocess.run([
+            "git",
+            "-c",
+            "user.email=tao@localhost",
+            "-c",
+            "user.name=Tao God",
+            "commit",
+            "-m",
+            "updates",
+        ], cwd=path, check=True, capture_output=True)
+        logger.info("Committed test_patch for %s", instance_id)
+
+    @staticmethod
+    def _validate(path: Path, base_commit: str, patched: bool) -> str:
+        """Check the snapshot is a clean tree one commit (or none) past the base commit; returns its HEAD"""
+        def git(*args: str) -> str:
+            return subprocess.run(["git", *args], cwd=path, check=True, capture_output=True, text=True).stdout.strip()
+
+        head = git("rev-parse", "HEAD")
+        expected_base = git("rev-parse", "HEAD~1") if patched else head
+        if not expected_base.startswith(base_commit) and not base_commit.startswith(expected_base):
+            raise RuntimeError(f"Snapshot at {path} is based on {expected_base}, expected {base_commit}")
+        if git("status", "--porcelain", "--untracked-files=no"):
+            raise RuntimeError(f"Snapshot at {path} has uncommitted changes")
+        return head
+
+    def _evict(self) -> None:
+        """Remove least recently used snapshots until the cache fits in max_bytes"""
+        entries = []
+        for manifest_path in self.root.glob("*.json"):
+            try:
+                size = json.loads(manifest_path.read_text()).get("size_bytes", 0)
+                entries.append((manifest_path.stat().st_mtime, manifest_path.stem, size))
+            except (OSError, ValueError):
+                continue
+        total = sum(size for _, _, size in entries)
+        for _, name, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            lock = FileLock(str(self.root / f"{name}.lock"))
+            try:
+                lock.acquire(timeout=0)
+            except Timeout:
+                continue
+            try:
+                # Checked under the snapshot's lock, which acquire() holds while it takes a reference
+                with self._lock:
+                    if name in self._in_use:
+                        continue
+                logger.info(f"Evicting prepared snapshot {name}")
+                (self.root / f"{name}.json").unlink(missing_ok=True)
+                shutil.rmtree(self.root / name, ignore_errors=True)
+                total -= size
+            finally:
+                lock.release()
+
+
+def _unique_size(path: Path) -> int:
+    """Bytes that removing path would free: files not hard-linked from anywhere else.
+
+    Snapshots are hard-linked clones of the base clone in REPO_CACHE_DIR, so
+    their git objects are shared with it and not counted.
+    """
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                stat = os.lstat(os.path.join(dirpath, filename))
+            except OSError:
+                continue
+            if stat.st_nlink == 1:
+                total += stat.st_size
+    return total
+
+
+# Global snapshot cache
+snapshot_cache = SnapshotCache()
@@ -0,0 +1,150 @@
+"""Per-run repository working copies made from the repository cache.
+
+Strategies, cheapest first:
+
+- reflink: ``cp --reflink=always``; files share blocks with the cache until
+  written (btrfs, XFS, bcachefs, ...).
+- overlay: an overlayfs mount with the cache as the read-only lower layer and
+  a per-run upper layer that receives every write. Needs root.
+- hardlink: ``git clone --local``; git objects are hard-linked to the cache
+  and only the checkout is written. A sandbox that rewrites an object file in
+  place would change the cache too, so this is never picked automatically.
+- copy: a full copy of the cache.
+
+Every strategy produces a self-contained directory, which matters because a
+sandbox mounts only its own working copy: ``git worktree`` and
+``git clone --shared`` would leave the container's git pointing at a cache it
+cannot see. "auto" probes the host once and uses the cheapest of reflink,
+overlay and copy that works.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional
+
+from validator.sandbox.constants import REPO_CACHE_DIR, REPOS_BASE_DIR, SANDBOX_WORKSPACE_STRATEGY
+from loggers.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+STRATEGIES = ("reflink", "overlay", "hardlink", "copy")
+AUTO_STRATEGIES = ("reflink", "overlay", "copy")
+
+# Upper and work directories of overlay workspaces, one subdirectory per working copy
+OVERLAY_DIR = REPOS_BASE_DIR / ".overlay"
+
+_auto_strategy: Optional[str] = None
+_lock = threading.Lock()
+
+
+def workspace_strategy() -> str:
+    """The configured strategy, or the cheapest one the host supports for "auto" """
+    global _auto_strategy
+    if SANDBOX_WORKSPACE_STRATEGY != "auto":
+        if SANDBOX_WORKSPACE_STRATEGY not in STRATEGIES:
+            raise ValueError(f"Unknown SANDBOX_WORKSPACE_STRATEGY {SANDBOX_WORKSPACE_STRATEGY!r}")
+        return SANDBOX_WORKSPACE_STRATEGY
+    with _lock:
+        if _auto_strategy is None:
+            probes = {"reflink": _supports_reflink, "overlay": _supports_overlay}
+            _auto_strategy = next(s for s in AUTO_STRATEGIES if s not in probes or probes[s]())
+            logger.info(f"Using {_auto_strategy} repository workspaces")
+        return _auto_strategy
+
+
+def create_workspace(cache_path: Path, repo_path: Path, strategy: Optional[str] = None) -> str:
+    """Create repo_path as a working copy of cache_path, replacing any existing one; returns the strategy used"""
+    remove_workspace(repo_path)
+    repo_path.parent.mkdir(parents=True, exist_ok=True)
+    strategy = strategy or workspace_strategy()
+    try:
+        if strategy == "reflink":
+            _run(["cp", "-a", "--reflink=always", str(cache_path), str(repo_path)])
+        elif strategy == "overlay":
+            _create_overlay(cache_path, repo_path)
+        elif strategy == "hardlink":
+            _create_hardlink_clone(cache_path, repo_path)
+        else:
+            shutil.copytree(cache_path, repo_path)
+        return strategy
+    except (OSError, subprocess.CalledProcessError) as e:
+        if strategy == "copy":
+            raise
+        logger.warning(f"Failed to create {strategy} workspace at {repo_path}, copying instead: {e}")
+        remove_workspace(repo_path)
+        shutil.copytree(cache_path, repo_path)
+        return "copy"
+
+
+def remove_workspace(repo_path: Path) -> None:
+    """Remove a working copy made by any strategy"""
+    if os.path.ismount(repo_path):
+        subprocess.run(["umount", str(repo_path)], capture_output=True)
+    shutil.rmtree(OVERLAY_DIR / repo_path.name, ignore_errors=True)
+    if repo_path.exists():
+        shutil.rmtree(repo_path, ignore_errors=True)
+
+
+def _run(args) -> None:
+    subprocess.run(args, check=True, capture_output=True, text=True)
+
+
+def _create_overlay(cache_path: Path, repo_path: Path) -> None:
+    layers = OVERLAY_DIR / repo_path.name
+    upper, work = layers / "upper", layers / "work"
+    for path in (upper, work, repo_path):
+        path.mkdir(parents=True, exist_ok=True)
+    _run(_overlay_mount_args(cache_path, upper, work, repo_path))
+
+
+def _overlay_mount_args(lower: Path, upper: Path, work: Path, target: Path):
+    return [
+        "mount", "-t", "overlay", "overlay",
+        "-o", f"lowerdir={lower},upperdir={upper},workdir={work}",
+        str(target),
+    ]
+
+
+def _create_hardlink_clone(cache_path: Path, repo_path: Path) -> None:
+    commit = subprocess.run(
+        ["git", "rev-parse", "HEAD"], cwd=cache_path, check=True, capture_output=True, text=True
+    ).stdout.strip()
+    _run(["git", "clone", "--local", "--no-checkout", "--quiet", str(cache_path), str(repo_path)])
+    _run(["git", "-C", str(repo_path), "checkout", "--quiet", "--detach", commit])
+    # Keep origin pointing where the cache's does, as a plain copy would
+    origin = subprocess.run(["git", "remote", "get-url", "origin"], cwd=cache_path, capture_output=True, text=True)
+    if origin.returncode == 0:
+        _run(["git", "-C", str(repo_path), "remote", "set-url", "origin", origin.stdout.strip()])
+
+
+def _supports_reflink() -> bool:
+    """Whether files in the cache can be reflinked into the working copy directory"""
+    REPO_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    REPOS_BASE_DIR.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=REPO_CACHE_DIR) as source_dir, \
+            tempfile.TemporaryDirectory(dir=REPOS_BASE_DIR) as target_dir:
+        source = Path(source_dir) / "probe"
+        source.write_bytes(b"\0" * 4096)
+        probe = ["cp", "--reflink=always", str(source), str(Path(target_dir) / "probe")]
+        return subprocess.run(probe, capture_output=True).returncode == 0
+
+
+def _supports_overlay() -> bool:
+    """Whether we can mount an overlay over the cache with its writable layers next to the working copies"""
+    if not hasattr(os, "geteuid") or os.geteuid() != 0:
+        return False
+    REPO_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    REPOS_BASE_DIR.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=REPO_CACHE_DIR) as lower, \
+            tempfile.TemporaryDirectory(dir=REPOS_BASE_DIR) as layers:
+        upper, work, target = (Path(layers) / name for name in ("upper", "work", "target"))
+        for path in (upper, work, target):
+            path.mkdir()
+        if subprocess.run(_overlay_mount_args(Path(lower), upper, work, target), capture_output=True).returncode != 0:
+            return False
+        subprocess.run(["umount", str(target)], capture_output=True)
+        return True
@@ -9,12 +9,13 @@ from typing import TYPE_CHECKING, List
 from ddtrace import tracer
 
 import httpx
-from swebench.harness.utils import load_swebench_dataset
 
 from validator.config import RIDGES_API_URL, SCREENER_MODE, validator_hotkey
+from validator.sandbox.executor import run_blocking
 from validator.sandbox.manager import SandboxManager
 from validator.sandbox.schema import AgentVersion, EvaluationRun, SwebenchProblem
 from validator.sandbox.constants import AGENTS_BASE_DIR
+from validator.utils.swebench_index import swebench_index
 from loggers.logging_utils import get_logger
 
 if TYPE_CHECKING:
@@ -28,13 +29,18 @@ async def run_evaluation(websocket_app: "WebsocketApp", evaluation_id: str, agen
     """Run evaluation for a specific agent version"""
     logger.info(f"Starting evaluation {evaluation_id} for agent {agent_version.miner_hotkey}")
 
-    sandbox_manager = SandboxManager(websocket_app)
+    # Connecting to Docker and starting the proxy container block, so keep them off the loop
+    sandbox_manager = await run_blocking(SandboxManager, websocket_app)
     errored = False
 
     try:
         # Download agent code
         agent_dir = AGENTS_BASE_DIR / agent_version.miner_hotkey / str(agent_version.version_num)
         agent_dir.mkdir(parents=True, exist_ok=True)
+        
+        # Pull images and create the sandbox containers while the agent and problems load
+        sandbox_manager.prewarm_sandboxes(evaluation_runs, agent_dir)
+        
         agent_file = agent_dir / "agent.py"
         async with httpx.AsyncClient(timeout=300) as client:
             logger.info(f"Downloading agent code for version {agent_version.version_id}")
@@ -48,16 +54,9 @@ async def run_evaluation(websocket_app: "WebsocketApp", evaluation_id: str, agen
         
         # Get problems for the evaluation runs
         instance_ids = [evaluation_run.swebench_instance_id for evaluation_run in evaluation_runs]
-        instances = load_swebench_dataset("SWE-bench/SWE-bench_Verified", "test", instance_ids)
-        problems = {
-            instance["instance_id"]: SwebenchProblem(
-                instance_id=instance["instance_id"],
-                problem_statement=instance["problem_statement"],
-                repo=instance["repo"],
-                base_commit=instance["base_commit"],
-            )
-            for instance in instances
-        }
+        # The first lookup loads the dataset index, which blocks
+        await run_blocking(swebench_index.instances, instance_ids)
+        problems = {instance_id: swebench_index.problem(instance_id) for instance_id in instance_ids}
 
         for evaluation_run in evaluation_runs:
             problem = problems[evaluation_run.swebench_instance_id]
@@ -69,4 +68,4 @@ async def run_evaluation(websocket_app: "WebsocketApp", evaluation_id: str, agen
         logger.error(f"Error during evaluation: {e}", exc_info=True)
         errored = True
     finally:
-        sandbox_manager.cleanup(force_cancel=errored)
+        await sandbox_manager.cleanup(force_cancel=errored)
@@ -2,8 +2,9 @@
 
 from typing import List
 import httpx
-from swebench.harness.run_evaluation import load_swebench_dataset
+from validator.sandbox.executor import run_blocking
 from validator.sandbox.schema import SwebenchProblem
+from validator.utils.swebench_index import swebench_index
 from validator.config import RIDGES_API_URL, SCREENER_MODE
 from loggers.logging_utils import get_logger
 
@@ -13,14 +14,9 @@ async def get_swebench_problems(evaluation_id: str) -> List[SwebenchProblem]:
     """Get evaluation runs for an agent version"""
     try:
         instance_ids = await get_evaluation_set_instances(evaluation_id)
-        instances = load_swebench_dataset("SWE-bench/SWE-bench_Verified", "test", instance_ids)
-        
-        problems = [SwebenchProblem(
-            instance_id=instance["instance_id"],
-            problem_statement=instance["problem_statement"],
-            repo=instance["repo"],
-            base_commit=instance["base_commit"],
-        ) for instance in instances]
+        # The first lookup loads the dataset index, which blocks
+        await run_blocking(swebench_index.instances, instance_ids)
+        problems = [swebench_index.problem(instance_id) for instance_id in instance_ids]
         
         logger.info(f"Generated {len(problems)} problems for evaluation {evaluation_id}")
         return problems
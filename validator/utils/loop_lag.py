@@ -0,0 +1,86 @@
+"""Event loop lag monitoring for the validator."""
+
+import asyncio
+from typing import Dict, List, Optional
+
+from ddtrace import tracer
+
+from loggers.logging_utils import get_logger
+from validator.config import LOOP_LAG_CHECK_INTERVAL, LOOP_LAG_REPORT_FREQUENCY, LOOP_LAG_WARN_THRESHOLD
+from validator.sandbox.capacity import host_capacity
+from validator.sandbox.executor import executor_stats
+from validator.sandbox.grading import grading_scheduler
+
+logger = get_logger(__name__)
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from a fixed sleep.
+
+    Anything blocking the loop (a synchronous Docker or git call, a large file
+    copy) delays every coroutine, including websocket heartbeats and status
+    updates; the delay shows up here as lag. Lags above the warning threshold
+    are logged as they happen, and a summary with the sandbox thread pool's
+    and the grading scheduler's backlogs and the host's admission state is
+    logged periodically.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_CHECK_INTERVAL, warn_threshold: float = LOOP_LAG_WARN_THRESHOLD,
+                 report_seconds: float = LOOP_LAG_REPORT_FREQUENCY.total_seconds()):
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self.report_seconds = report_seconds
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._window: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_report = loop.time() + self.report_seconds
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            now = loop.time()
+            self._record(max(0.0, now - expected))
+            if now >= next_report:
+                self._report()
+                next_report = now + self.report_seconds
+
+    def _record(self, lag: float) -> None:
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self._window.append(lag)
+        if lag > self.warn_threshold:
+            logger.warning(f"Event loop blocked for {lag:.3f}s; sandbox pool: {executor_stats()}")
+
+    def stats(self) -> Dict[str, float]:
+        window = sorted(self._window)
+        return {
+            "last_seconds": round(self.last_lag, 4),
+            "max_seconds": round(self.max_lag, 4),
+            "window_p50_seconds": round(window[len(window) // 2], 4) if window else 0.0,
+            "window_p99_seconds": round(window[min(len(window) - 1, int(len(window) * 0.99))], 4) if window else 0.0,
+            "window_max_seconds": round(window[-1], 4) if window else 0.0,
+        }
+
+    @tracer.wrap(resource="report-loop-lag")
+    def _report(self) -> None:
+        stats = self.stats()
+        span = tracer.current_span()
+        if span is not None:
+            for key, value in stats.items():
+                span.set_metric(f"loop_lag.{key}", value)
+        logger.info(
+            f"Event loop lag: {stats}; sandbox pool: {executor_stats()}; grading: {grading_scheduler.stats()}; "
+            f"host capacity: {host_capacity.state()}"
+        )
+        self._window.clear()
+
+
+# Global loop lag monitor
+loop_lag_monitor = LoopLagMonitor()
@@ -0,0 +1,129 @@
+"""Process-wide index of the SWE-bench dataset by instance_id."""
+
+import os
+import pickle
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from swebench.harness.run_evaluation import load_swebench_dataset, make_test_spec
+from swebench.harness.test_spec.test_spec import TestSpec
+
+from validator.sandbox.constants import SWEBENCH_DATASET_NAME, SWEBENCH_DATASET_SPLIT, SWEBENCH_INDEX_CACHE_DIR
+from validator.sandbox.schema import SwebenchProblem
+from loggers.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class SwebenchIndex:
+    """Lazily loaded instance_id -> instance index of a SWE-bench dataset.
+
+    The dataset is read and filtered once per process instead of at every
+    call site. The index is also pickled to disk, keyed by the dataset's Hub
+    revision, so a restarted validator loads it without going through the
+    datasets library at all; if the revision can't be looked up (offline),
+    the newest cached index is used.
+    """
+
+    def __init__(self, name: str = SWEBENCH_DATASET_NAME, split: str = SWEBENCH_DATASET_SPLIT,
+                 cache_dir: Path = SWEBENCH_INDEX_CACHE_DIR):
+        self.name = name
+        self.split = split
+        self.cache_dir = cache_dir
+        self._instances: Optional[Dict[str, dict]] = None
+        self._test_specs: Dict[str, TestSpec] = {}
+        self._lock = threading.Lock()
+
+    def instance(self, instance_id: str) -> dict:
+        """The raw dataset instance, as load_swebench_dataset returns it (blocking on first use)"""
+        return self.instances([instance_id])[0]
+
+    def instances(self, instance_ids: List[str]) -> List[dict]:
+        """Instances in the order of instance_ids; raises ValueError if any is missing (blocking on first use)"""
+        index = self._index()
+        missing = [instance_id for instance_id in instance_ids if instance_id not in index]
+        if missing:
+            raise ValueError(f"Some instance IDs not found in dataset!\nMissing IDs:\n{' '.join(missing)}")
+        return [index[instance_id] for instance_id in instance_ids]
+
+    def problem(self, instance_id: str) -> SwebenchProblem:
+        instance = self.instance(instance_id)
+        return SwebenchProblem(
+            instance_id=instance["instance_id"],
+            problem_statement=instance["problem_statement"],
+            repo=instance["repo"],
+            base_commit=instance["base_commit"],
+        )
+
+    def test_spec(self, instance_id: str) -> TestSpec:
+        """The SWE-bench test spec of an instance, built once (blocking on first use)"""
+        test_spec = self._test_specs.get(instance_id)
+        if test_spec is None:
+            test_spec = make_test_spec(self.instance(instance_id))
+            self._test_specs[instance_id] = test_spec
+        return test_spec
+
+    def _index(self) -> Dict[str, dict]:
+        if self._instances is None:
+            with self._lock:
+                if self._instances is None:
+                    self._instances = self._load()
+        return self._instances
+
+    def _cache_prefix(self) -> str:
+        return f"{self.name.replace('/', '__')}-{self.split}-"
+
+    def _load(self) -> Dict[str, dict]:
+        revision = self._revision()
+        cache_path = self._cached_index(revision)
+        if cache_path is not None:
+            try:
+                with open(cache_path, "rb") as f:
+                    instances = pickle.load(f)
+                logger.info(f"Loaded {len(instances)} {self.name} instances from {cache_path}")
+                return instances
+            except (OSError, pickle.UnpicklingError, EOFError) as e:
+                logger.warning(f"Ignoring unreadable SWE-bench index cache {cache_path}: {e}")
+
+        instances = {instance["instance_id"]: dict(instance) for instance in load_swebench_dataset(self.name, self.split)}
+        logger.info(f"Loaded {len(instances)} {self.name} instances from the dataset")
+        if revision is not None:
+            self._store(instances, revision)
+        return instances
+
+    def _revision(self) -> Optional[str]:
+        """Current Hub revision of the dataset, or None if it can't be looked up"""
+        try:
+            from huggingface_hub import HfApi
+
+            return HfApi().dataset_info(self.name, timeout=10).sha
+        except Exception as e:
+            logger.warning(f"Could not look up the revision of {self.name}: {e}")
+            return None
+
+    def _cached_index(self, revision: Optional[str]) -> Optional[Path]:
+        if revision is not None:
+            path = self.cache_dir / f"{self._cache_prefix()}{revision}.pkl"
+            return path if path.exists() else None
+        cached = sorted(self.cache_dir.glob(f"{self._cache_prefix()}*.pkl"), key=lambda path: path.stat().st_mtime)
+        return cached[-1] if cached else None
+
+    def _store(self, instances: Dict[str, dict], revision: str) -> None:
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            path = self.cache_dir / f"{self._cache_prefix()}{revision}.pkl"
+            partial = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(partial, "wb") as f:
+                pickle.dump(instances, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(partial, path)
+            # Indexes of older revisions are never read again
+            for stale in self.cache_dir.glob(f"{self._cache_prefix()}*.pkl"):
+                if stale != path:
+                    stale.unlink(missing_ok=True)
+        except OSError as e:
+            logger.warning(f"Could not cache the SWE-bench index: {e}")
+
+
+# Global SWE-bench dataset index
+swebench_index = SwebenchIndex()